@@ -0,0 +1,6 @@
+"""
+EFFITECH - Benchmarks del backend
+
+Se ejecutan desde el directorio backend, p. ej.:
+    python -m benchmarks.bench_serialization
+"""
@@ -0,0 +1,250 @@
+"""
+Benchmark de la API a nivel de petición.
+
+Ejecuta `server.app` en el mismo proceso a través de un cliente ASGI (httpx),
+sin red ni servidor uvicorn, contra un sustituto local de MongoDB:
+mongomock-motor por defecto, o un mongod local con --mongo-url.
+
+Escenarios:
+    login           POST /api/auth/login
+    auth_me         GET  /api/auth/me
+    list_panels_N   GET  /api/panels?limit=100 con N paneles en la colección
+    ingestion       POST /api/external/panel-data (lotes de lecturas)
+
+Por escenario se mide throughput (peticiones/s) y latencias p50/p95/p99.
+Los resultados se guardan en JSON (por defecto test_reports/benchmark_api.json)
+junto con el commit actual, para comparar entre commits.
+
+Uso (desde backend/):
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks.bench_api [--panels 1000,10000] [--requests 200]
+    python -m benchmarks.bench_api --mongo-url mongodb://localhost:27017
+
+mongomock evalúa las consultas en Python y de forma síncrona: los números
+sirven para comparar commits entre sí, no como estimación de producción, y
+cada consulta recorre la colección completa. Por eso con mongomock el tamaño
+por defecto llega a 10k paneles; con un mongod local (--mongo-url) llega a
+100k. Se trabaja sobre la base de datos effitech_benchmark, que se vacía al
+empezar y al terminar.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from typing import Awaitable, Callable, List
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_OUTPUT = BACKEND_DIR.parent / "test_reports" / "benchmark_api.json"
+BENCHMARK_DB = "effitech_benchmark"
+BENCHMARK_PASSWORD = "benchmark123"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongo-url', help="mongod local; sin este parámetro se usa mongomock-motor")
+    parser.add_argument('--panels', help="Tamaños de la colección de paneles (por defecto 1000,10000 con mongomock y 1000,10000,100000 con mongod)")
+    parser.add_argument('--requests', type=int, default=200, help="Peticiones por escenario")
+    parser.add_argument('--login-requests', type=int, default=50, help="Peticiones de login (bcrypt domina su coste)")
+    parser.add_argument('--concurrency', type=int, default=10, help="Peticiones simultáneas")
+    parser.add_argument('--batch-size', type=int, default=100, help="Lecturas por petición de ingesta")
+    parser.add_argument('--output', type=Path, default=DEFAULT_OUTPUT)
+    return parser.parse_args()
+
+
+args = parse_args()
+
+# server.py lee la configuración al importarse
+os.environ['MONGO_URL'] = args.mongo_url or 'mongodb://localhost:27017'
+os.environ['DB_NAME'] = BENCHMARK_DB
+os.environ.setdefault('EXTERNAL_APP_API_KEY', 'effitech-benchmark-key')
+sys.path.insert(0, str(BACKEND_DIR))
+
+import httpx  # noqa: E402
+
+import server  # noqa: E402
+
+
+def use_mongo_stand_in() -> str:
+    """Sustituir el cliente de server por mongomock-motor si no hay --mongo-url"""
+    if args.mongo_url:
+        return "mongod"
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        sys.exit("mongomock-motor no está instalado: pip install -r benchmarks/requirements.txt (o use --mongo-url)")
+    server.client = AsyncMongoMockClient()
+    server.db = server.analytics_db = server.ingest_db = server.client[BENCHMARK_DB]
+    return "mongomock"
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Percentil por el método del rango más cercano"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+async def run_scenario(name: str, total: int, concurrency: int, make_request: Callable[[int], Awaitable[httpx.Response]]) -> dict:
+    """Lanzar `total` peticiones con `concurrency` workers y resumir latencias"""
+    latencies: List[float] = []
+    errors = 0
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index, errors
+        while next_index < total:
+            i = next_index
+            next_index += 1
+            start = time.perf_counter()
+            response = await make_request(i)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, total)))))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    result = {
+        "requests": total,
+        "errors": errors,
+        "concurrency": concurrency,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+    print(f"{name:<22} {result['throughput_rps']:>9.1f} req/s  "
+          f"p50 {result['p50_ms']:>8.2f} ms  p95 {result['p95_ms']:>8.2f} ms  p99 {result['p99_ms']:>8.2f} ms"
+          f"{f'  ({errors} errores)' if errors else ''}")
+    return result
+
+
+async def seed_admin() -> dict:
+    """Usuario admin con contraseña conocida"""
+    user = server.User(email="bench-admin@effitech.com", full_name="Benchmark Admin", role="admin")
+    user_doc = user.model_dump()
+    user_doc['password'] = server.get_password_hash(BENCHMARK_PASSWORD)
+    await server.db.users.insert_one(user_doc)
+    return user_doc
+
+
+async def seed_panels(target: int, existing: int, owner_id: str) -> None:
+    """Completar la colección de paneles hasta `target` documentos"""
+    base = datetime.now(timezone.utc)
+    chunk = 5000
+    for start in range(existing, target, chunk):
+        docs = [
+            {
+                "id": str(uuid.uuid4()),
+                "model": f"Modelo {i}",
+                "location": f"Sitio {i % 50}",
+                "capacity": 3000.0,
+                "status": "activo",
+                "user_id": owner_id if i % 2 else None,
+                "user_name": "Benchmark Admin" if i % 2 else None,
+                "created_at": base - timedelta(seconds=i)
+            }
+            for i in range(start, min(start + chunk, target))
+        ]
+        await server.db.panels.insert_many(docs)
+
+
+async def main():
+    backend = use_mongo_stand_in()
+    await server.client.drop_database(BENCHMARK_DB)
+    await server.ensure_readings_collection()
+    await server.ensure_indexes()
+    server.reading_buffer.start()
+
+    panels = args.panels or ("1000,10000,100000" if backend == "mongod" else "1000,10000")
+    panel_sizes = sorted(int(size) for size in panels.split(",") if size)
+    results = {}
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        admin = await seed_admin()
+        credentials = {"email": admin['email'], "password": BENCHMARK_PASSWORD}
+        token = (await client.post("/api/auth/login", json=credentials)).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        print(f"Backend: {backend} | concurrencia {args.concurrency} | {args.requests} peticiones por escenario\n")
+
+        results["login"] = await run_scenario(
+            "login", args.login_requests, args.concurrency,
+            lambda i: client.post("/api/auth/login", json=credentials)
+        )
+        results["auth_me"] = await run_scenario(
+            "auth_me", args.requests, args.concurrency,
+            lambda i: client.get("/api/auth/me", headers=headers)
+        )
+
+        existing = 0
+        for size in panel_sizes:
+            await seed_panels(size, existing, admin['id'])
+            existing = size
+            results[f"list_panels_{size}"] = await run_scenario(
+                f"list_panels_{size}", args.requests, args.concurrency,
+                lambda i: client.get("/api/panels", params={"limit": 100}, headers=headers)
+            )
+
+        panel_ids = await server.db.panels.distinct("id", {"user_id": admin['id']})
+        panel_ids = panel_ids[:1000] or [str(uuid.uuid4())]
+
+        def ingest(i: int):
+            now = datetime.now(timezone.utc).isoformat()
+            batch = [
+                {"panel_id": panel_ids[(i * args.batch_size + j) % len(panel_ids)], "production": 1.5, "temperature": 25.0, "consumption": 0.4, "timestamp": now}
+                for j in range(args.batch_size)
+            ]
+            return client.post("/api/external/panel-data", params={"api_key": server.EXTERNAL_APP_API_KEY}, json=batch)
+
+        results["ingestion"] = await run_scenario("ingestion", args.requests, args.concurrency, ingest)
+        results["ingestion"]["readings_per_request"] = args.batch_size
+
+        flush_started = time.perf_counter()
+        await server.reading_buffer.stop()
+        results["ingestion"]["final_flush_seconds"] = round(time.perf_counter() - flush_started, 3)
+
+    await server.client.drop_database(BENCHMARK_DB)
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    report = {
+        "commit": commit or None,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "mongo_backend": backend,
+        "parameters": {
+            "requests": args.requests,
+            "login_requests": args.login_requests,
+            "concurrency": args.concurrency,
+            "panel_sizes": panel_sizes,
+            "ingestion_batch_size": args.batch_size,
+        },
+        "results": results,
+    }
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(report, indent=2, ensure_ascii=False) + "\n")
+    print(f"\nResultados guardados en {args.output}")
+
+
+if __name__ == '__main__':
+    # httpx registra cada petición en INFO y taparía los resultados
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    asyncio.run(main())
@@ -0,0 +1,67 @@
+"""
+Benchmark del coste de bcrypt.
+
+Mide, para cada número de rondas, la latencia de generar un hash y de
+verificar una contraseña (lo que cuesta cada login) en un solo núcleo, y
+estima cuántos logins por segundo admite el pool de hashing
+(PASSWORD_HASH_WORKERS). Sirve para elegir BCRYPT_ROUNDS según la CPU
+disponible; los hashes existentes se actualizan al nuevo coste en el
+siguiente login de cada usuario.
+
+Uso (desde backend/):
+    python -m benchmarks.bench_password_hash [--rounds 10,11,12,13] [--samples 10]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+from passlib.context import CryptContext
+
+# server.py lee la configuración al importarse; no se abre ninguna conexión
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'effitech_benchmark')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import server  # noqa: E402
+
+PASSWORD = "contraseña-de-prueba-123"
+
+
+def measure(func, samples: int) -> List[float]:
+    """Latencias en milisegundos"""
+    latencies = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', default="10,11,12,13", help="Costes a medir, separados por comas")
+    parser.add_argument('--samples', type=int, default=10, help="Mediciones por coste y operación")
+    args = parser.parse_args()
+
+    workers = server.PASSWORD_HASH_WORKERS
+    print(f"Coste actual (BCRYPT_ROUNDS): {server.BCRYPT_ROUNDS} | workers del pool: {workers}\n")
+    print(f"{'rondas':>6}  {'hash p50':>10}  {'verify p50':>10}  {'verify max':>10}  {'logins/s (pool)':>15}")
+
+    for rounds in sorted(int(r) for r in args.rounds.split(",") if r):
+        context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=rounds)
+        hashed = context.hash(PASSWORD)
+        hash_ms = measure(lambda: context.hash(PASSWORD), args.samples)
+        verify_ms = measure(lambda: context.verify(PASSWORD, hashed), args.samples)
+        verify_p50 = statistics.median(verify_ms)
+        marker = "  <- actual" if rounds == server.BCRYPT_ROUNDS else ""
+        print(f"{rounds:>6}  {statistics.median(hash_ms):>8.1f}ms  {verify_p50:>8.1f}ms  "
+              f"{max(verify_ms):>8.1f}ms  {workers * 1000 / verify_p50:>15.1f}{marker}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark de serialización de listados de paneles.
+
+Compara, por elemento, el camino anterior (PanelResponse construido a mano,
+revalidado por FastAPI contra response_model y codificado con json) con el
+actual (serialize_panel + ORJSONResponse sin validación adicional).
+
+Uso (desde backend/):
+    python -m benchmarks.bench_serialization [--items 1000] [--repeat 20]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List
+
+# server.py lee la configuración al importarse; no se abre ninguna conexión
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'effitech_benchmark')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import ORJSONResponse  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+
+import server  # noqa: E402
+
+
+def make_panels(n: int) -> List[dict]:
+    """Documentos de panel como los devuelve MongoDB"""
+    now = datetime.now(timezone.utc).isoformat()
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "model": f"Modelo {i}",
+            "location": f"Sitio {i % 50}",
+            "capacity": 3000.0,
+            "status": "activo",
+            "user_id": str(uuid.uuid4()) if i % 2 else None,
+            "user_name": "Usuario" if i % 2 else None,
+            "created_at": now
+        }
+        for i in range(n)
+    ]
+
+
+list_adapter = TypeAdapter(List[server.PanelResponse])
+
+
+def legacy_path(panels: List[dict]) -> bytes:
+    """Camino anterior: modelo por elemento + validación de response_model + json"""
+    result = []
+    for p in panels:
+        result.append(server.PanelResponse(
+            id=p['id'],
+            model=p['model'],
+            location=p['location'],
+            capacity=p['capacity'],
+            status=p.get('status', 'activo'),
+            user_id=p.get('user_id'),
+            user_name=p.get('user_name'),
+            created_at=p['created_at'] if isinstance(p['created_at'], str) else p['created_at'].isoformat()
+        ))
+    # Lo que hace FastAPI con un response_model: volcar, validar y codificar
+    content = [r.model_dump() for r in result]
+    validated = list_adapter.validate_python(content)
+    return json.dumps(jsonable_encoder(validated)).encode()
+
+
+def fast_path(panels: List[dict]) -> bytes:
+    """Camino actual: serialize_panel + ORJSONResponse"""
+    return ORJSONResponse(content=[server.serialize_panel(p) for p in panels]).body
+
+
+def measure(func, panels: List[dict], repeat: int) -> float:
+    """Mejor tiempo por elemento en microsegundos"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(panels)
+        best = min(best, time.perf_counter() - start)
+    return best / len(panels) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    panels = make_panels(args.items)
+    assert json.loads(legacy_path(panels)) == json.loads(fast_path(panels))
+
+    legacy_us = measure(legacy_path, panels, args.repeat)
+    fast_us = measure(fast_path, panels, args.repeat)
+
+    print(f"Paneles por listado: {args.items}")
+    print(f"Antes   (PanelResponse + response_model + json): {legacy_us:8.2f} µs/elemento")
+    print(f"Después (serialize_panel + orjson):              {fast_us:8.2f} µs/elemento")
+    print(f"Mejora: {legacy_us / fast_us:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
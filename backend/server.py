@@ -6,16 +6,37 @@ Autor: Equipo EFFITECH
 Versión: 2.0.0
 """
 
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, ReadPreference, ReturnDocument, UpdateOne, WriteConcern, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import Optional, List, Literal
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, ValidationError, field_validator
+from typing import Optional, List, Literal, Union, Dict, Callable, AsyncIterator, Tuple
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+import ast
+import asyncio
+import base64
+import hashlib
+import hmac
+import ipaddress
+import bisect
+import csv
+import io
+import json
+import math
+import re
+import orjson
+import secrets
+import threading
+import time
 import uuid
 from datetime import datetime, timezone, timedelta
 from passlib.context import CryptContext
@@ -27,24 +48,202 @@ ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # Conexión MongoDB
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+
+class MongoSettings(BaseModel):
+    """
+    Configuración del cliente de MongoDB leída de variables de entorno.
+
+    Los tiempos están en milisegundos. Los valores None no se pasan al cliente,
+    de modo que rigen las opciones de MONGO_URL o los valores por defecto del driver.
+    """
+    url: str
+    db_name: str
+    app_name: str = "effitech-api"
+    max_pool_size: Optional[int] = Field(None, ge=1)
+    min_pool_size: Optional[int] = Field(None, ge=0)
+    max_idle_time_ms: Optional[int] = Field(None, ge=0)
+    wait_queue_timeout_ms: Optional[int] = Field(None, ge=0)
+    server_selection_timeout_ms: Optional[int] = Field(None, ge=0)
+    connect_timeout_ms: Optional[int] = Field(None, ge=0)
+    socket_timeout_ms: Optional[int] = Field(None, ge=0)
+    retry_writes: Optional[bool] = None
+    # Preferencia de lectura general y la de las consultas de analítica/series (admiten réplicas)
+    read_preference: Optional[Literal["primary", "primaryPreferred", "secondary", "secondaryPreferred", "nearest"]] = None
+    analytics_read_preference: Optional[Literal["primary", "primaryPreferred", "secondary", "secondaryPreferred", "nearest"]] = None
+    # Write concern de la ingesta de lecturas (alto volumen, tolera perder el último lote)
+    ingest_write_w: Union[int, str] = 1
+    ingest_write_journal: bool = False
+
+    @field_validator('ingest_write_w')
+    @classmethod
+    def parse_write_w(cls, value: Union[int, str]) -> Union[int, str]:
+        """w numérico ("1") o con nombre ("majority")"""
+        return int(value) if isinstance(value, str) and value.isdigit() else value
+
+    @classmethod
+    def from_env(cls) -> "MongoSettings":
+        """Construir la configuración a partir de las variables definidas en el entorno"""
+        values = {field: os.environ[var] for field, var in MONGO_SETTINGS_ENV.items() if os.environ.get(var)}
+        return cls(**values)
+
+    def client_options(self) -> dict:
+        """Opciones explícitas para AsyncIOMotorClient"""
+        options = {
+            "appname": self.app_name,
+            "maxPoolSize": self.max_pool_size,
+            "minPoolSize": self.min_pool_size,
+            "maxIdleTimeMS": self.max_idle_time_ms,
+            "waitQueueTimeoutMS": self.wait_queue_timeout_ms,
+            "serverSelectionTimeoutMS": self.server_selection_timeout_ms,
+            "connectTimeoutMS": self.connect_timeout_ms,
+            "socketTimeoutMS": self.socket_timeout_ms,
+            "retryWrites": self.retry_writes,
+            "readPreference": self.read_preference,
+        }
+        return {k: v for k, v in options.items() if v is not None}
+
+# campo -> variable de entorno
+MONGO_SETTINGS_ENV = {
+    "url": "MONGO_URL",
+    "db_name": "DB_NAME",
+    "app_name": "MONGO_APP_NAME",
+    "max_pool_size": "MONGO_MAX_POOL_SIZE",
+    "min_pool_size": "MONGO_MIN_POOL_SIZE",
+    "max_idle_time_ms": "MONGO_MAX_IDLE_TIME_MS",
+    "wait_queue_timeout_ms": "MONGO_WAIT_QUEUE_TIMEOUT_MS",
+    "server_selection_timeout_ms": "MONGO_SERVER_SELECTION_TIMEOUT_MS",
+    "connect_timeout_ms": "MONGO_CONNECT_TIMEOUT_MS",
+    "socket_timeout_ms": "MONGO_SOCKET_TIMEOUT_MS",
+    "retry_writes": "MONGO_RETRY_WRITES",
+    "read_preference": "MONGO_READ_PREFERENCE",
+    "analytics_read_preference": "MONGO_ANALYTICS_READ_PREFERENCE",
+    "ingest_write_w": "MONGO_INGEST_WRITE_W",
+    "ingest_write_journal": "MONGO_INGEST_WRITE_JOURNAL",
+}
+
+mongo_settings = MongoSettings.from_env()
 
 # Configuración JWT
 SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'effitech-solar-energy-platform-secret-key-2025')
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 días
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get('ACCESS_TOKEN_EXPIRE_MINUTES', '15'))
+# Tokens de actualización rotativos (la sesión dura lo mismo que antes el token de acceso)
+REFRESH_TOKEN_EXPIRE_DAYS = float(os.environ.get('REFRESH_TOKEN_EXPIRE_DAYS', '7'))
+# Margen en el que un token recién rotado se acepta de nuevo (varias pestañas renovando a la vez)
+REFRESH_TOKEN_REUSE_GRACE_SECONDS = float(os.environ.get('REFRESH_TOKEN_REUSE_GRACE_SECONDS', '10'))
+
+# Tabla de revocación de tokens (cambios de rol y usuarios eliminados)
+TOKEN_REVOCATION_REFRESH_SECONDS = float(os.environ.get('TOKEN_REVOCATION_REFRESH_SECONDS', '5'))
+
+# ETags de listados: cada cuánto se recogen las versiones escritas por otros workers
+COLLECTION_VERSION_REFRESH_SECONDS = float(os.environ.get('COLLECTION_VERSION_REFRESH_SECONDS', '1'))
+
+# Caché de usuarios autenticados
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', '60'))
+USER_CACHE_MAX_SIZE = int(os.environ.get('USER_CACHE_MAX_SIZE', '10000'))
 
 # Seguridad de contraseñas
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Coste de bcrypt (2^rounds iteraciones). Los hashes con otro coste se rehacen al iniciar sesión;
+# ver benchmarks/bench_password_hash.py para elegirlo según la CPU disponible.
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS
+)
 security = HTTPBearer()
 
+# Pool de hashing de contraseñas (bcrypt fuera del event loop)
+PASSWORD_HASH_EXECUTOR = os.environ.get('PASSWORD_HASH_EXECUTOR', 'thread')  # "thread" o "process"
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_QUEUE = int(os.environ.get('PASSWORD_HASH_MAX_QUEUE', '64'))
+
+# Límite de intentos de login y registro (token bucket por IP y por correo).
+# Los contadores viven en la memoria de cada worker: con N workers de uvicorn
+# el límite efectivo llega a N veces el configurado.
+AUTH_RATE_LIMIT_IP_PER_MINUTE = float(os.environ.get('AUTH_RATE_LIMIT_IP_PER_MINUTE', '120'))
+AUTH_RATE_LIMIT_IP_BURST = int(os.environ.get('AUTH_RATE_LIMIT_IP_BURST', '60'))
+# Por correo solo cuentan los intentos fallidos
+AUTH_RATE_LIMIT_EMAIL_PER_MINUTE = float(os.environ.get('AUTH_RATE_LIMIT_EMAIL_PER_MINUTE', '2'))
+AUTH_RATE_LIMIT_EMAIL_BURST = int(os.environ.get('AUTH_RATE_LIMIT_EMAIL_BURST', '10'))
+AUTH_RATE_LIMIT_MAX_KEYS = int(os.environ.get('AUTH_RATE_LIMIT_MAX_KEYS', '100000'))
+# Proxies (IPs o redes CIDR, separadas por comas) cuyo X-Forwarded-For se acepta
+# para identificar al cliente; sin proxies de confianza se usa la IP de la conexión
+AUTH_RATE_LIMIT_TRUSTED_PROXIES = [
+    ipaddress.ip_network(value.strip(), strict=False)
+    for value in os.environ.get('AUTH_RATE_LIMIT_TRUSTED_PROXIES', '').split(',')
+    if value.strip()
+]
+
+# Ingesta de telemetría desde la app externa (sin API key configurada queda deshabilitada)
+EXTERNAL_APP_API_KEY = os.environ.get('EXTERNAL_APP_API_KEY', '')
+INGEST_BUFFER_MAX_SIZE = int(os.environ.get('INGEST_BUFFER_MAX_SIZE', '50000'))
+INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', '1000'))
+INGEST_FLUSH_INTERVAL_SECONDS = float(os.environ.get('INGEST_FLUSH_INTERVAL_SECONDS', '1.0'))
+
+# Caché panel -> propietario/capacidad usada durante la ingesta
+PANEL_DIRECTORY_TTL_SECONDS = float(os.environ.get('PANEL_DIRECTORY_TTL_SECONDS', '300'))
+
+# Importación y exportación masiva de paneles
+PANEL_BULK_CHUNK_SIZE = int(os.environ.get('PANEL_BULK_CHUNK_SIZE', '500'))
+PANEL_BULK_MAX_ERRORS = int(os.environ.get('PANEL_BULK_MAX_ERRORS', '1000'))
+PANEL_BULK_MAX_LINE_BYTES = int(os.environ.get('PANEL_BULK_MAX_LINE_BYTES', str(64 * 1024)))
+PANEL_EXPORT_BATCH_SIZE = int(os.environ.get('PANEL_EXPORT_BATCH_SIZE', '1000'))
+
+# Feed en tiempo real por WebSocket
+ENERGY_WS_PUSH_INTERVAL_SECONDS = float(os.environ.get('ENERGY_WS_PUSH_INTERVAL_SECONDS', '1.0'))
+ENERGY_WS_SEND_TIMEOUT_SECONDS = float(os.environ.get('ENERGY_WS_SEND_TIMEOUT_SECONDS', '5.0'))
+
+# Resumen de analítica: máximo de períodos por respuesta (los más recientes)
+ANALYTICS_MAX_PERIODS = int(os.environ.get('ANALYTICS_MAX_PERIODS', '366'))
+
+# Motor de alertas
+ALERT_TICK_SECONDS = float(os.environ.get('ALERT_TICK_SECONDS', '1.0'))
+# Cada cuánto se buscan paneles sin lecturas recientes (offline)
+ALERT_OFFLINE_CHECK_SECONDS = float(os.environ.get('ALERT_OFFLINE_CHECK_SECONDS', '30'))
+ALERT_OFFLINE_CHECK_BATCH = int(os.environ.get('ALERT_OFFLINE_CHECK_BATCH', '1000'))
+ALERT_OFFLINE_DEFAULT_MINUTES = float(os.environ.get('ALERT_OFFLINE_DEFAULT_MINUTES', '15'))
+ALERT_CONFIG_REFRESH_SECONDS = float(os.environ.get('ALERT_CONFIG_REFRESH_SECONDS', '60'))
+
+# Fórmula CO2 por defecto (kg de CO2 evitados por kWh)
+CO2_DEFAULT_KG_PER_KWH = float(os.environ.get('CO2_DEFAULT_KG_PER_KWH', '0.6'))
+CO2_FORMULA_CACHE_TTL_SECONDS = float(os.environ.get('CO2_FORMULA_CACHE_TTL_SECONDS', '60'))
+# Límites de las fórmulas personalizadas (evitan árboles enormes o muy anidados)
+CO2_FORMULA_MAX_LENGTH = int(os.environ.get('CO2_FORMULA_MAX_LENGTH', '500'))
+CO2_FORMULA_MAX_VARIABLES = int(os.environ.get('CO2_FORMULA_MAX_VARIABLES', '20'))
+
+# Retención de lecturas crudas (0 = sin expiración); los agregados se conservan siempre
+READINGS_RETENTION_DAYS = int(os.environ.get('READINGS_RETENTION_DAYS', '0'))
+
+# Sondas de salud: ping a MongoDB en segundo plano
+HEALTH_PING_INTERVAL_SECONDS = float(os.environ.get('HEALTH_PING_INTERVAL_SECONDS', '5'))
+HEALTH_PING_TIMEOUT_SECONDS = float(os.environ.get('HEALTH_PING_TIMEOUT_SECONDS', '2'))
+HEALTH_MAX_PING_AGE_SECONDS = float(os.environ.get('HEALTH_MAX_PING_AGE_SECONDS', '15'))
+
+# Métricas Prometheus (segundos)
+METRICS_LATENCY_BUCKETS = tuple(
+    float(b) for b in os.environ.get('METRICS_LATENCY_BUCKETS', '0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10').split(',')
+)
+
+# Migración de created_at (cadenas ISO antiguas) a fechas BSON nativas
+DATE_MIGRATION_BATCH_SIZE = int(os.environ.get('DATE_MIGRATION_BATCH_SIZE', '500'))
+DATE_MIGRATION_PAUSE_SECONDS = float(os.environ.get('DATE_MIGRATION_PAUSE_SECONDS', '0.1'))
+
 # Crear aplicación
 app = FastAPI(
     title="EFFITECH API",
     description="Sistema de Gestión de Energía Solar",
-    version="2.0.0"
+    version="2.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Router con prefijo /api
@@ -58,6 +257,247 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+# ==================== MÉTRICAS ====================
+
+# Registro de métricas en memoria expuesto en /api/metrics (formato de texto de Prometheus).
+# Cada observación es una búsqueda binaria del bucket y unas sumas bajo un lock
+# (los eventos de Mongo llegan desde los hilos de Motor). Las etiquetas usan la
+# plantilla de la ruta, no la URL, para mantener acotada la cardinalidad.
+
+def _format_labels(labelnames: Tuple[str, ...], labels: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+class Counter:
+    """Contador monótono con etiquetas"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: tuple = (), amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, labels: tuple = ()) -> float:
+        return self._values.get(labels, 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(v)}" for labels, v in values]
+
+class Gauge(Counter):
+    """Valor instantáneo que sube y baja"""
+    kind = "gauge"
+
+    def dec(self, labels: tuple = (), amount: float = 1.0) -> None:
+        self.inc(labels, -amount)
+
+class Histogram:
+    """Histograma de buckets acumulativos con etiquetas"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = METRICS_LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # etiquetas -> [conteos por bucket (el último es +Inf), suma, total]
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, labels: tuple = ()) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            snapshot = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        lines = []
+        for labels, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == math.inf else _format_value(bound)
+                bucket_labels = _format_labels(self.labelnames, labels, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {repr(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+class MetricsRegistry:
+    """Conjunto de métricas publicadas en /metrics"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+HTTP_REQUESTS = metrics.register(Counter(
+    "http_requests_total", "Peticiones HTTP atendidas", ("method", "route", "status")))
+HTTP_LATENCY = metrics.register(Histogram(
+    "http_request_duration_seconds", "Latencia de las peticiones HTTP", ("method", "route")))
+HTTP_IN_FLIGHT = metrics.register(Gauge(
+    "http_requests_in_flight", "Peticiones HTTP en curso"))
+MONGO_LATENCY = metrics.register(Histogram(
+    "mongodb_command_duration_seconds", "Duración de los comandos de MongoDB", ("command", "outcome")))
+AUTH_LATENCY = metrics.register(Histogram(
+    "auth_operation_duration_seconds", "Duración de operaciones JWT y bcrypt", ("operation",)))
+MONGO_POOL_CONNECTIONS = metrics.register(Gauge(
+    "mongodb_pool_connections", "Conexiones abiertas en el pool de MongoDB"))
+MONGO_POOL_CHECKED_OUT = metrics.register(Gauge(
+    "mongodb_pool_checked_out", "Conexiones del pool de MongoDB en uso"))
+AUTH_RATE_LIMITED = metrics.register(Counter(
+    "auth_rate_limited_total", "Intentos de login o registro rechazados por límite", ("limiter",)))
+
+class MetricsMiddleware:
+    """Middleware ASGI que mide latencia, estado y peticiones en curso por ruta"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            HTTP_IN_FLIGHT.dec()
+            # FastAPI deja la ruta resuelta en el scope; sin ruta se agrupa como "unmatched"
+            route = getattr(scope.get("route"), "path", "unmatched")
+            method = scope["method"]
+            HTTP_LATENCY.observe(elapsed, (method, route))
+            HTTP_REQUESTS.inc((method, route, str(status_code)))
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Listener de monitorización de comandos de pymongo (usado por Motor)"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_LATENCY.observe(event.duration_micros / 1e6, (event.command_name, "success"))
+
+    def failed(self, event):
+        MONGO_LATENCY.observe(event.duration_micros / 1e6, (event.command_name, "failure"))
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """Listener del pool de conexiones: conexiones abiertas y en uso"""
+
+    def connection_created(self, event):
+        MONGO_POOL_CONNECTIONS.inc()
+
+    def connection_closed(self, event):
+        MONGO_POOL_CONNECTIONS.dec()
+
+    def connection_checked_out(self, event):
+        MONGO_POOL_CHECKED_OUT.inc()
+
+    def connection_checked_in(self, event):
+        MONGO_POOL_CHECKED_OUT.dec()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+
+# ==================== CONEXIÓN A MONGODB ====================
+
+client = AsyncIOMotorClient(
+    mongo_settings.url,
+    event_listeners=[MongoCommandMetrics(), MongoPoolMetrics()],
+    **mongo_settings.client_options()
+)
+db = client[mongo_settings.db_name]
+# Lecturas de analítica y series temporales (pueden ir a secundarios)
+analytics_db = client.get_database(
+    mongo_settings.db_name,
+    read_preference=READ_PREFERENCES.get(mongo_settings.analytics_read_preference)
+)
+# Escrituras de la ingesta de lecturas con su propio write concern
+ingest_db = client.get_database(
+    mongo_settings.db_name,
+    write_concern=WriteConcern(w=mongo_settings.ingest_write_w, j=mongo_settings.ingest_write_journal)
+)
+
+def describe_mongo_config() -> dict:
+    """Configuración efectiva del cliente (entorno + MONGO_URL + valores por defecto), sin credenciales"""
+    options = client.options
+    pool = options.pool_options
+    return {
+        "url": re.sub(r"//[^@/]+@", "//***@", mongo_settings.url),
+        "db_name": mongo_settings.db_name,
+        "max_pool_size": pool.max_pool_size,
+        "min_pool_size": pool.min_pool_size,
+        "max_idle_time_seconds": pool.max_idle_time_seconds,
+        "wait_queue_timeout_seconds": pool.wait_queue_timeout,
+        "server_selection_timeout_seconds": options.server_selection_timeout,
+        "connect_timeout_seconds": pool.connect_timeout,
+        "socket_timeout_seconds": pool.socket_timeout,
+        "retry_writes": options.retry_writes,
+        "read_preference": db.read_preference.name,
+        "analytics_read_preference": analytics_db.read_preference.name,
+        "ingest_write_concern": ingest_db.write_concern.document,
+    }
+
+
 # ==================== MODELOS DE DATOS ====================
 
 class UserCreate(BaseModel):
@@ -81,6 +521,14 @@ class User(BaseModel):
     role: Literal["admin", "user"] = "user"
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+    @field_validator('created_at')
+    @classmethod
+    def normalize_created_at(cls, value: datetime) -> datetime:
+        """Las fechas BSON se leen sin zona horaria; siempre están en UTC"""
+        if value.tzinfo is None:
+            return value.replace(tzinfo=timezone.utc)
+        return value
+
 class UserResponse(BaseModel):
     """Modelo de respuesta de usuario para listados"""
     id: str
@@ -94,6 +542,22 @@ class Token(BaseModel):
     access_token: str
     token_type: str
     user: User
+    refresh_token: Optional[str] = None
+    expires_in: int = ACCESS_TOKEN_EXPIRE_MINUTES * 60
+
+class RefreshRequest(BaseModel):
+    """Modelo para renovar el token de acceso o cerrar la sesión"""
+    refresh_token: str = Field(..., min_length=1)
+
+class TokenClaims(BaseModel):
+    """Identidad verificada a partir del JWT, sin consultar la base de datos"""
+    id: str
+    role: str
+    token_version: int = 0
+
+class UpdateProfile(BaseModel):
+    """Modelo para actualizar el perfil del usuario actual"""
+    full_name: str = Field(..., min_length=1)
 
 class UpdateUserRole(BaseModel):
     """Modelo para actualizar rol de usuario"""
@@ -125,6 +589,7 @@ class Panel(BaseModel):
     capacity: float
     status: Literal["activo", "inactivo", "mantenimiento"] = "activo"
     user_id: Optional[str] = None
+    user_name: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class PanelResponse(BaseModel):
@@ -138,6 +603,426 @@ class PanelResponse(BaseModel):
     user_name: Optional[str] = None
     created_at: str
 
+class PanelBulkError(BaseModel):
+    """Error de una fila en la importación masiva"""
+    row: int
+    error: str
+
+class PanelBulkResult(BaseModel):
+    """Resumen de una importación masiva de paneles"""
+    inserted: int
+    failed: int
+    errors: List[PanelBulkError]
+    errors_truncated: bool = False
+
+class PanelBulkFilter(BaseModel):
+    """Criterios para seleccionar paneles en una operación masiva"""
+    status: Optional[Literal["activo", "inactivo", "mantenimiento"]] = None
+    location: Optional[str] = None
+    user_id: Optional[str] = None
+
+class PanelBulkOperation(BaseModel):
+    """Operación masiva sobre paneles seleccionados por id o por filtro"""
+    action: Literal["assign", "unassign", "status"]
+    panel_ids: Optional[List[str]] = Field(None, min_length=1, max_length=10000)
+    filter: Optional[PanelBulkFilter] = None
+    user_id: Optional[str] = None
+    status: Optional[Literal["activo", "inactivo", "mantenimiento"]] = None
+
+class PanelBulkOperationResult(BaseModel):
+    """Resumen de una operación masiva sobre paneles"""
+    action: str
+    matched: int
+    modified: int
+    not_found: List[str] = []
+
+
+# ==================== CACHÉ DE USUARIOS ====================
+
+class UserCache:
+    """
+    Caché LRU en memoria con expiración (TTL) para usuarios autenticados.
+
+    Evita consultar MongoDB en cada petición autenticada. Las entradas se
+    indexan por el `sub` del JWT y guardan la versión de token (`ver`) con la
+    que se cargaron: un token con otra versión (p. ej. emitido tras un cambio
+    de rol en otro worker) no usa la entrada. Deben invalidarse cuando el
+    usuario cambia.
+    """
+
+    def __init__(self, ttl_seconds: float, max_size: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, tuple[float, int, User]]" = OrderedDict()
+
+    def get(self, user_id: str, token_version: int = 0) -> Optional[User]:
+        """Obtener usuario de la caché si existe, no ha expirado y es de la misma versión de token"""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, cached_version, user = entry
+        if expires_at < time.monotonic() or cached_version != token_version:
+            del self._entries[user_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        return user
+
+    def set(self, user_id: str, user: User, token_version: int = 0) -> None:
+        """Guardar usuario en la caché, desalojando el menos usado si está llena"""
+        if self.max_size <= 0 or self.ttl_seconds <= 0:
+            return
+        self._entries[user_id] = (time.monotonic() + self.ttl_seconds, token_version, user)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, user_id: str) -> None:
+        """Eliminar un usuario de la caché"""
+        self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        """Vaciar la caché completa"""
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        """Estadísticas de uso de la caché"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0
+        }
+
+user_cache = UserCache(USER_CACHE_TTL_SECONDS, USER_CACHE_MAX_SIZE)
+
+
+# ==================== REVOCACIÓN DE TOKENS ====================
+
+class TokenRevocations:
+    """
+    Versión mínima de token aceptada por usuario, en memoria.
+
+    Los tokens llevan rol y versión (`ver`), así que las rutas de lectura se
+    autorizan sin consultar MongoDB; esta tabla es lo único que se comprueba.
+    Solo contiene usuarios cuyo rol cambió o que fueron eliminados. Cada entrada
+    se guarda en `token_revocations` con expiración igual a la vida del token
+    (pasado ese tiempo ningún token anterior sigue vigente) y la tabla se recarga
+    periódicamente para recoger los cambios hechos por otros workers.
+    """
+
+    def __init__(self, refresh_interval: float, retention: timedelta):
+        self.refresh_interval = refresh_interval
+        self.retention = retention
+        self.loaded_at: Optional[float] = None
+        self._min_versions: Dict[str, int] = {}
+        self._deleted: set = set()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def is_revoked(self, user_id: str, version: int) -> bool:
+        """Token de un usuario eliminado o anterior a su último cambio de rol"""
+        return user_id in self._deleted or version < self._min_versions.get(user_id, 0)
+
+    async def _store(self, user_id: str, min_version: int, deleted: bool) -> None:
+        await db.token_revocations.update_one(
+            {"user_id": user_id},
+            {"$set": {
+                "min_version": min_version,
+                "deleted": deleted,
+                "expires_at": datetime.now(timezone.utc) + self.retention
+            }},
+            upsert=True
+        )
+
+    async def revoke_before(self, user_id: str, version: int) -> None:
+        """Invalidar los tokens del usuario con versión menor que `version`"""
+        await self._store(user_id, version, False)
+        self._min_versions[user_id] = max(version, self._min_versions.get(user_id, 0))
+
+    async def revoke_user(self, user_id: str) -> None:
+        """Invalidar todos los tokens de un usuario eliminado"""
+        await self._store(user_id, 0, True)
+        self._deleted.add(user_id)
+
+    async def load(self) -> None:
+        """Recargar la tabla con las entradas vigentes"""
+        min_versions: Dict[str, int] = {}
+        deleted = set()
+        cursor = db.token_revocations.find(
+            {"expires_at": {"$gt": datetime.now(timezone.utc)}},
+            {"_id": 0, "user_id": 1, "min_version": 1, "deleted": 1}
+        )
+        async for doc in cursor:
+            if doc.get('deleted'):
+                deleted.add(doc['user_id'])
+            else:
+                min_versions[doc['user_id']] = doc.get('min_version', 0)
+        self._min_versions = min_versions
+        self._deleted = deleted
+        self.loaded_at = time.monotonic()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.load()
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo recargar la tabla de revocación de tokens: {e!r}")
+
+    def start(self) -> None:
+        """Iniciar la recarga periódica"""
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Detener la recarga periódica"""
+        if self._task is not None:
+            self._stopping = True
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        """Tamaño de la tabla y antigüedad de la última recarga"""
+        return {
+            "revoked_versions": len(self._min_versions),
+            "deleted_users": len(self._deleted),
+            "age_seconds": round(time.monotonic() - self.loaded_at, 2) if self.loaded_at is not None else None
+        }
+
+token_revocations = TokenRevocations(TOKEN_REVOCATION_REFRESH_SECONDS, timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+
+
+# ==================== LÍMITE DE INTENTOS DE AUTENTICACIÓN ====================
+
+class TokenBucketLimiter:
+    """
+    Token bucket por clave (IP o correo) en memoria.
+
+    Cada clave guarda solo (tokens, instante de la última recarga). Al superar
+    `max_keys` se desaloja la clave usada hace más tiempo, que en la práctica
+    ya habría recuperado el cubo completo. El estado es local al proceso: cada
+    worker aplica el límite por separado.
+    """
+
+    def __init__(self, name: str, rate_per_minute: float, burst: int, max_keys: int):
+        self.name = name
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.max_keys = max_keys
+        self.rejected = 0
+        self.evictions = 0
+        self._buckets: "OrderedDict[str, tuple[float, float]]" = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0 and self.burst > 0
+
+    def _tokens(self, key: str, now: float) -> float:
+        entry = self._buckets.get(key)
+        if entry is None:
+            return float(self.burst)
+        tokens, updated_at = entry
+        return min(float(self.burst), tokens + (now - updated_at) * self.rate)
+
+    def _store(self, key: str, tokens: float, now: float) -> None:
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+            self.evictions += 1
+
+    def _reject(self, tokens: float) -> float:
+        self.rejected += 1
+        AUTH_RATE_LIMITED.inc((self.name,))
+        return (1 - tokens) / self.rate
+
+    def acquire(self, key: str) -> float:
+        """Consumir un intento: 0 si se permite, o segundos hasta el siguiente disponible"""
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic()
+        tokens = self._tokens(key, now)
+        if tokens < 1:
+            return self._reject(tokens)
+        self._store(key, tokens - 1, now)
+        return 0.0
+
+    def check(self, key: str) -> float:
+        """Como `acquire`, pero sin consumir: el intento se cobra después con `consume`"""
+        if not self.enabled:
+            return 0.0
+        tokens = self._tokens(key, time.monotonic())
+        return self._reject(tokens) if tokens < 1 else 0.0
+
+    def consume(self, key: str) -> None:
+        """Descontar un intento ya realizado (p. ej. una contraseña incorrecta)"""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        self._store(key, max(0.0, self._tokens(key, now) - 1), now)
+
+    def stats(self) -> dict:
+        """Configuración y uso del limitador"""
+        return {
+            "rate_per_minute": round(self.rate * 60, 2),
+            "burst": self.burst,
+            "keys": len(self._buckets),
+            "max_keys": self.max_keys,
+            "rejected": self.rejected,
+            "evictions": self.evictions
+        }
+
+auth_ip_limiter = TokenBucketLimiter("ip", AUTH_RATE_LIMIT_IP_PER_MINUTE, AUTH_RATE_LIMIT_IP_BURST, AUTH_RATE_LIMIT_MAX_KEYS)
+auth_email_limiter = TokenBucketLimiter("email", AUTH_RATE_LIMIT_EMAIL_PER_MINUTE, AUTH_RATE_LIMIT_EMAIL_BURST, AUTH_RATE_LIMIT_MAX_KEYS)
+
+def rate_limit_email_key(email: str) -> str:
+    """Clave del limitador por correo (sin distinguir mayúsculas)"""
+    return email.strip().lower()
+
+def is_trusted_proxy(address: str) -> bool:
+    """Indicar si una dirección pertenece a AUTH_RATE_LIMIT_TRUSTED_PROXIES"""
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in AUTH_RATE_LIMIT_TRUSTED_PROXIES)
+
+def rate_limit_client_ip(request: Request) -> str:
+    """
+    IP del cliente para el limitador.
+
+    Si la conexión llega desde un proxy de confianza, se recorre X-Forwarded-For
+    de derecha a izquierda saltando los proxies de confianza; la primera
+    dirección restante es el cliente. Las entradas a su izquierda las escribe
+    el propio cliente y no se usan.
+    """
+    peer = request.client.host if request.client else "desconocida"
+    if not is_trusted_proxy(peer):
+        return peer
+    forwarded = [
+        address.strip()
+        for header in request.headers.getlist("x-forwarded-for")
+        for address in header.split(",")
+        if address.strip()
+    ]
+    for address in reversed(forwarded):
+        if not is_trusted_proxy(address):
+            return address
+    return forwarded[0] if forwarded else peer
+
+def enforce_auth_rate_limit(request: Request, email: str) -> None:
+    """
+    Rechazar con 429 los intentos que superan el límite por IP o por correo
+    
+    Se llama antes de cualquier consulta a MongoDB o verificación bcrypt. Cada
+    intento cuenta para la IP; para el correo solo cuentan los fallidos, que se
+    registran con `record_auth_failure`.
+    """
+    client_ip = rate_limit_client_ip(request)
+    retry_after = auth_ip_limiter.acquire(client_ip) or auth_email_limiter.check(rate_limit_email_key(email))
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Demasiados intentos, intente de nuevo más tarde",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+
+def record_auth_failure(email: str) -> None:
+    """Cobrar un intento fallido al límite del correo"""
+    auth_email_limiter.consume(rate_limit_email_key(email))
+
+
+# ==================== MODELOS DE TELEMETRÍA ====================
+
+class PanelReading(BaseModel):
+    """Lectura de un panel enviada por la app externa"""
+    panel_id: str
+    production: float
+    temperature: Optional[float] = None
+    consumption: Optional[float] = None
+    timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+    @field_validator('timestamp')
+    @classmethod
+    def normalize_timestamp(cls, value: datetime) -> datetime:
+        """Normalizar a UTC (fechas sin zona horaria se consideran UTC)"""
+        if value.tzinfo is None:
+            return value.replace(tzinfo=timezone.utc)
+        return value.astimezone(timezone.utc)
+
+class RollupPoint(BaseModel):
+    """Punto agregado de producción y temperatura de un panel"""
+    bucket: str
+    count: int
+    production_sum: float
+    production_min: float
+    production_max: float
+    production_avg: float
+    temperature_min: Optional[float] = None
+    temperature_max: Optional[float] = None
+    temperature_avg: Optional[float] = None
+
+class AlertConfig(BaseModel):
+    """Configuración de una alerta del usuario"""
+    alert_type: Literal["low_production", "high_temperature", "offline"]
+    threshold_value: float = Field(..., ge=0, description="Umbral (kWh, °C o minutos sin datos para offline; 0 = valor por defecto)")
+    enabled: bool = True
+
+class AlertResponse(BaseModel):
+    """Modelo de respuesta de alerta"""
+    alert_id: str
+    user_id: str
+    panel_id: str
+    alert_type: str
+    message: str
+    timestamp: str
+    read: bool
+
+class CO2Formula(BaseModel):
+    """Fórmula personalizada de CO2 evitado"""
+    formula_variables: Dict[str, float] = Field(default_factory=dict, max_length=CO2_FORMULA_MAX_VARIABLES)
+    expression: Optional[str] = Field(
+        None,
+        max_length=CO2_FORMULA_MAX_LENGTH,
+        description="Expresión con total_kwh y las variables (por defecto, total_kwh multiplicado por todas las variables)"
+    )
+
+class CO2Result(BaseModel):
+    """Resultado del cálculo de CO2 evitado"""
+    total_production_kwh: float
+    co2_avoided_kg: float
+    co2_avoided_tons: float
+
+class AnalyticsPeriod(BaseModel):
+    """Indicadores energéticos de un período"""
+    period: str
+    production: float
+    consumption: float
+    savings: float
+    efficiency: float
+
+class AnalyticsSummary(BaseModel):
+    """Resumen de analítica por períodos"""
+    granularity: str
+    periods: List[AnalyticsPeriod]
+    totals: AnalyticsPeriod
+
 
 # ==================== FUNCIONES DE SEGURIDAD ====================
 
@@ -149,6 +1034,97 @@ def get_password_hash(password: str) -> str:
     """Generar hash de contraseña"""
     return pwd_context.hash(password)
 
+class PasswordHasher:
+    """
+    Ejecuta bcrypt en un pool de workers acotado para no bloquear el event loop.
+
+    Si la cola de espera supera `max_queue`, las nuevas peticiones se rechazan
+    con 503 en lugar de acumularse (degradación controlada ante ráfagas de login).
+    """
+
+    def __init__(self, kind: str, workers: int, max_queue: int):
+        self.kind = kind
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.pending = 0
+        self.peak_queued = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+        self._executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pwd-hash")
+        return self._executor
+
+    async def _run(self, operation: str, func, *args):
+        if self.pending >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Servidor ocupado, intente de nuevo en unos segundos",
+                headers={"Retry-After": "1"}
+            )
+        self.pending += 1
+        self.peak_queued = max(self.peak_queued, self.pending - self.workers)
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.pending -= 1
+            self.completed += 1
+            self.total_seconds += elapsed
+            AUTH_LATENCY.observe(elapsed, (operation,))
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """Verificar contraseña en el pool"""
+        return await self._run("bcrypt_verify", verify_password, plain_password, hashed_password)
+
+    async def hash(self, password: str) -> str:
+        """Generar hash de contraseña en el pool"""
+        return await self._run("bcrypt_hash", get_password_hash, password)
+
+    def shutdown(self) -> None:
+        """Liberar los workers del pool"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def stats(self) -> dict:
+        """Métricas de uso del pool"""
+        return {
+            "executor": self.kind,
+            "bcrypt_rounds": BCRYPT_ROUNDS,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": min(self.pending, self.workers),
+            "queued": max(0, self.pending - self.workers),
+            "peak_queued": self.peak_queued,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_latency_ms": round(self.total_seconds / self.completed * 1000, 2) if self.completed else 0.0
+        }
+
+password_hasher = PasswordHasher(PASSWORD_HASH_EXECUTOR, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE)
+
+async def rehash_password(user_id: str, plain_password: str, old_hash: str) -> None:
+    """Rehacer el hash con el coste actual tras un login correcto"""
+    try:
+        new_hash = await password_hasher.hash(plain_password)
+    except HTTPException:
+        # Pool saturado: se reintentará en el próximo inicio de sesión
+        return
+    # Solo si la contraseña no cambió mientras tanto
+    result = await db.users.update_one({"id": user_id, "password": old_hash}, {"$set": {"password": new_hash}})
+    if result.modified_count:
+        logger.info(f"🔑 Hash de contraseña del usuario {user_id} actualizado a {BCRYPT_ROUNDS} rondas")
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Crear token JWT"""
     to_encode = data.copy()
@@ -157,14 +1133,17 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
+    start = time.perf_counter()
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    AUTH_LATENCY.observe(time.perf_counter() - start, ("jwt_encode",))
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
-    """Obtener usuario actual del token JWT"""
-    token = credentials.credentials
+def decode_access_token(token: str) -> dict:
+    """Verificar firma, expiración y revocación de un token JWT"""
+    start = time.perf_counter()
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        AUTH_LATENCY.observe(time.perf_counter() - start, ("jwt_decode",))
         user_id: str = payload.get("sub")
         if user_id is None:
             raise HTTPException(
@@ -176,12 +1155,31 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="El token ha expirado"
         )
-    except jwt.JWTError:
+    except jwt.InvalidTokenError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="No se pudo validar las credenciales"
         )
     
+    # Los tokens sin versión son anteriores a cualquier cambio de rol
+    if token_revocations.is_revoked(user_id, payload.get("ver", 0)):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="El token ha sido revocado, inicie sesión de nuevo"
+        )
+    return payload
+
+async def get_user_from_token(token: str) -> User:
+    """Validar un token JWT y obtener su usuario"""
+    payload = decode_access_token(token)
+    return await load_token_user(payload["sub"], payload.get("ver", 0))
+
+async def load_token_user(user_id: str, token_version: int = 0) -> User:
+    """Usuario del `sub` de un token ya verificado (caché o base de datos)"""
+    cached_user = user_cache.get(user_id, token_version)
+    if cached_user is not None:
+        return cached_user
+    
     user_doc = await db.users.find_one({"id": user_id}, {"_id": 0, "password": 0})
     if user_doc is None:
         raise HTTPException(
@@ -189,15 +1187,17 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             detail="Usuario no encontrado"
         )
     
-    # Convertir timestamp ISO a datetime
-    if isinstance(user_doc['created_at'], str):
-        user_doc['created_at'] = datetime.fromisoformat(user_doc['created_at'])
-    
     # Asegurar que tenga rol (compatibilidad con usuarios antiguos)
     if 'role' not in user_doc:
         user_doc['role'] = 'user'
     
-    return User(**user_doc)
+    user = User(**user_doc)
+    user_cache.set(user_id, user, token_version)
+    return user
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
+    """Obtener usuario actual del token JWT"""
+    return await get_user_from_token(credentials.credentials)
 
 async def get_admin_user(current_user: User = Depends(get_current_user)) -> User:
     """Verificar que el usuario actual es administrador"""
@@ -208,81 +1208,582 @@ async def get_admin_user(current_user: User = Depends(get_current_user)) -> User
         )
     return current_user
 
-
-# ==================== RUTAS DE AUTENTICACIÓN ====================
-
-@api_router.post("/auth/register", response_model=Token, tags=["Autenticación"])
-async def register(user_data: UserCreate):
+async def get_token_claims(credentials: HTTPAuthorizationCredentials = Depends(security)) -> TokenClaims:
     """
-    Registrar un nuevo usuario
+    Identidad del token sin consultar la base de datos (rutas de solo lectura)
     
-    - **email**: Correo electrónico único
-    - **password**: Contraseña (mínimo 6 caracteres)
-    - **full_name**: Nombre completo del usuario
+    Los tokens emitidos antes de incluir el rol se resuelven con el usuario guardado.
     """
-    # Verificar si el usuario ya existe
-    existing_user = await db.users.find_one({"email": user_data.email})
-    if existing_user:
+    payload = decode_access_token(credentials.credentials)
+    if "role" not in payload:
+        user = await load_token_user(payload["sub"])
+        return TokenClaims(id=user.id, role=user.role)
+    return TokenClaims(id=payload["sub"], role=payload["role"], token_version=payload.get("ver", 0))
+
+async def get_admin_claims(claims: TokenClaims = Depends(get_token_claims)) -> TokenClaims:
+    """Verificar desde el token que el usuario es administrador"""
+    if claims.role != "admin":
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="El correo electrónico ya está registrado"
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="No tiene permisos de administrador"
         )
-    
-    # Verificar si es el primer usuario (será admin)
-    user_count = await db.users.count_documents({})
-    is_first_user = user_count == 0
-    
-    # Crear nuevo usuario
-    user = User(
-        email=user_data.email,
-        full_name=user_data.full_name,
-        role="admin" if is_first_user else "user"
-    )
-    
-    # Preparar documento para MongoDB
-    user_doc = user.model_dump()
-    user_doc['password'] = get_password_hash(user_data.password)
-    user_doc['created_at'] = user_doc['created_at'].isoformat()
-    
-    await db.users.insert_one(user_doc)
-    
-    # Crear token de acceso
-    access_token = create_access_token(data={"sub": user.id})
-    
-    logger.info(f"Nuevo usuario registrado: {user.email} (rol: {user.role})")
-    
-    return Token(
-        access_token=access_token,
-        token_type="bearer",
-        user=user
-    )
+    return claims
 
-@api_router.post("/auth/login", response_model=Token, tags=["Autenticación"])
-async def login(credentials: UserLogin):
+
+# ==================== TOKENS DE ACTUALIZACIÓN ====================
+
+# Los tokens de actualización son opacos: en `refresh_tokens` solo se guarda su hash.
+# Cada uso lo consume y emite otro de la misma familia (sesión); presentar uno ya
+# consumido indica que fue robado y revoca la familia completa.
+# El sucesor de un token se deriva de él con HMAC, así que si dos pestañas envían
+# el mismo token a la vez, la segunda (dentro de REFRESH_TOKEN_REUSE_GRACE_SECONDS)
+# recibe el mismo sucesor que la primera en lugar de revocar la sesión.
+
+def hash_refresh_token(refresh_token: str) -> str:
+    """Hash con el que se guarda y busca un token de actualización"""
+    return hashlib.sha256(refresh_token.encode()).hexdigest()
+
+def successor_refresh_token(refresh_token: str) -> str:
+    """Token que sustituye a `refresh_token` al rotarlo (siempre el mismo para el mismo token)"""
+    digest = hmac.new(SECRET_KEY.encode(), refresh_token.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode().rstrip("=")
+
+async def create_refresh_token(user_id: str, family_id: Optional[str] = None, refresh_token: Optional[str] = None) -> str:
+    """Emitir un token de actualización, en una sesión nueva o en la indicada"""
+    refresh_token = refresh_token or secrets.token_urlsafe(32)
+    now = datetime.now(timezone.utc)
+    await db.refresh_tokens.insert_one({
+        "token_hash": hash_refresh_token(refresh_token),
+        "user_id": user_id,
+        "family_id": family_id or str(uuid.uuid4()),
+        "created_at": now,
+        "expires_at": now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+        "used_at": None
+    })
+    return refresh_token
+
+async def issue_tokens(
+    user: User,
+    token_version: int,
+    family_id: Optional[str] = None,
+    refresh_token: Optional[str] = None,
+    store_refresh_token: bool = True
+) -> Token:
+    """Token de acceso corto más token de actualización para el usuario"""
+    access_token = create_access_token(data={"sub": user.id, "role": user.role, "ver": token_version})
+    if store_refresh_token:
+        refresh_token = await create_refresh_token(user.id, family_id, refresh_token)
+    return Token(access_token=access_token, token_type="bearer", user=user, refresh_token=refresh_token)
+
+async def rotate_refresh_token(refresh_token: str) -> Tuple[dict, bool]:
     """
-    Iniciar sesión
-    
-    - **email**: Correo electrónico
-    - **password**: Contraseña
+    Consumir un token de actualización y devolver su documento.
+
+    El segundo valor indica una repetición dentro del margen de gracia: el token
+    ya se rotó hace menos de REFRESH_TOKEN_REUSE_GRACE_SECONDS y su sucesor aún
+    no se ha usado, así que se responde con ese mismo sucesor.
     """
-    # Buscar usuario
-    user_doc = await db.users.find_one({"email": credentials.email})
-    if not user_doc:
+    token_hash = hash_refresh_token(refresh_token)
+    now = datetime.now(timezone.utc)
+    token_doc = await db.refresh_tokens.find_one_and_update(
+        {"token_hash": token_hash, "used_at": None, "expires_at": {"$gt": now}},
+        {"$set": {"used_at": now}}
+    )
+    if token_doc is None:
+        recent = await db.refresh_tokens.find_one({
+            "token_hash": token_hash,
+            "used_at": {"$gte": now - timedelta(seconds=REFRESH_TOKEN_REUSE_GRACE_SECONDS)}
+        })
+        if recent is not None:
+            successor = await db.refresh_tokens.find_one({
+                "token_hash": hash_refresh_token(successor_refresh_token(refresh_token)),
+                "used_at": None
+            })
+            if successor is not None:
+                return recent, True
+        reused = await db.refresh_tokens.find_one({"token_hash": token_hash, "used_at": {"$ne": None}})
+        if reused is not None:
+            await db.refresh_tokens.delete_many({"family_id": reused['family_id']})
+            logger.warning(f"⚠️ Reutilización de token de actualización del usuario {reused['user_id']}: sesión revocada")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Correo o contraseña incorrectos"
+            detail="Token de actualización inválido o expirado"
         )
-    
-    # Verificar contraseña
-    if not verify_password(credentials.password, user_doc['password']):
-        raise HTTPException(
+    return token_doc, False
+
+
+# ==================== PAGINACIÓN ====================
+
+# Paginación por cursor (keyset) sobre (created_at, id), del más reciente al más antiguo
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+PAGINATION_SORT = [("created_at", DESCENDING), ("id", DESCENDING)]
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(doc: dict) -> str:
+    """Generar cursor opaco a partir del último documento de la página"""
+    created_at = doc['created_at']
+    payload = {"i": doc['id']}
+    if isinstance(created_at, datetime):
+        payload.update({"c": created_at.isoformat(), "t": "d"})
+    else:
+        payload["c"] = created_at
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> dict:
+    """Convertir un cursor opaco en el filtro keyset de la página siguiente"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        if not isinstance(payload, dict):
+            raise ValueError("cursor no es un objeto")
+        last_id = payload["i"]
+        created_at = payload["c"]
+        # Solo cadenas: un objeto aquí inyectaría operadores en la consulta
+        if not isinstance(last_id, str) or not isinstance(created_at, str):
+            raise ValueError("valores de cursor inválidos")
+        is_date = payload.get("t") == "d"
+        if is_date:
+            created_at = datetime.fromisoformat(created_at)
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cursor de paginación inválido"
+        )
+    conditions = [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "id": {"$lt": last_id}}
+    ]
+    # Mientras la migración de fechas no termina, los documentos con created_at
+    # en cadena se ordenan después de todas las fechas BSON (orden de tipos de MongoDB)
+    if is_date:
+        conditions.append({"created_at": {"$type": "string"}})
+    return {"$or": conditions}
+
+def apply_created_range(query: dict, created_from: Optional[datetime], created_to: Optional[datetime]) -> dict:
+    """Añadir un rango [created_from, created_to) sobre created_at (fechas sin zona se toman como UTC)"""
+    bounds = {}
+    if created_from:
+        bounds["$gte"] = created_from if created_from.tzinfo else created_from.replace(tzinfo=timezone.utc)
+    if created_to:
+        bounds["$lt"] = created_to if created_to.tzinfo else created_to.replace(tzinfo=timezone.utc)
+    if bounds:
+        query['created_at'] = bounds
+    return query
+
+def apply_cursor(query: dict, cursor: Optional[str]) -> dict:
+    """Combinar el filtro de la consulta con el filtro keyset del cursor"""
+    if not cursor:
+        return query
+    cursor_filter = decode_cursor(cursor)
+    return {"$and": [query, cursor_filter]} if query else cursor_filter
+
+def finish_page(docs: List[dict], limit: int, response: Response) -> List[dict]:
+    """
+    Recortar la página (consultada con limit + 1) y publicar el cursor siguiente.
+
+    Si hay más resultados, el cursor de la página siguiente se envía en la cabecera X-Next-Cursor.
+    """
+    if len(docs) > limit:
+        docs = docs[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(docs[-1])
+    return docs
+
+async def fetch_page(collection, query: dict, projection: dict, limit: int, cursor: Optional[str], response: Response) -> List[dict]:
+    """Obtener una página de documentos ordenada por (created_at, id)"""
+    docs = await collection.find(apply_cursor(query, cursor), projection).sort(PAGINATION_SORT).limit(limit + 1).to_list(limit + 1)
+    return finish_page(docs, limit, response)
+
+
+# ==================== SERIALIZACIÓN ====================
+
+# Las respuestas se construyen como dicts listos para JSON. Las rutas de un solo
+# elemento dejan que FastAPI los valide una vez contra response_model; los
+# listados devuelven ORJSONResponse directamente y omiten esa validación.
+
+def serialize_date(value) -> str:
+    """
+    Fecha almacenada en formato ISO (UTC).
+
+    MongoDB devuelve las fechas BSON sin zona horaria; siempre están en UTC.
+    Las cadenas ISO solo aparecen en documentos aún no migrados.
+    """
+    if isinstance(value, str):
+        return value
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.isoformat()
+
+def serialize_panel(doc: dict) -> dict:
+    """Documento de panel en el formato de PanelResponse"""
+    return {
+        "id": doc['id'],
+        "model": doc['model'],
+        "location": doc['location'],
+        "capacity": doc['capacity'],
+        "status": doc.get('status', 'activo'),
+        "user_id": doc.get('user_id'),
+        "user_name": doc.get('user_name'),
+        "created_at": serialize_date(doc['created_at'])
+    }
+
+def serialize_user(doc: dict) -> dict:
+    """Documento de usuario en el formato de UserResponse"""
+    return {
+        "id": doc['id'],
+        "email": doc['email'],
+        "full_name": doc['full_name'],
+        "role": doc.get('role', 'user'),
+        "created_at": serialize_date(doc['created_at'])
+    }
+
+def list_response(items: List[dict], response: Response, etag: Optional[str] = None) -> ORJSONResponse:
+    """Respuesta de listado serializada con orjson, conservando el cursor de paginación"""
+    headers = {}
+    next_cursor = response.headers.get(NEXT_CURSOR_HEADER)
+    if next_cursor:
+        headers[NEXT_CURSOR_HEADER] = next_cursor
+    if etag:
+        headers.update(etag_headers(etag))
+    return ORJSONResponse(content=items, headers=headers)
+
+
+# ==================== VERSIONES DE COLECCIONES (ETAG) ====================
+
+class CollectionVersions:
+    """
+    Contador de versión por colección para construir ETags de los listados.
+
+    Toda escritura sobre la colección llama a `bump`, que incrementa el contador
+    en `collection_versions` y en memoria. Leer la versión no consulta MongoDB;
+    los incrementos de otros workers se recogen cada `refresh_interval`
+    segundos, que es lo máximo que otro worker puede responder 304 con datos
+    ya cambiados.
+    """
+
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self._versions: Dict[str, int] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def get(self, collection_name: str) -> int:
+        """Versión actual conocida por este worker"""
+        return self._versions.get(collection_name, 0)
+
+    async def bump(self, collection_name: str) -> None:
+        """Registrar una escritura en la colección"""
+        doc = await db.collection_versions.find_one_and_update(
+            {"_id": collection_name},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self._versions[collection_name] = max(doc['version'], self.get(collection_name))
+
+    async def load(self) -> None:
+        """Recargar las versiones de todas las colecciones"""
+        async for doc in db.collection_versions.find({}):
+            self._versions[doc['_id']] = max(doc['version'], self.get(doc['_id']))
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.load()
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudieron recargar las versiones de colecciones: {e!r}")
+
+    def start(self) -> None:
+        """Iniciar la recarga periódica"""
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Detener la recarga periódica"""
+        if self._task is not None:
+            self._stopping = True
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+collection_versions = CollectionVersions(COLLECTION_VERSION_REFRESH_SECONDS)
+
+def listing_etag(request: Request, collection_name: str, claims: TokenClaims) -> str:
+    """
+    ETag débil de un listado
+    
+    Depende de la versión de la colección, del usuario y su rol (los listados
+    se filtran por usuario) y de los parámetros de la consulta.
+    """
+    key = f"{collection_name}:{collection_versions.get(collection_name)}:{claims.id}:{claims.role}:{request.url.query}"
+    return f'W/"{hashlib.sha1(key.encode()).hexdigest()[:20]}"'
+
+def etag_headers(etag: str) -> dict:
+    """Cabeceras para que el navegador guarde el listado y lo revalide en cada uso"""
+    return {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Authorization"}
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """Respuesta 304 si If-None-Match contiene el ETag (comparación débil)"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return None
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    if "*" in tags or etag.removeprefix("W/") in tags:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=etag_headers(etag))
+    return None
+
+
+# ==================== TAREAS EN SEGUNDO PLANO ====================
+
+# Referencias a las tareas activas para que no sean recolectadas antes de terminar
+background_tasks: set = set()
+
+def run_in_background(coro, description: str) -> asyncio.Task:
+    """Lanzar una corrutina en segundo plano registrando cualquier error"""
+    async def runner():
+        try:
+            await coro
+        except Exception:
+            logger.exception(f"Error en tarea en segundo plano: {description}")
+
+    task = asyncio.create_task(runner())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+# ==================== REPOSITORIO DE PANELES ====================
+
+# Los paneles guardan el nombre del usuario asignado (user_name) desnormalizado,
+# por lo que las lecturas no necesitan consultar la colección users.
+
+async def find_panels(query: dict, limit: Optional[int] = None) -> List[dict]:
+    """
+    Obtener paneles (incluyen el nombre desnormalizado del usuario asignado, user_name).
+
+    Con `limit` los resultados se ordenan por (created_at, id) como en la paginación.
+    """
+    panels_cursor = db.panels.find(query, {"_id": 0})
+    if limit is not None:
+        panels_cursor = panels_cursor.sort(PAGINATION_SORT).limit(limit)
+    return await panels_cursor.to_list(limit)
+
+async def find_panel(panel_id: str) -> Optional[dict]:
+    """Obtener un panel por id"""
+    return await db.panels.find_one({"id": panel_id}, {"_id": 0})
+
+async def propagate_owner_name(user_id: str, full_name: Optional[str]) -> None:
+    """Actualizar el nombre desnormalizado en todos los paneles de un usuario"""
+    result = await db.panels.update_many(
+        {"user_id": user_id},
+        {"$set": {"user_name": full_name}}
+    )
+    if result.modified_count:
+        await collection_versions.bump("panels")
+    logger.info(f"Nombre de usuario {user_id} propagado a {result.modified_count} paneles")
+
+async def backfill_panel_owner_names() -> None:
+    """Completar user_name en paneles asignados que aún no lo tienen (datos antiguos)"""
+    user_ids = await db.panels.distinct("user_id", {"user_id": {"$ne": None}, "user_name": {"$exists": False}})
+    for user_id in user_ids:
+        user = await db.users.find_one({"id": user_id}, {"_id": 0, "full_name": 1})
+        await db.panels.update_many(
+            {"user_id": user_id, "user_name": {"$exists": False}},
+            {"$set": {"user_name": user['full_name'] if user else None}}
+        )
+    if user_ids:
+        await collection_versions.bump("panels")
+        logger.info(f"Nombre de propietario completado en paneles de {len(user_ids)} usuarios")
+
+
+# ==================== MIGRACIÓN DE FECHAS ====================
+
+# Versiones anteriores guardaban created_at como cadena ISO. La migración convierte
+# los documentos por lotes a fechas BSON nativas mientras la API sigue atendiendo.
+# Es reanudable: cada lote vuelve a consultar solo los documentos que siguen en
+# cadena, y el progreso queda registrado en la colección migrations.
+
+DATE_MIGRATION_ID = "created_at_bson_dates"
+DATE_MIGRATION_COLLECTIONS = ("users", "panels")
+
+def parse_stored_date(value: str) -> datetime:
+    """Cadena ISO almacenada a datetime en UTC"""
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+async def migrate_collection_dates(collection_name: str) -> int:
+    """
+    Convertir created_at de cadena a fecha BSON en una colección; devuelve los documentos convertidos.
+
+    Los valores que no se pueden interpretar se registran y se dejan como están
+    para revisarlos a mano. El recorrido avanza por _id, así que esos documentos
+    no se vuelven a leer en los lotes siguientes.
+    """
+    collection = db[collection_name]
+    converted = 0
+    last_id = None
+    while True:
+        query = {"created_at": {"$type": "string"}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        docs = await collection.find(
+            query,
+            {"_id": 1, "created_at": 1}
+        ).sort("_id", ASCENDING).limit(DATE_MIGRATION_BATCH_SIZE).to_list(DATE_MIGRATION_BATCH_SIZE)
+        if not docs:
+            return converted
+        last_id = docs[-1]['_id']
+
+        operations = []
+        skipped = 0
+        for doc in docs:
+            try:
+                created_at = parse_stored_date(doc['created_at'])
+            except ValueError:
+                logger.warning(
+                    f"⚠️ created_at inválido en {collection_name} ({doc['_id']}): "
+                    f"{doc['created_at']!r}; se deja sin migrar"
+                )
+                skipped += 1
+                continue
+            # El filtro sobre el valor original evita pisar una escritura concurrente
+            operations.append(UpdateOne(
+                {"_id": doc['_id'], "created_at": doc['created_at']},
+                {"$set": {"created_at": created_at}}
+            ))
+        modified = 0
+        if operations:
+            result = await collection.bulk_write(operations, ordered=False)
+            modified = result.modified_count
+        converted += modified
+        if modified:
+            await collection_versions.bump(collection_name)
+
+        await db.migrations.update_one(
+            {"_id": DATE_MIGRATION_ID},
+            {"$inc": {f"converted.{collection_name}": modified,
+                      f"skipped.{collection_name}": skipped},
+             "$set": {"updated_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        # Pausa entre lotes para no competir con el tráfico de la API
+        await asyncio.sleep(DATE_MIGRATION_PAUSE_SECONDS)
+
+async def migrate_created_at_dates() -> None:
+    """Migrar created_at a fechas BSON en users y panels (se omite si ya terminó)"""
+    state = await db.migrations.find_one({"_id": DATE_MIGRATION_ID})
+    if state and state.get("completed_at"):
+        return
+
+    started = time.perf_counter()
+    totals = {name: await migrate_collection_dates(name) for name in DATE_MIGRATION_COLLECTIONS}
+    await db.migrations.update_one(
+        {"_id": DATE_MIGRATION_ID},
+        {"$set": {"completed_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    logger.info(f"📅 Migración de created_at completada: {totals} en {elapsed_ms:.0f} ms")
+
+
+# ==================== RUTAS DE AUTENTICACIÓN ====================
+
+@api_router.post("/auth/register", response_model=Token, tags=["Autenticación"])
+async def register(user_data: UserCreate, request: Request):
+    """
+    Registrar un nuevo usuario
+    
+    - **email**: Correo electrónico único
+    - **password**: Contraseña (mínimo 6 caracteres)
+    - **full_name**: Nombre completo del usuario
+    """
+    enforce_auth_rate_limit(request, user_data.email)
+    
+    # Verificar si el usuario ya existe
+    existing_user = await db.users.find_one({"email": user_data.email})
+    if existing_user:
+        # Cuenta como fallo: limita la enumeración de correos registrados
+        record_auth_failure(user_data.email)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="El correo electrónico ya está registrado"
+        )
+    
+    # Verificar si es el primer usuario (será admin)
+    user_count = await db.users.count_documents({})
+    is_first_user = user_count == 0
+    
+    # Crear nuevo usuario
+    user = User(
+        email=user_data.email,
+        full_name=user_data.full_name,
+        role="admin" if is_first_user else "user"
+    )
+    
+    # Preparar documento para MongoDB
+    user_doc = user.model_dump()
+    user_doc['password'] = await password_hasher.hash(user_data.password)
+    
+    # El índice único sobre email resuelve registros simultáneos del mismo correo
+    try:
+        await db.users.insert_one(user_doc)
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="El correo electrónico ya está registrado"
+        )
+    await collection_versions.bump("users")
+    
+    # Crear tokens (rol y versión permiten autorizar sin consultar la base de datos)
+    tokens = await issue_tokens(user, 0)
+    
+    logger.info(f"Nuevo usuario registrado: {user.email} (rol: {user.role})")
+    
+    return tokens
+
+@api_router.post("/auth/login", response_model=Token, tags=["Autenticación"])
+async def login(credentials: UserLogin, request: Request):
+    """
+    Iniciar sesión
+    
+    - **email**: Correo electrónico
+    - **password**: Contraseña
+    
+    Los intentos están limitados por IP y por correo (429 con cabecera Retry-After).
+    """
+    enforce_auth_rate_limit(request, credentials.email)
+    
+    # Buscar usuario
+    user_doc = await db.users.find_one({"email": credentials.email})
+    if not user_doc:
+        record_auth_failure(credentials.email)
+        raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Correo o contraseña incorrectos"
         )
     
-    # Convertir timestamp ISO a datetime
-    if isinstance(user_doc['created_at'], str):
-        user_doc['created_at'] = datetime.fromisoformat(user_doc['created_at'])
+    # Verificar contraseña
+    if not await password_hasher.verify(credentials.password, user_doc['password']):
+        record_auth_failure(credentials.email)
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Correo o contraseña incorrectos"
+        )
+    
+    # Hash con otro coste (BCRYPT_ROUNDS cambió): se rehace sin retrasar la respuesta
+    if pwd_context.needs_update(user_doc['password']):
+        run_in_background(
+            rehash_password(user_doc['id'], credentials.password, user_doc['password']),
+            f"rehash de contraseña del usuario {user_doc['id']}"
+        )
     
     # Asegurar que tenga rol (compatibilidad con usuarios antiguos)
     if 'role' not in user_doc:
@@ -294,17 +1795,58 @@ async def login(credentials: UserLogin):
     
     user = User(**user_doc)
     
-    # Crear token de acceso
-    access_token = create_access_token(data={"sub": user.id})
+    # Crear tokens (rol y versión permiten autorizar sin consultar la base de datos)
+    tokens = await issue_tokens(user, user_doc.get('token_version', 0))
     
     logger.info(f"Usuario autenticado: {user.email}")
     
-    return Token(
-        access_token=access_token,
-        token_type="bearer",
-        user=user
+    return tokens
+
+@api_router.post("/auth/refresh", response_model=Token, tags=["Autenticación"])
+async def refresh_session(request_data: RefreshRequest):
+    """
+    Renovar el token de acceso
+    
+    - **refresh_token**: Token de actualización recibido al iniciar sesión o en la última renovación
+    
+    Devuelve un token de acceso nuevo y otro token de actualización; el enviado deja de ser válido.
+    Repetir la petición con el mismo token durante unos segundos devuelve el mismo sucesor.
+    """
+    token_doc, replayed = await rotate_refresh_token(request_data.refresh_token)
+    
+    # El rol y la versión se leen de nuevo: la renovación es lo único que consulta la base de datos
+    user_doc = await db.users.find_one({"id": token_doc['user_id']}, {"_id": 0, "password": 0})
+    if user_doc is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Usuario no encontrado"
+        )
+    if 'role' not in user_doc:
+        user_doc['role'] = 'user'
+    
+    user = User(**user_doc)
+    return await issue_tokens(
+        user,
+        user_doc.get('token_version', 0),
+        token_doc['family_id'],
+        refresh_token=successor_refresh_token(request_data.refresh_token),
+        store_refresh_token=not replayed
     )
 
+@api_router.post("/auth/logout", tags=["Autenticación"])
+async def logout(request_data: RefreshRequest):
+    """
+    Cerrar la sesión
+    
+    - **refresh_token**: Token de actualización de la sesión a cerrar
+    
+    El token de acceso en curso sigue siendo válido hasta que expire.
+    """
+    token_doc = await db.refresh_tokens.find_one({"token_hash": hash_refresh_token(request_data.refresh_token)})
+    if token_doc is not None:
+        await db.refresh_tokens.delete_many({"family_id": token_doc['family_id']})
+    return {"message": "Sesión cerrada correctamente"}
+
 @api_router.get("/auth/me", response_model=User, tags=["Autenticación"])
 async def get_me(current_user: User = Depends(get_current_user)):
     """
@@ -314,25 +1856,65 @@ async def get_me(current_user: User = Depends(get_current_user)):
     """
     return current_user
 
+@api_router.put("/auth/me", response_model=User, tags=["Autenticación"])
+async def update_me(profile: UpdateProfile, current_user: User = Depends(get_current_user)):
+    """
+    Actualizar el nombre del usuario actual
+    
+    - **full_name**: Nuevo nombre completo
+    """
+    await db.users.update_one({"id": current_user.id}, {"$set": {"full_name": profile.full_name}})
+    user_cache.invalidate(current_user.id)
+    await collection_versions.bump("users")
+    
+    # Los paneles guardan el nombre del propietario: se actualizan en segundo plano
+    run_in_background(
+        propagate_owner_name(current_user.id, profile.full_name),
+        f"propagar nombre de usuario {current_user.id}"
+    )
+    
+    logger.info(f"Usuario {current_user.id} actualizó su nombre")
+    
+    return current_user.model_copy(update={"full_name": profile.full_name})
+
 
 # ==================== RUTAS DE GESTIÓN DE USUARIOS (ADMIN) ====================
 
 @api_router.get("/users", response_model=List[UserResponse], tags=["Usuarios"])
-async def list_users(admin: User = Depends(get_admin_user)):
-    """
-    Listar todos los usuarios (solo admin)
-    """
-    users = await db.users.find({}, {"_id": 0, "password": 0}).to_list(1000)
-    result = []
-    for u in users:
-        result.append(UserResponse(
-            id=u['id'],
-            email=u['email'],
-            full_name=u['full_name'],
-            role=u.get('role', 'user'),
-            created_at=u['created_at'] if isinstance(u['created_at'], str) else u['created_at'].isoformat()
-        ))
-    return result
+async def list_users(
+    request: Request,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    role: Optional[Literal["admin", "user"]] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    admin: TokenClaims = Depends(get_admin_claims)
+):
+    """
+    Listar usuarios paginados (solo admin)
+    
+    - **limit**: Tamaño de página
+    - **cursor**: Valor de la cabecera X-Next-Cursor de la página anterior
+    - **role**: Filtrar por rol
+    - **created_from**, **created_to**: Rango de fecha de registro [desde, hasta)
+    
+    Con `If-None-Match` igual al ETag de la respuesta anterior devuelve 304 si no hubo cambios.
+    """
+    etag = listing_etag(request, "users", admin)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    
+    query = {}
+    if role == "admin":
+        query['role'] = "admin"
+    elif role == "user":
+        # Usuarios antiguos sin campo role se consideran "user"
+        query['role'] = {"$ne": "admin"}
+    apply_created_range(query, created_from, created_to)
+    users = await fetch_page(db.users, query, {"_id": 0, "password": 0}, limit, cursor, response)
+    return list_response([serialize_user(u) for u in users], response, etag)
 
 @api_router.put("/users/{user_id}/role", response_model=UserResponse, tags=["Usuarios"])
 async def update_user_role(user_id: str, role_data: UpdateUserRole, admin: User = Depends(get_admin_user)):
@@ -346,11 +1928,19 @@ async def update_user_role(user_id: str, role_data: UpdateUserRole, admin: User
             detail="No puede quitarse el rol de administrador a sí mismo"
         )
     
+    # Un cambio de rol sube la versión de token: los tokens anteriores llevan el rol viejo
     result = await db.users.find_one_and_update(
-        {"id": user_id},
-        {"$set": {"role": role_data.role}},
-        return_document=True
+        {"id": user_id, "role": {"$ne": role_data.role}},
+        {"$set": {"role": role_data.role}, "$inc": {"token_version": 1}},
+        return_document=ReturnDocument.AFTER
     )
+    if result:
+        await token_revocations.revoke_before(user_id, result['token_version'])
+        energy_hub.disconnect_user(user_id)
+        await collection_versions.bump("users")
+    else:
+        # Mismo rol que el actual (o usuario inexistente): los tokens siguen siendo válidos
+        result = await db.users.find_one({"id": user_id})
     
     if not result:
         raise HTTPException(
@@ -358,15 +1948,11 @@ async def update_user_role(user_id: str, role_data: UpdateUserRole, admin: User
             detail="Usuario no encontrado"
         )
     
+    user_cache.invalidate(user_id)
+    
     logger.info(f"Rol de usuario {user_id} actualizado a {role_data.role}")
     
-    return UserResponse(
-        id=result['id'],
-        email=result['email'],
-        full_name=result['full_name'],
-        role=result.get('role', 'user'),
-        created_at=result['created_at'] if isinstance(result['created_at'], str) else result['created_at'].isoformat()
-    )
+    return serialize_user(result)
 
 @api_router.delete("/users/{user_id}", tags=["Usuarios"])
 async def delete_user(user_id: str, admin: User = Depends(get_admin_user)):
@@ -383,10 +1969,11 @@ async def delete_user(user_id: str, admin: User = Depends(get_admin_user)):
     # Primero desasignar paneles del usuario
     await db.panels.update_many(
         {"user_id": user_id},
-        {"$set": {"user_id": None}}
+        {"$set": {"user_id": None, "user_name": None}}
     )
     
     result = await db.users.delete_one({"id": user_id})
+    user_cache.invalidate(user_id)
     
     if result.deleted_count == 0:
         raise HTTPException(
@@ -394,11 +1981,132 @@ async def delete_user(user_id: str, admin: User = Depends(get_admin_user)):
             detail="Usuario no encontrado"
         )
     
+    await token_revocations.revoke_user(user_id)
+    energy_hub.disconnect_user(user_id)
+    await db.refresh_tokens.delete_many({"user_id": user_id})
+    await collection_versions.bump("users")
+    await collection_versions.bump("panels")
+    panel_directory.clear()
+    
     logger.info(f"Usuario {user_id} eliminado")
     
     return {"message": "Usuario eliminado correctamente"}
 
 
+# ==================== IMPORTACIÓN Y EXPORTACIÓN DE PANELES ====================
+
+# La importación lee el cuerpo como flujo línea a línea (NDJSON o CSV), valida cada
+# fila al llegar e inserta por bloques; la exportación recorre un cursor de Mongo
+# y envía el resultado por partes sin cargar todos los paneles en memoria.
+
+NDJSON_MEDIA_TYPES = {"application/x-ndjson", "application/ndjson", "application/jsonl"}
+CSV_MEDIA_TYPE = "text/csv"
+PANEL_EXPORT_FIELDS = list(PanelResponse.model_fields)
+EXPORT_FLUSH_BYTES = 64 * 1024
+
+async def iter_body_lines(request: Request) -> AsyncIterator[Tuple[int, bytes]]:
+    """
+    Recorrer las líneas no vacías del cuerpo a medida que llegan (número de línea, contenido).
+
+    Una línea de más de PANEL_BULK_MAX_LINE_BYTES corta la importación con 413,
+    así que el búfer nunca retiene más de una línea de ese tamaño.
+    """
+    def check_length(line: bytes, number: int) -> None:
+        if len(line) > PANEL_BULK_MAX_LINE_BYTES:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"La línea {number} supera el máximo de {PANEL_BULK_MAX_LINE_BYTES} bytes"
+            )
+
+    pending = b""
+    line_number = 0
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            line_number += 1
+            check_length(line, line_number)
+            if line.strip():
+                yield line_number, line.rstrip(b"\r")
+        check_length(pending, line_number + 1)
+    if pending.strip():
+        yield line_number + 1, pending.rstrip(b"\r")
+
+async def iter_panel_rows(request: Request, fmt: str) -> AsyncIterator[Tuple[int, Union[dict, str]]]:
+    """
+    Convertir las líneas del cuerpo en filas (número de línea, dict).
+
+    Las filas que no se pueden leer se devuelven con un mensaje de error en lugar del dict.
+    En CSV la primera línea es la cabecera con los nombres de columna.
+    """
+    header = None
+    async for line_number, line in iter_body_lines(request):
+        try:
+            text = line.decode("utf-8-sig" if line_number == 1 else "utf-8")
+            if fmt == "csv":
+                values = next(csv.reader([text]))
+                if header is None:
+                    header = [name.strip() for name in values]
+                    continue
+                if len(values) != len(header):
+                    yield line_number, f"Se esperaban {len(header)} columnas y hay {len(values)}"
+                    continue
+                yield line_number, dict(zip(header, values))
+            else:
+                row = orjson.loads(text)
+                if not isinstance(row, dict):
+                    yield line_number, "Cada línea debe ser un objeto JSON"
+                    continue
+                yield line_number, row
+        except (ValueError, csv.Error) as exc:
+            yield line_number, f"Línea ilegible: {exc}"
+
+def describe_validation_error(exc: ValidationError) -> str:
+    """Mensaje compacto con los campos inválidos de una fila"""
+    return "; ".join(
+        f"{'.'.join(str(part) for part in error['loc']) or 'fila'}: {error['msg']}"
+        for error in exc.errors()
+    )
+
+async def insert_panel_chunk(chunk: List[Tuple[int, dict]]) -> Tuple[int, List[PanelBulkError]]:
+    """Insertar un bloque de paneles; devuelve los insertados y los errores de escritura por fila"""
+    try:
+        result = await db.panels.insert_many([doc for _, doc in chunk], ordered=False)
+        return len(result.inserted_ids), []
+    except BulkWriteError as exc:
+        errors = [
+            PanelBulkError(row=chunk[write_error["index"]][0], error=write_error.get("errmsg", "Error de escritura"))
+            for write_error in exc.details.get("writeErrors", [])
+        ]
+        return exc.details.get("nInserted", 0), errors
+
+async def iter_export_chunks(panels_cursor, fmt: str) -> AsyncIterator[bytes]:
+    """Serializar los paneles de un cursor en bloques de ~64 KB"""
+    text_buffer = io.StringIO()
+    writer = csv.writer(text_buffer, lineterminator="\n")
+    output = bytearray()
+    if fmt == "csv":
+        writer.writerow(PANEL_EXPORT_FIELDS)
+    async for doc in panels_cursor:
+        panel = serialize_panel(doc)
+        if fmt == "csv":
+            writer.writerow([panel[field] if panel[field] is not None else "" for field in PANEL_EXPORT_FIELDS])
+        else:
+            output += orjson.dumps(panel)
+            output += b"\n"
+        if text_buffer.tell():
+            output += text_buffer.getvalue().encode("utf-8")
+            text_buffer.seek(0)
+            text_buffer.truncate()
+        if len(output) >= EXPORT_FLUSH_BYTES:
+            yield bytes(output)
+            output.clear()
+    if text_buffer.tell():
+        output += text_buffer.getvalue().encode("utf-8")
+    if output:
+        yield bytes(output)
+
+
 # ==================== RUTAS DE GESTIÓN DE PANELES ====================
 
 @api_router.post("/panels", response_model=PanelResponse, tags=["Paneles"])
@@ -413,60 +2121,169 @@ async def create_panel(panel_data: PanelCreate, admin: User = Depends(get_admin_
     )
     
     panel_doc = panel.model_dump()
-    panel_doc['created_at'] = panel_doc['created_at'].isoformat()
     
     await db.panels.insert_one(panel_doc)
+    await collection_versions.bump("panels")
     
     logger.info(f"Nuevo panel creado: {panel.id}")
     
-    return PanelResponse(
-        id=panel.id,
-        model=panel.model,
-        location=panel.location,
-        capacity=panel.capacity,
-        status=panel.status,
-        user_id=panel.user_id,
-        user_name=None,
-        created_at=panel_doc['created_at']
-    )
+    return serialize_panel(panel_doc)
 
 @api_router.get("/panels", response_model=List[PanelResponse], tags=["Paneles"])
-async def list_panels(current_user: User = Depends(get_current_user)):
+async def list_panels(
+    request: Request,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    status_filter: Optional[Literal["activo", "inactivo", "mantenimiento"]] = Query(None, alias="status"),
+    location: Optional[str] = None,
+    user_id: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    current_user: TokenClaims = Depends(get_token_claims)
+):
     """
-    Listar paneles (admin ve todos, usuarios solo los suyos)
+    Listar paneles paginados (admin ve todos, usuarios solo los suyos)
+    
+    - **limit**: Tamaño de página
+    - **cursor**: Valor de la cabecera X-Next-Cursor de la página anterior
+    - **status**, **location**, **user_id**: Filtros opcionales (user_id solo para admin)
+    - **created_from**, **created_to**: Rango de fecha de creación [desde, hasta)
+    
+    Con `If-None-Match` igual al ETag de la respuesta anterior devuelve 304 si no hubo cambios.
     """
+    # La versión se lee antes de consultar: una escritura concurrente produce otro ETag
+    etag = listing_etag(request, "panels", current_user)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    
+    query = {}
     if current_user.role == "admin":
-        panels = await db.panels.find({}, {"_id": 0}).to_list(1000)
+        if user_id:
+            query['user_id'] = user_id
     else:
-        panels = await db.panels.find({"user_id": current_user.id}, {"_id": 0}).to_list(1000)
+        query['user_id'] = current_user.id
+    if status_filter:
+        query['status'] = status_filter
+    if location:
+        query['location'] = location
+    apply_created_range(query, created_from, created_to)
     
-    # Obtener nombres de usuarios para los paneles asignados
-    user_ids = list(set(p.get('user_id') for p in panels if p.get('user_id')))
-    users_map = {}
-    if user_ids:
-        users = await db.users.find({"id": {"$in": user_ids}}, {"_id": 0, "id": 1, "full_name": 1}).to_list(1000)
-        users_map = {u['id']: u['full_name'] for u in users}
-    
-    result = []
-    for p in panels:
-        result.append(PanelResponse(
-            id=p['id'],
-            model=p['model'],
-            location=p['location'],
-            capacity=p['capacity'],
-            status=p.get('status', 'activo'),
-            user_id=p.get('user_id'),
-            user_name=users_map.get(p.get('user_id')),
-            created_at=p['created_at'] if isinstance(p['created_at'], str) else p['created_at'].isoformat()
-        ))
-    return result
+    docs = await find_panels(apply_cursor(query, cursor), limit=limit + 1)
+    panels = finish_page(docs, limit, response)
+    return list_response([serialize_panel(p) for p in panels], response, etag)
+
+@api_router.post("/panels/bulk", response_model=PanelBulkResult, tags=["Paneles"])
+async def import_panels(request: Request, admin: User = Depends(get_admin_user)):
+    """
+    Importar paneles de forma masiva (solo admin)
+    
+    El cuerpo se envía como NDJSON (`Content-Type: application/x-ndjson`, un objeto por línea)
+    o CSV (`Content-Type: text/csv`, con cabecera model,location,capacity).
+    Cada fila se valida como en la creación individual; las filas inválidas se
+    informan en **errors** con su número de línea y no detienen la importación.
+    Una línea de más de PANEL_BULK_MAX_LINE_BYTES (64 KB por defecto) la corta
+    con 413; los bloques insertados hasta ese punto se conservan.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type == CSV_MEDIA_TYPE:
+        fmt = "csv"
+    elif content_type in NDJSON_MEDIA_TYPES:
+        fmt = "ndjson"
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Formato no soportado: use application/x-ndjson o text/csv"
+        )
+    
+    inserted = 0
+    failed = 0
+    errors: List[PanelBulkError] = []
+    chunk: List[Tuple[int, dict]] = []
+    
+    def record_errors(new_errors: List[PanelBulkError]) -> None:
+        # Solo se conservan los primeros PANEL_BULK_MAX_ERRORS; el resto se cuenta
+        nonlocal failed
+        failed += len(new_errors)
+        errors.extend(new_errors[:PANEL_BULK_MAX_ERRORS - len(errors)])
+    
+    async def flush_chunk() -> None:
+        nonlocal inserted
+        chunk_inserted, chunk_errors = await insert_panel_chunk(chunk)
+        inserted += chunk_inserted
+        record_errors(chunk_errors)
+        chunk.clear()
+    
+    try:
+        async for line_number, row in iter_panel_rows(request, fmt):
+            if isinstance(row, str):
+                record_errors([PanelBulkError(row=line_number, error=row)])
+                continue
+            try:
+                panel_data = PanelCreate(**row)
+            except ValidationError as exc:
+                record_errors([PanelBulkError(row=line_number, error=describe_validation_error(exc))])
+                continue
+            panel = Panel(
+                model=panel_data.model,
+                location=panel_data.location,
+                capacity=panel_data.capacity
+            )
+            chunk.append((line_number, panel.model_dump()))
+            if len(chunk) >= PANEL_BULK_CHUNK_SIZE:
+                await flush_chunk()
+        if chunk:
+            await flush_chunk()
+    finally:
+        # Los bloques ya insertados se conservan aunque la importación se corte (413)
+        if inserted:
+            await collection_versions.bump("panels")
+    logger.info(f"📦 Importación masiva de paneles: {inserted} insertados, {failed} con error")
+    
+    return PanelBulkResult(
+        inserted=inserted,
+        failed=failed,
+        errors=errors,
+        errors_truncated=failed > PANEL_BULK_MAX_ERRORS
+    )
+
+@api_router.get("/panels/export", tags=["Paneles"])
+async def export_panels(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    status_filter: Optional[Literal["activo", "inactivo", "mantenimiento"]] = Query(None, alias="status"),
+    location: Optional[str] = None,
+    user_id: Optional[str] = None,
+    admin: TokenClaims = Depends(get_admin_claims)
+):
+    """
+    Exportar paneles como NDJSON o CSV (solo admin)
+    
+    - **format**: ndjson (por defecto) o csv
+    - **status**, **location**, **user_id**: Filtros opcionales
+    """
+    query = {}
+    if status_filter:
+        query['status'] = status_filter
+    if location:
+        query['location'] = location
+    if user_id:
+        query['user_id'] = user_id
+    
+    panels_cursor = db.panels.find(query, {"_id": 0}).sort(PAGINATION_SORT).batch_size(PANEL_EXPORT_BATCH_SIZE)
+    media_type = CSV_MEDIA_TYPE if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        iter_export_chunks(panels_cursor, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="panels.{format}"'}
+    )
 
 @api_router.get("/panels/{panel_id}", response_model=PanelResponse, tags=["Paneles"])
-async def get_panel(panel_id: str, current_user: User = Depends(get_current_user)):
+async def get_panel(panel_id: str, current_user: TokenClaims = Depends(get_token_claims)):
     """
     Obtener un panel específico
     """
-    panel = await db.panels.find_one({"id": panel_id}, {"_id": 0})
+    panel = await find_panel(panel_id)
     
     if not panel:
         raise HTTPException(
@@ -481,22 +2298,7 @@ async def get_panel(panel_id: str, current_user: User = Depends(get_current_user
             detail="No tiene acceso a este panel"
         )
     
-    user_name = None
-    if panel.get('user_id'):
-        user = await db.users.find_one({"id": panel['user_id']}, {"_id": 0, "full_name": 1})
-        if user:
-            user_name = user['full_name']
-    
-    return PanelResponse(
-        id=panel['id'],
-        model=panel['model'],
-        location=panel['location'],
-        capacity=panel['capacity'],
-        status=panel.get('status', 'activo'),
-        user_id=panel.get('user_id'),
-        user_name=user_name,
-        created_at=panel['created_at'] if isinstance(panel['created_at'], str) else panel['created_at'].isoformat()
-    )
+    return serialize_panel(panel)
 
 @api_router.put("/panels/{panel_id}", response_model=PanelResponse, tags=["Paneles"])
 async def update_panel(panel_id: str, panel_data: PanelUpdate, admin: User = Depends(get_admin_user)):
@@ -511,10 +2313,21 @@ async def update_panel(panel_id: str, panel_data: PanelUpdate, admin: User = Dep
             detail="No hay datos para actualizar"
         )
     
+    # Mantener el nombre desnormalizado si cambia el usuario asignado
+    if 'user_id' in update_data:
+        user = await db.users.find_one({"id": update_data['user_id']}, {"_id": 0, "full_name": 1})
+        if not user:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Usuario no encontrado"
+            )
+        update_data['user_name'] = user['full_name']
+    
     result = await db.panels.find_one_and_update(
         {"id": panel_id},
         {"$set": update_data},
-        return_document=True
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
     )
     
     if not result:
@@ -523,24 +2336,12 @@ async def update_panel(panel_id: str, panel_data: PanelUpdate, admin: User = Dep
             detail="Panel no encontrado"
         )
     
-    user_name = None
-    if result.get('user_id'):
-        user = await db.users.find_one({"id": result['user_id']}, {"_id": 0, "full_name": 1})
-        if user:
-            user_name = user['full_name']
+    panel_directory.invalidate(panel_id)
+    await collection_versions.bump("panels")
     
     logger.info(f"Panel {panel_id} actualizado")
     
-    return PanelResponse(
-        id=result['id'],
-        model=result['model'],
-        location=result['location'],
-        capacity=result['capacity'],
-        status=result.get('status', 'activo'),
-        user_id=result.get('user_id'),
-        user_name=user_name,
-        created_at=result['created_at'] if isinstance(result['created_at'], str) else result['created_at'].isoformat()
-    )
+    return serialize_panel(result)
 
 @api_router.delete("/panels/{panel_id}", tags=["Paneles"])
 async def delete_panel(panel_id: str, admin: User = Depends(get_admin_user)):
@@ -555,6 +2356,9 @@ async def delete_panel(panel_id: str, admin: User = Depends(get_admin_user)):
             detail="Panel no encontrado"
         )
     
+    panel_directory.invalidate(panel_id)
+    await collection_versions.bump("panels")
+    
     logger.info(f"Panel {panel_id} eliminado")
     
     return {"message": "Panel eliminado correctamente"}
@@ -565,7 +2369,7 @@ async def assign_panel(panel_id: str, user_id: str, admin: User = Depends(get_ad
     Asignar un panel a un usuario (solo admin)
     """
     # Verificar que el usuario existe
-    user = await db.users.find_one({"id": user_id}, {"_id": 0})
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, "full_name": 1})
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -574,8 +2378,8 @@ async def assign_panel(panel_id: str, user_id: str, admin: User = Depends(get_ad
     
     result = await db.panels.find_one_and_update(
         {"id": panel_id},
-        {"$set": {"user_id": user_id}},
-        return_document=True
+        {"$set": {"user_id": user_id, "user_name": user['full_name']}},
+        return_document=ReturnDocument.AFTER
     )
     
     if not result:
@@ -584,18 +2388,12 @@ async def assign_panel(panel_id: str, user_id: str, admin: User = Depends(get_ad
             detail="Panel no encontrado"
         )
     
+    panel_directory.invalidate(panel_id)
+    await collection_versions.bump("panels")
+    
     logger.info(f"Panel {panel_id} asignado a usuario {user_id}")
     
-    return PanelResponse(
-        id=result['id'],
-        model=result['model'],
-        location=result['location'],
-        capacity=result['capacity'],
-        status=result.get('status', 'activo'),
-        user_id=result.get('user_id'),
-        user_name=user['full_name'],
-        created_at=result['created_at'] if isinstance(result['created_at'], str) else result['created_at'].isoformat()
-    )
+    return serialize_panel(result)
 
 @api_router.post("/panels/{panel_id}/unassign", response_model=PanelResponse, tags=["Paneles"])
 async def unassign_panel(panel_id: str, admin: User = Depends(get_admin_user)):
@@ -604,8 +2402,8 @@ async def unassign_panel(panel_id: str, admin: User = Depends(get_admin_user)):
     """
     result = await db.panels.find_one_and_update(
         {"id": panel_id},
-        {"$set": {"user_id": None}},
-        return_document=True
+        {"$set": {"user_id": None, "user_name": None}},
+        return_document=ReturnDocument.AFTER
     )
     
     if not result:
@@ -614,40 +2412,1455 @@ async def unassign_panel(panel_id: str, admin: User = Depends(get_admin_user)):
             detail="Panel no encontrado"
         )
     
+    panel_directory.invalidate(panel_id)
+    await collection_versions.bump("panels")
+    
     logger.info(f"Panel {panel_id} desasignado")
     
-    return PanelResponse(
-        id=result['id'],
-        model=result['model'],
-        location=result['location'],
-        capacity=result['capacity'],
-        status=result.get('status', 'activo'),
-        user_id=None,
-        user_name=None,
-        created_at=result['created_at'] if isinstance(result['created_at'], str) else result['created_at'].isoformat()
-    )
-
-
-# ==================== RUTAS BÁSICAS ====================
+    return serialize_panel(result)
 
-@api_router.get("/", tags=["General"])
-async def root():
-    """Información de la API"""
-    return {
-        "message": "EFFITECH API - Sistema de Gestión de Energía Solar",
-        "version": "1.0.0",
-        "status": "operational"
+@api_router.post("/panels/bulk/update", response_model=PanelBulkOperationResult, tags=["Paneles"])
+async def bulk_update_panels(operation: PanelBulkOperation, admin: User = Depends(get_admin_user)):
+    """
+    Asignar, desasignar o cambiar el estado de varios paneles a la vez (solo admin)
+    
+    - **action**: assign (requiere user_id), unassign o status (requiere status)
+    - **panel_ids**: Lista de ids de panel, o bien
+    - **filter**: Criterios status/location/user_id (al menos uno)
+    
+    Se aplica con un único update_many y devuelve cuántos paneles coincidieron y
+    cambiaron; con panel_ids se informan además los ids inexistentes.
+    """
+    if (operation.panel_ids is None) == (operation.filter is None):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Indique panel_ids o filter (solo uno de los dos)"
+        )
+    
+    if operation.panel_ids is not None:
+        panel_ids = list(dict.fromkeys(operation.panel_ids))
+        query = {"id": {"$in": panel_ids}}
+    else:
+        query = operation.filter.model_dump(exclude_none=True)
+        if not query:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="El filtro debe incluir al menos un criterio"
+            )
+    
+    if operation.action == "assign":
+        if not operation.user_id:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="user_id es obligatorio para asignar"
+            )
+        user = await db.users.find_one({"id": operation.user_id}, {"_id": 0, "full_name": 1})
+        if not user:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Usuario no encontrado"
+            )
+        changes = {"user_id": operation.user_id, "user_name": user['full_name']}
+    elif operation.action == "unassign":
+        changes = {"user_id": None, "user_name": None}
+    else:
+        if not operation.status:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="status es obligatorio para cambiar el estado"
+            )
+        changes = {"status": operation.status}
+    
+    result = await db.panels.update_many(query, {"$set": changes})
+    
+    not_found = []
+    if operation.panel_ids is not None and result.matched_count < len(panel_ids):
+        existing = set(await db.panels.distinct("id", query))
+        not_found = [panel_id for panel_id in panel_ids if panel_id not in existing]
+    
+    # El directorio de ingesta guarda el propietario de cada panel
+    if operation.action != "status":
+        if operation.panel_ids is not None:
+            for panel_id in panel_ids:
+                panel_directory.invalidate(panel_id)
+        else:
+            panel_directory.clear()
+    if result.modified_count:
+        await collection_versions.bump("panels")
+    
+    logger.info(f"Operación masiva {operation.action}: {result.matched_count} paneles, {result.modified_count} modificados")
+    
+    return PanelBulkOperationResult(
+        action=operation.action,
+        matched=result.matched_count,
+        modified=result.modified_count,
+        not_found=not_found
+    )
+
+
+# ==================== SERIES TEMPORALES Y AGREGADOS ====================
+
+READINGS_COLLECTION = "panel_readings"
+
+def _floor_5m(ts: datetime) -> datetime:
+    return ts.replace(minute=ts.minute - ts.minute % 5, second=0, microsecond=0)
+
+def _floor_1h(ts: datetime) -> datetime:
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+def _floor_1d(ts: datetime) -> datetime:
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+# granularidad -> (colección de agregados, función de redondeo del intervalo)
+ROLLUPS = {
+    "5m": ("panel_readings_5m", _floor_5m),
+    "1h": ("panel_readings_1h", _floor_1h),
+    "1d": ("panel_readings_1d", _floor_1d),
+}
+
+async def ensure_readings_collection() -> None:
+    """Crear panel_readings como colección time-series (MongoDB 5.0+) si no existe"""
+    if READINGS_COLLECTION in await db.list_collection_names():
+        return
+    options = {"timeseries": {"timeField": "timestamp", "metaField": "panel_id", "granularity": "minutes"}}
+    if READINGS_RETENTION_DAYS > 0:
+        options["expireAfterSeconds"] = READINGS_RETENTION_DAYS * 86400
+    try:
+        await db.create_collection(READINGS_COLLECTION, **options)
+        logger.info(f"📈 Colección time-series {READINGS_COLLECTION} creada")
+    except Exception as e:
+        # Servidores anteriores a 5.0: se usa una colección normal
+        logger.warning(f"No se pudo crear {READINGS_COLLECTION} como time-series, se usará una colección normal: {e}")
+
+async def update_rollups(readings: List[dict]) -> None:
+    """
+    Acumular lecturas ya persistidas en los agregados de 5 minutos, hora y día.
+
+    Las lecturas se agrupan primero en memoria por (panel, intervalo) para
+    emitir un único upsert por grupo.
+    """
+    if not readings:
+        return
+    for collection_name, floor in ROLLUPS.values():
+        groups = {}
+        for r in readings:
+            key = (r['panel_id'], floor(r['timestamp']))
+            g = groups.get(key)
+            production = r['production']
+            temperature = r.get('temperature')
+            if g is None:
+                g = groups[key] = {
+                    "count": 0, "production_sum": 0.0,
+                    "production_min": production, "production_max": production,
+                    "temperature_count": 0, "temperature_sum": 0.0,
+                    "temperature_min": None, "temperature_max": None
+                }
+            g['count'] += 1
+            g['production_sum'] += production
+            g['production_min'] = min(g['production_min'], production)
+            g['production_max'] = max(g['production_max'], production)
+            if temperature is not None:
+                g['temperature_count'] += 1
+                g['temperature_sum'] += temperature
+                g['temperature_min'] = temperature if g['temperature_min'] is None else min(g['temperature_min'], temperature)
+                g['temperature_max'] = temperature if g['temperature_max'] is None else max(g['temperature_max'], temperature)
+
+        operations = []
+        for (panel_id, bucket), g in groups.items():
+            update = {
+                "$inc": {
+                    "count": g['count'],
+                    "production_sum": g['production_sum'],
+                    "temperature_count": g['temperature_count'],
+                    "temperature_sum": g['temperature_sum']
+                },
+                "$min": {"production_min": g['production_min']},
+                "$max": {"production_max": g['production_max']}
+            }
+            if g['temperature_min'] is not None:
+                update['$min']['temperature_min'] = g['temperature_min']
+                update['$max']['temperature_max'] = g['temperature_max']
+            operations.append(UpdateOne({"panel_id": panel_id, "bucket": bucket}, update, upsert=True))
+        await db[collection_name].bulk_write(operations, ordered=False)
+
+def rollup_to_point(doc: dict) -> RollupPoint:
+    """Convertir un documento de agregado en un punto con promedios"""
+    count = doc['count']
+    temperature_count = doc.get('temperature_count', 0)
+    bucket = doc['bucket']
+    if bucket.tzinfo is None:
+        bucket = bucket.replace(tzinfo=timezone.utc)
+    return RollupPoint(
+        bucket=bucket.isoformat(),
+        count=count,
+        production_sum=doc['production_sum'],
+        production_min=doc['production_min'],
+        production_max=doc['production_max'],
+        production_avg=doc['production_sum'] / count if count else 0.0,
+        temperature_min=doc.get('temperature_min'),
+        temperature_max=doc.get('temperature_max'),
+        temperature_avg=doc['temperature_sum'] / temperature_count if temperature_count else None
+    )
+
+async def find_rollups(panel_ids: List[str], granularity: str, start: Optional[datetime], end: Optional[datetime]) -> List[dict]:
+    """Leer agregados de los paneles indicados en el rango [start, end)"""
+    collection_name, _ = ROLLUPS[granularity]
+    query = {"panel_id": panel_ids[0] if len(panel_ids) == 1 else {"$in": panel_ids}}
+    bucket_range = {}
+    if start:
+        bucket_range['$gte'] = start
+    if end:
+        bucket_range['$lt'] = end
+    if bucket_range:
+        query['bucket'] = bucket_range
+    return await analytics_db[collection_name].find(query, {"_id": 0}).sort("bucket", ASCENDING).to_list(None)
+
+
+# ==================== DIRECTORIO DE PANELES ====================
+
+class PanelDirectory:
+    """
+    Caché en memoria de panel_id -> {user_id, capacity} para la ingesta.
+
+    Evita consultar la colección panels por cada lectura: los ids desconocidos
+    de un lote se resuelven con una sola consulta $in. Las rutas que modifican
+    paneles invalidan las entradas afectadas.
+    """
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}
+
+    async def resolve(self, panel_ids) -> dict:
+        """Obtener la información de cada panel (None si no existe)"""
+        now = time.monotonic()
+        result = {}
+        missing = []
+        for panel_id in panel_ids:
+            entry = self._entries.get(panel_id)
+            if entry is not None and entry[0] > now:
+                result[panel_id] = entry[1]
+            else:
+                missing.append(panel_id)
+        if missing:
+            docs = await db.panels.find(
+                {"id": {"$in": missing}},
+                {"_id": 0, "id": 1, "user_id": 1, "capacity": 1}
+            ).to_list(len(missing))
+            found = {d['id']: {"user_id": d.get('user_id'), "capacity": d.get('capacity', 0.0)} for d in docs}
+            expires_at = now + self.ttl_seconds
+            for panel_id in missing:
+                info = found.get(panel_id)
+                self._entries[panel_id] = (expires_at, info)
+                result[panel_id] = info
+        return result
+
+    def invalidate(self, panel_id: str) -> None:
+        """Eliminar un panel de la caché"""
+        self._entries.pop(panel_id, None)
+
+    def clear(self) -> None:
+        """Vaciar la caché completa"""
+        self._entries.clear()
+
+panel_directory = PanelDirectory(PANEL_DIRECTORY_TTL_SECONDS)
+
+
+# ==================== AGREGADOS DE ANALÍTICA ====================
+
+# Agregados materializados por alcance ("all" o id de usuario) y período.
+# Se actualizan incrementalmente con cada lote de lecturas, por lo que el coste
+# de una consulta depende del número de períodos y no del historial.
+# La capacidad de cada panel se guarda una sola vez por período en el mapa
+# `panels` (id -> capacidad), de modo que la eficiencia no depende de cuántas
+# lecturas envíe el panel. La eficiencia es el factor de capacidad: producción
+# entre capacidad × horas del período, igual en cualquier granularidad.
+ANALYTICS_SCOPE_ALL = "all"
+
+def _floor_month(ts: datetime) -> datetime:
+    return ts.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def _next_month(ts: datetime) -> datetime:
+    return (ts.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+ANALYTICS_AGGREGATES = {
+    "day": ("analytics_daily", _floor_1d),
+    "month": ("analytics_monthly", _floor_month),
+}
+
+async def update_analytics(readings: List[dict]) -> None:
+    """
+    Acumular lecturas en los agregados diarios y mensuales.
+
+    La producción se atribuye al usuario asignado al panel en el momento de la lectura.
+    """
+    panels = await panel_directory.resolve({r['panel_id'] for r in readings})
+    for collection_name, floor in ANALYTICS_AGGREGATES.values():
+        groups = {}
+        capacities = {}
+        for r in readings:
+            info = panels.get(r['panel_id'])
+            if info is None:
+                continue
+            period = floor(r['timestamp'])
+            scopes = [ANALYTICS_SCOPE_ALL]
+            if info['user_id']:
+                scopes.append(info['user_id'])
+            for scope in scopes:
+                g = groups.setdefault((scope, period), {"production": 0.0, "consumption": 0.0, "readings": 0})
+                g['production'] += r['production']
+                g['consumption'] += r.get('consumption') or 0.0
+                g['readings'] += 1
+                capacities.setdefault((scope, period), {})[f"panels.{r['panel_id']}"] = info['capacity']
+        if groups:
+            await db[collection_name].bulk_write([
+                UpdateOne(
+                    {"scope": scope, "period": period},
+                    {"$inc": g, "$set": capacities[(scope, period)]},
+                    upsert=True
+                )
+                for (scope, period), g in groups.items()
+            ], ordered=False)
+
+def period_capacity(doc: dict) -> float:
+    """Capacidad de los paneles que enviaron lecturas en el período (cada panel una vez)"""
+    return sum(doc.get('panels', {}).values())
+
+def period_hours(granularity: str, period: datetime, now: datetime) -> float:
+    """Horas del período; el período en curso cuenta solo hasta `now`"""
+    if period.tzinfo is None:
+        period = period.replace(tzinfo=timezone.utc)
+    period_end = period + timedelta(days=1) if granularity == "day" else _next_month(period)
+    return max(0.0, (min(period_end, now) - period).total_seconds() / 3600)
+
+def analytics_period(label: str, production: float, consumption: float, capacity_hours: float) -> AnalyticsPeriod:
+    """Calcular ahorro y eficiencia (producción / capacidad × horas) de un período"""
+    return AnalyticsPeriod(
+        period=label,
+        production=round(production, 3),
+        consumption=round(consumption, 3),
+        savings=round(production - consumption, 3),
+        efficiency=round(production / capacity_hours * 100, 2) if capacity_hours else 0.0
+    )
+
+
+# ==================== FEED EN TIEMPO REAL ====================
+
+class EnergySubscriber:
+    """
+    Cliente WebSocket suscrito al feed de energía.
+
+    Guarda la versión y la expiración del token con el que se conectó para que
+    el hub pueda cerrar la conexión cuando el token deja de ser válido.
+    """
+
+    def __init__(self, websocket: WebSocket, user: User, token_version: int, expires_at: float):
+        self.websocket = websocket
+        self.user_id = user.id
+        self.is_admin = user.role == "admin"
+        self.token_version = token_version
+        self.expires_at = expires_at
+        # Código de cierre pendiente (p. ej. 1008 al revocar o expirar el token)
+        self.close_code: Optional[int] = None
+        # Última actualización pendiente por panel (se fusionan entre envíos)
+        self.pending = {}
+        self.ready = asyncio.Event()
+
+    def close(self, code: int) -> None:
+        """Pedir al bucle de envío que cierre la conexión"""
+        if self.close_code is None:
+            self.close_code = code
+            self.ready.set()
+
+class EnergyHub:
+    """
+    Pub/sub en proceso para el feed de producción en tiempo real.
+
+    La ingesta publica lecturas sin esperar; cada `push_interval` el hub fusiona
+    la última lectura de cada panel, resuelve su propietario y la entrega solo
+    a los suscriptores con acceso (los admin reciben todo). Cada cliente guarda
+    como máximo una actualización por panel, así que un cliente lento no acumula
+    memoria; si un envío supera `send_timeout`, se cierra su conexión.
+
+    En cada intervalo también se revisa el token de cada suscriptor: si expiró
+    o fue revocado (cambio de rol o usuario eliminado), la conexión se cierra
+    con 1008 y el cliente debe reconectar con un token nuevo.
+    """
+
+    def __init__(self, push_interval: float, send_timeout: float):
+        self.push_interval = push_interval
+        self.send_timeout = send_timeout
+        self.subscribers = set()
+        self.published = 0
+        self.dropped_clients = 0
+        self.revoked_clients = 0
+        self._incoming = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def publish(self, readings: List[dict]) -> None:
+        """Registrar lecturas nuevas (solo se conserva la última por panel)"""
+        if not self.subscribers:
+            return
+        for r in readings:
+            self._incoming[r['panel_id']] = r
+        self.published += len(readings)
+
+    def _expire_subscribers(self) -> None:
+        now = time.time()
+        for sub in self.subscribers:
+            if sub.close_code is None and (
+                sub.expires_at <= now or token_revocations.is_revoked(sub.user_id, sub.token_version)
+            ):
+                self.revoked_clients += 1
+                sub.close(1008)
+
+    def disconnect_user(self, user_id: str) -> None:
+        """Cerrar las conexiones de un usuario (cambio de rol o eliminación)"""
+        for sub in self.subscribers:
+            if sub.user_id == user_id and sub.close_code is None:
+                self.revoked_clients += 1
+                sub.close(1008)
+
+    async def _dispatch(self) -> None:
+        if not self._incoming or not self.subscribers:
+            self._incoming.clear()
+            return
+        incoming, self._incoming = self._incoming, {}
+        panels = await panel_directory.resolve(incoming.keys())
+        for panel_id, r in incoming.items():
+            info = panels.get(panel_id)
+            owner = info['user_id'] if info else None
+            update = {
+                "panel_id": panel_id,
+                "production": r['production'],
+                "temperature": r.get('temperature'),
+                "timestamp": r['timestamp'].isoformat()
+            }
+            for sub in self.subscribers:
+                if sub.close_code is not None:
+                    continue
+                if sub.is_admin or (owner is not None and owner == sub.user_id):
+                    sub.pending[panel_id] = update
+                    sub.ready.set()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.push_interval)
+            try:
+                self._expire_subscribers()
+                await self._dispatch()
+            except Exception:
+                logger.exception("Error distribuyendo actualizaciones de energía")
+
+    def start(self) -> None:
+        """Iniciar la tarea de distribución"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Detener la tarea de distribución"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def serve(self, sub: EnergySubscriber) -> None:
+        """Enviar al cliente sus actualizaciones hasta que se desconecte"""
+        self.subscribers.add(sub)
+        try:
+            while True:
+                await sub.ready.wait()
+                sub.ready.clear()
+                if sub.close_code is not None:
+                    await sub.websocket.close(code=sub.close_code)
+                    return
+                updates, sub.pending = list(sub.pending.values()), {}
+                try:
+                    await asyncio.wait_for(
+                        sub.websocket.send_json({"type": "energy_update", "panels": updates}),
+                        timeout=self.send_timeout
+                    )
+                except asyncio.TimeoutError:
+                    self.dropped_clients += 1
+                    logger.warning(f"Cliente WebSocket lento desconectado (usuario {sub.user_id})")
+                    await sub.websocket.close(code=1013)
+                    return
+        finally:
+            self.subscribers.discard(sub)
+
+    def stats(self) -> dict:
+        """Métricas del hub"""
+        return {
+            "subscribers": len(self.subscribers),
+            "push_interval_seconds": self.push_interval,
+            "published": self.published,
+            "dropped_clients": self.dropped_clients,
+            "revoked_clients": self.revoked_clients
+        }
+
+energy_hub = EnergyHub(ENERGY_WS_PUSH_INTERVAL_SECONDS, ENERGY_WS_SEND_TIMEOUT_SECONDS)
+
+@api_router.websocket("/ws/energy")
+async def energy_feed(websocket: WebSocket, token: str = Query(...)):
+    """
+    Feed de producción en tiempo real
+    
+    Autenticación con el token JWT en el parámetro `token`. Envía mensajes
+    {"type": "energy_update", "panels": [...]} con las lecturas de los paneles del usuario.
+    La conexión se cierra con 1008 cuando el token expira o se revoca.
+    """
+    try:
+        payload = decode_access_token(token)
+        user = await load_token_user(payload["sub"], payload.get("ver", 0))
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    
+    await websocket.accept()
+    sub = EnergySubscriber(websocket, user, payload.get("ver", 0), payload["exp"])
+    sender = asyncio.create_task(energy_hub.serve(sub))
+    try:
+        # El cliente no envía datos; se lee solo para detectar la desconexión
+        while True:
+            await websocket.receive_text()
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        sender.cancel()
+
+
+# ==================== MOTOR DE ALERTAS ====================
+
+ALERT_LABELS = {
+    "low_production": "Producción baja",
+    "high_temperature": "Temperatura alta",
+    "offline": "Panel sin conexión",
+}
+
+class AlertEngine:
+    """
+    Evalúa cada lectura ingerida contra los umbrales de su propietario.
+
+    Los umbrales habilitados se mantienen compilados en memoria
+    (user_id -> {alert_type: umbral}) y se refrescan periódicamente desde
+    MongoDB. Una alerta se emite al entrar en la condición y se cierra cuando el
+    panel vuelve a la normalidad. Las escrituras se agrupan en lotes.
+
+    El estado compartido vive en MongoDB para que varios workers coincidan:
+    - cada alerta abierta (active=True) es única por (panel_id, alert_type); se
+      abre con un upsert y se cierra con un update sin condiciones locales, así
+      que un worker cierra también las alertas abiertas por otro;
+    - `panel_last_seen` guarda la última lectura de cada panel con regla offline
+      y el instante en que pasaría a estar sin conexión (`offline_after`); la
+      comprobación periódica consulta esa colección, así que un panel que envía
+      datos a otro worker no se da por desconectado.
+    Entre dos vaciados solo se escribe el último cambio de estado de cada alerta.
+    """
+
+    def __init__(self, tick_seconds: float, offline_check_seconds: float, refresh_seconds: float):
+        self.tick_seconds = tick_seconds
+        self.offline_check_seconds = offline_check_seconds
+        self.refresh_seconds = refresh_seconds
+        self.thresholds = {}
+        self.evaluated = 0
+        self.raised = 0
+        self.resolved = 0
+        self._pending: List[UpdateOne] = []
+        # Estado (abierta/cerrada) ya encolado por alerta en el lote actual
+        self._queued_state: Dict[Tuple[str, str], bool] = {}
+        # Última lectura por panel con regla offline, pendiente de escribir
+        self._seen: Dict[str, dict] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def load_configs(self) -> None:
+        """Compilar el índice de umbrales a partir de alert_configs"""
+        thresholds = {}
+        async for cfg in db.alert_configs.find({"enabled": True}, {"_id": 0}):
+            thresholds.setdefault(cfg['user_id'], {})[cfg['alert_type']] = cfg['threshold_value']
+        self.thresholds = thresholds
+
+    def set_config(self, user_id: str, config: AlertConfig) -> None:
+        """Actualizar el índice en memoria tras guardar una configuración"""
+        user_thresholds = self.thresholds.setdefault(user_id, {})
+        if config.enabled:
+            user_thresholds[config.alert_type] = config.threshold_value
+        else:
+            user_thresholds.pop(config.alert_type, None)
+
+    def _queue(self, panel_id: str, alert_type: str, active: bool, operation: UpdateOne) -> None:
+        key = (panel_id, alert_type)
+        if self._queued_state.get(key) == active:
+            return
+        self._queued_state[key] = active
+        self._pending.append(operation)
+
+    def _raise(self, user_id: str, panel_id: str, alert_type: str, message: str) -> None:
+        # Si la alerta ya está abierta (por este u otro worker), el upsert no crea nada
+        self._queue(panel_id, alert_type, True, UpdateOne(
+            {"panel_id": panel_id, "alert_type": alert_type, "active": True},
+            {"$setOnInsert": {
+                "alert_id": str(uuid.uuid4()),
+                "user_id": user_id,
+                "message": message,
+                "timestamp": datetime.now(timezone.utc),
+                "read": False
+            }},
+            upsert=True
+        ))
+
+    def _resolve(self, panel_id: str, alert_type: str) -> None:
+        self._queue(panel_id, alert_type, False, UpdateOne(
+            {"panel_id": panel_id, "alert_type": alert_type, "active": True},
+            {"$set": {"active": False, "resolved_at": datetime.now(timezone.utc)}}
+        ))
+
+    async def evaluate(self, readings: List[dict]) -> None:
+        """Evaluar un lote de lecturas persistidas"""
+        if not self.thresholds:
+            return
+        panels = await panel_directory.resolve({r['panel_id'] for r in readings})
+        for r in readings:
+            panel_id = r['panel_id']
+            info = panels.get(panel_id)
+            owner = info['user_id'] if info else None
+            user_thresholds = self.thresholds.get(owner) if owner else None
+            if not user_thresholds:
+                continue
+            self.evaluated += 1
+
+            threshold = user_thresholds.get("low_production")
+            if threshold is not None:
+                if r['production'] < threshold:
+                    self._raise(owner, panel_id, "low_production",
+                                f"Producción baja en panel {panel_id}: {r['production']} kWh (umbral: {threshold} kWh)")
+                else:
+                    self._resolve(panel_id, "low_production")
+
+            threshold = user_thresholds.get("high_temperature")
+            temperature = r.get('temperature')
+            if threshold is not None and temperature is not None:
+                if temperature > threshold:
+                    self._raise(owner, panel_id, "high_temperature",
+                                f"Temperatura alta en panel {panel_id}: {temperature} °C (umbral: {threshold} °C)")
+                else:
+                    self._resolve(panel_id, "high_temperature")
+
+            minutes = user_thresholds.get("offline")
+            if minutes is not None:
+                self._resolve(panel_id, "offline")
+                self._seen[panel_id] = {"user_id": owner, "minutes": minutes or ALERT_OFFLINE_DEFAULT_MINUTES}
+
+    async def _record_seen(self) -> None:
+        """Guardar la última lectura de los paneles con regla offline"""
+        if not self._seen:
+            return
+        seen, self._seen = self._seen, {}
+        now = datetime.now(timezone.utc)
+        await db.panel_last_seen.bulk_write([
+            UpdateOne(
+                {"panel_id": panel_id},
+                {"$set": {
+                    "user_id": info['user_id'],
+                    "last_reading_at": now,
+                    "offline_after": now + timedelta(minutes=info['minutes']),
+                    "offline": False
+                }},
+                upsert=True
+            )
+            for panel_id, info in seen.items()
+        ], ordered=False)
+
+    async def check_offline(self) -> None:
+        """Abrir alertas offline para los paneles sin lecturas recientes en ningún worker"""
+        stale = await db.panel_last_seen.find(
+            {"offline": False, "offline_after": {"$lt": datetime.now(timezone.utc)}},
+            {"_id": 0}
+        ).limit(ALERT_OFFLINE_CHECK_BATCH).to_list(ALERT_OFFLINE_CHECK_BATCH)
+        if not stale:
+            return
+        panels = await panel_directory.resolve({doc['panel_id'] for doc in stale})
+        for doc in stale:
+            panel_id = doc['panel_id']
+            info = panels.get(panel_id)
+            if info is None or info['user_id'] != doc['user_id']:
+                # Panel eliminado o reasignado: el seguimiento empieza de nuevo con su próxima lectura
+                await db.panel_last_seen.delete_one({"panel_id": panel_id, "offline_after": doc['offline_after']})
+                continue
+            # Marcar solo si no llegó una lectura nueva desde la consulta
+            marked = await db.panel_last_seen.update_one(
+                {"panel_id": panel_id, "offline": False, "offline_after": doc['offline_after']},
+                {"$set": {"offline": True}}
+            )
+            minutes = self.thresholds.get(doc['user_id'], {}).get("offline")
+            if not marked.modified_count or minutes is None:
+                continue
+            self._raise(doc['user_id'], panel_id, "offline",
+                        f"Panel {panel_id} sin datos desde hace {minutes or ALERT_OFFLINE_DEFAULT_MINUTES:g} minutos")
+
+    async def flush(self) -> None:
+        """Escribir las aperturas y cierres de alertas pendientes en un bulk_write"""
+        try:
+            await self._record_seen()
+        except Exception:
+            logger.exception("Error al guardar la última lectura de los paneles")
+        operations, self._pending = self._pending, []
+        self._queued_state.clear()
+        # Ordenado: abrir y cerrar la misma alerta en un lote debe respetar el orden.
+        # Un upsert que choca con la alerta que otro worker abrió a la vez se omite.
+        while operations:
+            try:
+                result = await db.alerts.bulk_write(operations, ordered=True)
+                self.raised += result.upserted_count
+                self.resolved += result.modified_count
+                return
+            except BulkWriteError as e:
+                self.raised += e.details.get('nUpserted', 0)
+                self.resolved += e.details.get('nModified', 0)
+                error = e.details['writeErrors'][0]
+                if error['code'] != 11000:
+                    logger.error(f"Error al guardar alertas: {error.get('errmsg')}")
+                operations = operations[error['index'] + 1:]
+            except Exception:
+                logger.exception(f"Error al guardar {len(operations)} operaciones de alertas")
+                return
+
+    async def _run(self) -> None:
+        last_refresh = last_offline_check = time.monotonic()
+        while True:
+            await asyncio.sleep(self.tick_seconds)
+            try:
+                if time.monotonic() - last_offline_check >= self.offline_check_seconds:
+                    await self.check_offline()
+                    last_offline_check = time.monotonic()
+                await self.flush()
+                if time.monotonic() - last_refresh >= self.refresh_seconds:
+                    await self.load_configs()
+                    last_refresh = time.monotonic()
+            except Exception:
+                logger.exception("Error en el ciclo del motor de alertas")
+
+    async def start(self) -> None:
+        """Cargar configuraciones e iniciar el ciclo de ticks"""
+        await self.load_configs()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Detener el ciclo y escribir las alertas pendientes"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        """Métricas del motor de alertas"""
+        return {
+            "users_with_rules": len(self.thresholds),
+            "evaluated": self.evaluated,
+            "raised": self.raised,
+            "resolved": self.resolved,
+            "pending_writes": len(self._pending),
+            "pending_last_seen": len(self._seen)
+        }
+
+alert_engine = AlertEngine(ALERT_TICK_SECONDS, ALERT_OFFLINE_CHECK_SECONDS, ALERT_CONFIG_REFRESH_SECONDS)
+
+
+# ==================== CÁLCULO DE CO2 ====================
+
+# Totales acumulados de producción (kWh) por panel, por usuario y global,
+# actualizados en la ingesta para que el cálculo de CO2 sea O(1).
+async def update_energy_totals(readings: List[dict]) -> None:
+    """Acumular la producción de un lote en energy_totals"""
+    panels = await panel_directory.resolve({r['panel_id'] for r in readings})
+    totals = {}
+    for r in readings:
+        info = panels.get(r['panel_id'])
+        if info is None:
+            continue
+        keys = [f"panel:{r['panel_id']}", f"user:{ANALYTICS_SCOPE_ALL}"]
+        if info['user_id']:
+            keys.append(f"user:{info['user_id']}")
+        for key in keys:
+            totals[key] = totals.get(key, 0.0) + r['production']
+    if totals:
+        await db.energy_totals.bulk_write([
+            UpdateOne({"key": key}, {"$inc": {"production_kwh": value}}, upsert=True)
+            for key, value in totals.items()
+        ], ordered=False)
+
+_FORMULA_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant, ast.Name, ast.Load,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.USub, ast.UAdd
+)
+
+def compile_co2_formula(variables: Dict[str, float], expression: Optional[str] = None) -> Callable[[float], float]:
+    """
+    Validar y compilar una fórmula de CO2 una sola vez.
+
+    Solo se permiten números, variables y operaciones aritméticas. Las
+    variables se fijan al compilar, así que evaluarla solo requiere total_kwh.
+    Lanza ValueError si la fórmula no es válida; al evaluarla, un resultado
+    infinito o NaN lanza OverflowError.
+    """
+    if "total_kwh" in variables:
+        raise ValueError("total_kwh es una variable reservada")
+    if len(variables) > CO2_FORMULA_MAX_VARIABLES:
+        raise ValueError(f"La fórmula admite como máximo {CO2_FORMULA_MAX_VARIABLES} variables")
+    if expression is not None and len(expression) > CO2_FORMULA_MAX_LENGTH:
+        raise ValueError(f"La expresión supera el máximo de {CO2_FORMULA_MAX_LENGTH} caracteres")
+    if not all(math.isfinite(value) for value in variables.values()):
+        raise ValueError("Las variables de la fórmula deben ser números finitos")
+    if expression is None:
+        expression = " * ".join(["total_kwh", *variables.keys()])
+    try:
+        tree = ast.parse(expression, mode="eval")
+        for node in ast.walk(tree):
+            if not isinstance(node, _FORMULA_NODES):
+                raise ValueError(f"Operación no permitida en la fórmula: {type(node).__name__}")
+            if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+                raise ValueError("Solo se permiten constantes numéricas")
+            if isinstance(node, ast.Name) and node.id != "total_kwh" and node.id not in variables:
+                raise ValueError(f"Variable desconocida: {node.id}")
+        code = compile(tree, "<co2_formula>", "eval")
+    except SyntaxError:
+        raise ValueError("Expresión de fórmula inválida")
+    except (RecursionError, MemoryError):
+        # Anidamiento excesivo: el parser o el compilador agotan la pila o la memoria
+        raise ValueError("Expresión de fórmula demasiado compleja")
+    names = dict(variables)
+
+    def formula(total_kwh: float) -> float:
+        result = float(eval(code, {"__builtins__": {}}, {**names, "total_kwh": total_kwh}))
+        # Un desbordamiento da inf/nan, que la respuesta JSON convertiría en null
+        if not math.isfinite(result):
+            raise OverflowError("Resultado de la fórmula no finito")
+        return result
+
+    return formula
+
+class CO2FormulaCache:
+    """
+    Fórmulas compiladas por usuario.
+
+    Se compilan al guardarlas o al primer uso; el TTL hace que otros workers
+    vean las fórmulas nuevas sin volver a compilar en cada cálculo.
+    """
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._formulas = {}
+        self.default = compile_co2_formula({"kwh_factor": CO2_DEFAULT_KG_PER_KWH})
+
+    async def get(self, user_id: str) -> Callable[[float], float]:
+        """Obtener la fórmula compilada del usuario"""
+        entry = self._formulas.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        doc = await db.co2_formulas.find_one({"user_id": user_id}, {"_id": 0})
+        formula = self.default
+        if doc:
+            try:
+                formula = compile_co2_formula(doc.get('formula_variables', {}), doc.get('expression'))
+            except ValueError:
+                logger.error(f"Fórmula CO2 inválida guardada para usuario {user_id}")
+        self.set(user_id, formula)
+        return formula
+
+    def set(self, user_id: str, formula: Callable[[float], float]) -> None:
+        """Guardar la fórmula compilada"""
+        self._formulas[user_id] = (time.monotonic() + self.ttl_seconds, formula)
+
+co2_formula_cache = CO2FormulaCache(CO2_FORMULA_CACHE_TTL_SECONDS)
+
+
+# ==================== INGESTA DE TELEMETRÍA ====================
+
+class ReadingBuffer:
+    """
+    Buffer en memoria para lecturas de paneles.
+
+    Las lecturas se acumulan y se escriben en lotes con insert_many(ordered=False)
+    cuando se alcanza `batch_size` o cada `flush_interval` segundos. Si el buffer
+    está lleno, `add` rechaza las lecturas para que el endpoint responda 429.
+    Tras cada escritura se invocan los `on_persisted` (agregados, etc.).
+    """
+
+    def __init__(self, collection_name: str, max_size: int, batch_size: int, flush_interval: float):
+        self.collection_name = collection_name
+        # Funciones async que reciben cada lote de lecturas ya persistidas
+        self.on_persisted = []
+        self.max_size = max_size
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.accepted = 0
+        self.rejected = 0
+        self.flushed = 0
+        self.failed = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+        self._items: List[dict] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def add(self, docs: List[dict]) -> bool:
+        """Encolar lecturas; devuelve False si no caben en el buffer"""
+        if len(self._items) + len(docs) > self.max_size:
+            self.rejected += len(docs)
+            return False
+        self._items.extend(docs)
+        self.accepted += len(docs)
+        if len(self._items) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+        return True
+
+    async def flush(self) -> None:
+        """Escribir en MongoDB todas las lecturas pendientes"""
+        if not self._items:
+            return
+        items, self._items = self._items, []
+        start = time.perf_counter()
+        collection = ingest_db[self.collection_name]
+        for i in range(0, len(items), self.batch_size):
+            chunk = items[i:i + self.batch_size]
+            try:
+                await collection.insert_many(chunk, ordered=False)
+                persisted = chunk
+            except BulkWriteError as e:
+                failed_indexes = {err['index'] for err in e.details.get('writeErrors', [])}
+                persisted = [doc for j, doc in enumerate(chunk) if j not in failed_indexes]
+                logger.error(f"Error parcial al escribir lecturas: {len(failed_indexes)} descartadas")
+            except Exception:
+                self.failed += len(chunk)
+                logger.exception(f"Error al escribir {len(chunk)} lecturas")
+                continue
+            self.flushed += len(persisted)
+            self.failed += len(chunk) - len(persisted)
+            for hook in self.on_persisted:
+                try:
+                    await hook(persisted)
+                except Exception:
+                    logger.exception(f"Error procesando lote de lecturas en {hook.__name__}")
+        self.flushes += 1
+        self.last_flush_ms = (time.perf_counter() - start) * 1000
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        """Iniciar la tarea de escritura periódica"""
+        if self._task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Detener la tarea y escribir lo pendiente"""
+        # Se detiene con una bandera y no con cancel(): en Python 3.11 wait_for
+        # descarta la cancelación si el evento ya estaba activo y el bucle seguiría
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        """Métricas del buffer de ingesta"""
+        return {
+            "buffered": len(self._items),
+            "max_size": self.max_size,
+            "batch_size": self.batch_size,
+            "flush_interval_seconds": self.flush_interval,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "flushed": self.flushed,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "last_flush_ms": round(self.last_flush_ms, 2)
+        }
+
+reading_buffer = ReadingBuffer(READINGS_COLLECTION, INGEST_BUFFER_MAX_SIZE, INGEST_BATCH_SIZE, INGEST_FLUSH_INTERVAL_SECONDS)
+reading_buffer.on_persisted.append(update_rollups)
+reading_buffer.on_persisted.append(update_analytics)
+reading_buffer.on_persisted.append(alert_engine.evaluate)
+reading_buffer.on_persisted.append(update_energy_totals)
+
+def verify_external_api_key(api_key: str = Query(..., description="API key de la app externa")) -> None:
+    """Validar la API key de la app externa"""
+    if not EXTERNAL_APP_API_KEY:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Ingesta de telemetría deshabilitada: falta configurar EXTERNAL_APP_API_KEY"
+        )
+    if not secrets.compare_digest(api_key, EXTERNAL_APP_API_KEY):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="API key inválida"
+        )
+
+@api_router.post("/external/panel-data", tags=["Telemetría"])
+async def receive_panel_data(
+    readings: Union[PanelReading, List[PanelReading]],
+    _: None = Depends(verify_external_api_key)
+):
+    """
+    Recibir lecturas de paneles desde la app externa
+    
+    Acepta una lectura o una lista de lecturas:
+    - **panel_id**: Identificador del panel
+    - **production**: Producción en kWh
+    - **temperature**: Temperatura en °C (opcional)
+    - **timestamp**: Fecha de la lectura (opcional, por defecto ahora)
+    """
+    if isinstance(readings, PanelReading):
+        readings = [readings]
+    
+    docs = [r.model_dump() for r in readings]
+    if not reading_buffer.add(docs):
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Buffer de ingesta lleno, reintente en unos segundos",
+            headers={"Retry-After": "1"}
+        )
+    energy_hub.publish(docs)
+    
+    return {"status": "success", "message": "Datos recibidos", "accepted": len(docs)}
+
+@api_router.get("/panels/{panel_id}/production", response_model=List[RollupPoint], tags=["Telemetría"])
+async def get_panel_production(
+    panel_id: str,
+    granularity: Literal["5m", "1h", "1d"] = "1h",
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    current_user: TokenClaims = Depends(get_token_claims)
+):
+    """
+    Serie de producción y temperatura de un panel
+    
+    Se lee de los agregados precalculados, nunca de las lecturas crudas.
+    - **granularity**: 5m, 1h o 1d
+    - **from** / **to**: Rango de fechas (opcional)
+    """
+    panel = await db.panels.find_one({"id": panel_id}, {"_id": 0, "user_id": 1})
+    if not panel:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Panel no encontrado"
+        )
+    if current_user.role != "admin" and panel.get('user_id') != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="No tiene acceso a este panel"
+        )
+    
+    docs = await find_rollups([panel_id], granularity, start, end)
+    return [rollup_to_point(d) for d in docs]
+
+@api_router.get("/ingestion/stats", tags=["Telemetría"])
+async def ingestion_stats(admin: TokenClaims = Depends(get_admin_claims)):
+    """Métricas del buffer de ingesta (solo admin)"""
+    return {
+        "reading_buffer": reading_buffer.stats(),
+        "energy_hub": energy_hub.stats(),
+        "alert_engine": alert_engine.stats()
+    }
+
+
+# ==================== RUTAS DE ANALÍTICA ====================
+
+@api_router.get("/analytics/summary", response_model=AnalyticsSummary, tags=["Analítica"])
+async def analytics_summary(
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    granularity: Literal["day", "month"] = "month",
+    current_user: TokenClaims = Depends(get_token_claims)
+):
+    """
+    Resumen de producción, consumo, ahorro y eficiencia por período
+    
+    Admin ve todos los paneles, usuarios solo los suyos. La eficiencia es la
+    producción entre la capacidad de los paneles por las horas del período.
+    - **from** / **to**: Rango de fechas (opcional); incluye los períodos que contienen ambos extremos
+    - **granularity**: day o month
+    
+    Devuelve como máximo ANALYTICS_MAX_PERIODS períodos, los más recientes del rango.
+    """
+    collection_name, floor = ANALYTICS_AGGREGATES[granularity]
+    scope = ANALYTICS_SCOPE_ALL if current_user.role == "admin" else current_user.id
+    query = {"scope": scope}
+    period_range = {}
+    # Ambos extremos se llevan al inicio de su período: se incluyen los períodos
+    # que contienen `from` y `to`
+    if start:
+        period_range['$gte'] = floor(start.astimezone(timezone.utc) if start.tzinfo else start)
+    if end:
+        period_range['$lte'] = floor(end.astimezone(timezone.utc) if end.tzinfo else end)
+    if period_range:
+        query['period'] = period_range
+    
+    docs = await analytics_db[collection_name].find(query, {"_id": 0}).sort(
+        "period", DESCENDING
+    ).limit(ANALYTICS_MAX_PERIODS).to_list(ANALYTICS_MAX_PERIODS)
+    docs.reverse()
+    
+    now = datetime.now(timezone.utc)
+    periods = []
+    totals = {"production": 0.0, "consumption": 0.0, "capacity_hours": 0.0}
+    for d in docs:
+        label = d['period'].strftime("%Y-%m" if granularity == "month" else "%Y-%m-%d")
+        capacity_hours = period_capacity(d) * period_hours(granularity, d['period'], now)
+        periods.append(analytics_period(label, d['production'], d['consumption'], capacity_hours))
+        totals['production'] += d['production']
+        totals['consumption'] += d['consumption']
+        totals['capacity_hours'] += capacity_hours
+    
+    return AnalyticsSummary(
+        granularity=granularity,
+        periods=periods,
+        totals=analytics_period("total", totals['production'], totals['consumption'], totals['capacity_hours'])
+    )
+
+
+# ==================== RUTAS DE ALERTAS ====================
+
+@api_router.post("/alerts/config", tags=["Alertas"])
+async def configure_alert(config: AlertConfig, current_user: User = Depends(get_current_user)):
+    """
+    Configurar una alerta para los paneles del usuario actual
+    
+    - **alert_type**: low_production, high_temperature u offline
+    - **threshold_value**: Umbral (kWh, °C o minutos sin datos)
+    - **enabled**: Activar o desactivar la alerta
+    """
+    await db.alert_configs.update_one(
+        {"user_id": current_user.id, "alert_type": config.alert_type},
+        {"$set": {"threshold_value": config.threshold_value, "enabled": config.enabled}},
+        upsert=True
+    )
+    alert_engine.set_config(current_user.id, config)
+    
+    logger.info(f"Alerta {config.alert_type} configurada para usuario {current_user.id}")
+    
+    return {"message": "Alerta configurada correctamente", **config.model_dump()}
+
+@api_router.get("/alerts", response_model=List[AlertResponse], tags=["Alertas"])
+async def list_alerts(
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: TokenClaims = Depends(get_token_claims)
+):
+    """
+    Listar las alertas más recientes del usuario actual
+    """
+    alerts = await db.alerts.find({"user_id": current_user.id}, {"_id": 0}).sort("timestamp", DESCENDING).to_list(limit)
+    return [
+        AlertResponse(**{**a, "timestamp": a['timestamp'].replace(tzinfo=timezone.utc).isoformat()})
+        for a in alerts
+    ]
+
+
+# ==================== RUTAS DE CO2 ====================
+
+@api_router.post("/co2/formula", tags=["CO2"])
+async def save_co2_formula(formula_data: CO2Formula, current_user: User = Depends(get_current_user)):
+    """
+    Guardar la fórmula de CO2 evitado del usuario actual
+    
+    - **formula_variables**: Variables numéricas (p. ej. kwh_factor)
+    - **expression**: Expresión opcional; por defecto total_kwh × todas las variables
+    """
+    try:
+        formula = compile_co2_formula(formula_data.formula_variables, formula_data.expression)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    
+    await db.co2_formulas.update_one(
+        {"user_id": current_user.id},
+        {"$set": formula_data.model_dump()},
+        upsert=True
+    )
+    co2_formula_cache.set(current_user.id, formula)
+    
+    logger.info(f"Fórmula CO2 actualizada para usuario {current_user.id}")
+    
+    return {"message": "Fórmula guardada correctamente", **formula_data.model_dump()}
+
+@api_router.get("/co2/calculate", response_model=CO2Result, tags=["CO2"])
+async def calculate_co2(panel_id: Optional[str] = None, current_user: TokenClaims = Depends(get_token_claims)):
+    """
+    Calcular el CO2 evitado con la fórmula del usuario
+    
+    Usa la producción acumulada de los paneles del usuario (todos para admin)
+    o de un solo panel con **panel_id**.
+    """
+    if panel_id:
+        panel = await db.panels.find_one({"id": panel_id}, {"_id": 0, "user_id": 1})
+        if not panel:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Panel no encontrado"
+            )
+        if current_user.role != "admin" and panel.get('user_id') != current_user.id:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="No tiene acceso a este panel"
+            )
+        key = f"panel:{panel_id}"
+    elif current_user.role == "admin":
+        key = f"user:{ANALYTICS_SCOPE_ALL}"
+    else:
+        key = f"user:{current_user.id}"
+    
+    totals = await db.energy_totals.find_one({"key": key}, {"_id": 0, "production_kwh": 1})
+    total_kwh = totals['production_kwh'] if totals else 0.0
+    formula = await co2_formula_cache.get(current_user.id)
+    try:
+        co2_kg = formula(total_kwh)
+    except (ArithmeticError, ValueError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="La fórmula de CO2 no se puede evaluar con los datos actuales"
+        )
+    
+    return CO2Result(
+        total_production_kwh=round(total_kwh, 3),
+        co2_avoided_kg=round(co2_kg, 3),
+        co2_avoided_tons=round(co2_kg / 1000, 6)
+    )
+
+
+# ==================== SALUD DE LA BASE DE DATOS ====================
+
+class DatabaseHealth:
+    """
+    Ping periódico a MongoDB en segundo plano.
+
+    Las sondas leen el último resultado en lugar de hacer su propio ping; si el
+    resultado es más antiguo que `max_age` (p. ej. el ping se quedó colgado) se
+    considera no saludable.
+    """
+
+    def __init__(self, interval: float, timeout: float, max_age: float):
+        self.interval = interval
+        self.timeout = timeout
+        self.max_age = max_age
+        self.ok = False
+        self.latency_ms: Optional[float] = None
+        self.error: Optional[str] = None
+        self.checked_at: Optional[float] = None
+        self.consecutive_failures = 0
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    async def check(self) -> None:
+        """Hacer un ping y guardar el resultado"""
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(db.command("ping"), timeout=self.timeout)
+            self.ok = True
+            self.error = None
+            self.consecutive_failures = 0
+        except Exception as e:
+            if self.ok:
+                logger.warning(f"⚠️ MongoDB no responde al ping: {e!r}")
+            self.ok = False
+            self.error = repr(e)
+            self.consecutive_failures += 1
+        self.latency_ms = (time.perf_counter() - start) * 1000
+        self.checked_at = time.monotonic()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            await self.check()
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        """Iniciar el ping periódico"""
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Detener el ping periódico"""
+        if self._task is not None:
+            # La bandera cubre una cancelación descartada por wait_for durante el ping
+            self._stopping = True
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def is_healthy(self) -> bool:
+        """Último ping correcto y reciente"""
+        return self.ok and self.checked_at is not None and time.monotonic() - self.checked_at <= self.max_age
+
+    def state(self) -> dict:
+        """Resultado del último ping"""
+        return {
+            "ok": self.is_healthy(),
+            "latency_ms": round(self.latency_ms, 2) if self.latency_ms is not None else None,
+            "age_seconds": round(time.monotonic() - self.checked_at, 2) if self.checked_at is not None else None,
+            "consecutive_failures": self.consecutive_failures,
+            "error": self.error
+        }
+
+database_health = DatabaseHealth(HEALTH_PING_INTERVAL_SECONDS, HEALTH_PING_TIMEOUT_SECONDS, HEALTH_MAX_PING_AGE_SECONDS)
+
+
+# ==================== RUTAS BÁSICAS ====================
+
+@api_router.get("/", tags=["General"])
+async def root():
+    """Información de la API"""
+    return {
+        "message": "EFFITECH API - Sistema de Gestión de Energía Solar",
+        "version": "1.0.0",
+        "status": "operational"
     }
 
+@api_router.get("/cache/stats", tags=["General"])
+async def cache_stats(admin: TokenClaims = Depends(get_admin_claims)):
+    """Estadísticas de la caché de usuarios y de la tabla de revocación (solo admin)"""
+    return {"user_cache": user_cache.stats(), "token_revocations": token_revocations.stats()}
+
+@api_router.get("/security/hasher/stats", tags=["General"])
+async def hasher_stats(admin: TokenClaims = Depends(get_admin_claims)):
+    """Métricas del pool de hashing de contraseñas (solo admin)"""
+    return {"password_hasher": password_hasher.stats()}
+
+@api_router.get("/security/rate-limit/stats", tags=["General"])
+async def rate_limit_stats(admin: TokenClaims = Depends(get_admin_claims)):
+    """Estado de los limitadores de login y registro del worker que responde (solo admin)"""
+    return {"ip": auth_ip_limiter.stats(), "email": auth_email_limiter.stats(), "pid": os.getpid()}
+
 @api_router.get("/health", tags=["General"])
 async def health_check():
-    """Verificar estado del servidor"""
+    """Verificar estado del servidor (según el último ping a MongoDB)"""
+    database_ok = database_health.is_healthy()
     return {
-        "status": "healthy",
-        "database": "connected",
+        "status": "healthy" if database_ok else "degraded",
+        "database": "connected" if database_ok else "disconnected",
         "timestamp": datetime.now(timezone.utc).isoformat()
     }
 
+@api_router.get("/health/live", tags=["General"])
+async def liveness_probe():
+    """Sonda de liveness: el proceso responde (no consulta dependencias)"""
+    return {"status": "alive"}
+
+@api_router.get("/health/ready", tags=["General"])
+async def readiness_probe():
+    """
+    Sonda de readiness: MongoDB accesible y buffer de ingesta con espacio.
+    
+    Solo lee el estado cacheado por el ping en segundo plano, por lo que una
+    ráfaga de sondas no genera consultas a la base de datos. Devuelve 503 si no está lista.
+    """
+    database = database_health.state()
+    buffered = len(reading_buffer)
+    ingestion_ok = buffered < reading_buffer.max_size
+    ready = database_health.is_healthy() and ingestion_ok
+    max_pool_size = client.options.pool_options.max_pool_size
+    checked_out = int(MONGO_POOL_CHECKED_OUT.value())
+    body = {
+        "status": "ready" if ready else "not_ready",
+        "database": database,
+        "pool": {
+            "max_pool_size": max_pool_size,
+            "open_connections": int(MONGO_POOL_CONNECTIONS.value()),
+            "checked_out": checked_out,
+            "utilization": round(checked_out / max_pool_size, 3) if max_pool_size else 0.0
+        },
+        "ingestion": {
+            "buffered": buffered,
+            "max_size": reading_buffer.max_size,
+            "utilization": round(buffered / reading_buffer.max_size, 3) if reading_buffer.max_size else 0.0
+        }
+    }
+    return ORJSONResponse(body, status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE)
+
+@api_router.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Métricas en formato de texto de Prometheus"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# ==================== ÍNDICES DE BASE DE DATOS ====================
+
+# (colección, claves, opciones) - create_index es idempotente
+DB_INDEXES = [
+    ("users", [("email", ASCENDING)], {"unique": True, "name": "users_email_unique"}),
+    ("users", [("id", ASCENDING)], {"unique": True, "name": "users_id_unique"}),
+    ("panels", [("id", ASCENDING)], {"unique": True, "name": "panels_id_unique"}),
+    ("panels", [("user_id", ASCENDING)], {"name": "panels_user_id"}),
+    # Paginación keyset (created_at, id) y filtros del listado
+    ("users", [("created_at", DESCENDING), ("id", DESCENDING)], {"name": "users_created_at_id"}),
+    ("panels", [("created_at", DESCENDING), ("id", DESCENDING)], {"name": "panels_created_at_id"}),
+    ("panels", [("user_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {"name": "panels_user_id_created_at_id"}),
+    ("panels", [("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {"name": "panels_status_created_at_id"}),
+    # Agregados de lecturas: un documento por (panel, intervalo)
+    ("panel_readings_5m", [("panel_id", ASCENDING), ("bucket", ASCENDING)], {"unique": True, "name": "rollup_5m_panel_bucket"}),
+    ("panel_readings_1h", [("panel_id", ASCENDING), ("bucket", ASCENDING)], {"unique": True, "name": "rollup_1h_panel_bucket"}),
+    ("panel_readings_1d", [("panel_id", ASCENDING), ("bucket", ASCENDING)], {"unique": True, "name": "rollup_1d_panel_bucket"}),
+    # Agregados de analítica: un documento por (alcance, período)
+    ("analytics_daily", [("scope", ASCENDING), ("period", ASCENDING)], {"unique": True, "name": "analytics_daily_scope_period"}),
+    ("analytics_monthly", [("scope", ASCENDING), ("period", ASCENDING)], {"unique": True, "name": "analytics_monthly_scope_period"}),
+    # Alertas
+    ("alert_configs", [("user_id", ASCENDING), ("alert_type", ASCENDING)], {"unique": True, "name": "alert_configs_user_type"}),
+    ("alerts", [("user_id", ASCENDING), ("timestamp", DESCENDING)], {"name": "alerts_user_timestamp"}),
+    # Una sola alerta abierta por (panel, tipo) entre todos los workers
+    ("alerts", [("panel_id", ASCENDING), ("alert_type", ASCENDING)],
+     {"unique": True, "partialFilterExpression": {"active": True}, "name": "alerts_active_panel_type"}),
+    # Última lectura por panel para detectar paneles sin conexión
+    ("panel_last_seen", [("panel_id", ASCENDING)], {"unique": True, "name": "panel_last_seen_panel"}),
+    ("panel_last_seen", [("offline", ASCENDING), ("offline_after", ASCENDING)], {"name": "panel_last_seen_offline_after"}),
+    # CO2
+    ("energy_totals", [("key", ASCENDING)], {"unique": True, "name": "energy_totals_key"}),
+    ("co2_formulas", [("user_id", ASCENDING)], {"unique": True, "name": "co2_formulas_user"}),
+    # Revocación de tokens: una entrada por usuario, se borra al caducar
+    ("token_revocations", [("user_id", ASCENDING)], {"unique": True, "name": "token_revocations_user"}),
+    ("token_revocations", [("expires_at", ASCENDING)], {"expireAfterSeconds": 0, "name": "token_revocations_ttl"}),
+    # Tokens de actualización: búsqueda por hash, revocación por sesión o usuario y borrado al caducar
+    ("refresh_tokens", [("token_hash", ASCENDING)], {"unique": True, "name": "refresh_tokens_hash_unique"}),
+    ("refresh_tokens", [("family_id", ASCENDING)], {"name": "refresh_tokens_family"}),
+    ("refresh_tokens", [("user_id", ASCENDING)], {"name": "refresh_tokens_user"}),
+    ("refresh_tokens", [("expires_at", ASCENDING)], {"expireAfterSeconds": 0, "name": "refresh_tokens_ttl"}),
+]
+
+async def ensure_indexes():
+    """Crear los índices necesarios si no existen"""
+    start = time.perf_counter()
+    for collection, keys, options in DB_INDEXES:
+        try:
+            await db[collection].create_index(keys, **options)
+        except OperationFailure as e:
+            # Por ejemplo, datos duplicados que impiden un índice único
+            logger.error(f"No se pudo crear el índice {options['name']} en {collection}: {e}")
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    logger.info(f"🗂️ Índices verificados ({len(DB_INDEXES)}) en {elapsed_ms:.1f} ms")
+
 
 # ==================== CONFIGURACIÓN DE LA APLICACIÓN ====================
 
@@ -661,16 +3874,42 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"],
 )
 
+# Métricas por petición (se añade después de CORS para medir también su coste)
+app.add_middleware(MetricsMiddleware)
+
 @app.on_event("startup")
 async def startup_event():
     """Evento al iniciar la aplicación"""
     logger.info("🚀 EFFITECH API iniciada")
-    logger.info(f"📊 Base de datos: {os.environ['DB_NAME']}")
+    logger.info(f"📊 Base de datos: {mongo_settings.db_name}")
+    logger.info(f"🔌 Configuración de MongoDB: {describe_mongo_config()}")
+    if not EXTERNAL_APP_API_KEY:
+        logger.warning("⚠️ EXTERNAL_APP_API_KEY no está configurada: la ingesta de telemetría queda deshabilitada")
+    database_health.start()
+    await ensure_readings_collection()
+    await ensure_indexes()
+    await token_revocations.load()
+    token_revocations.start()
+    await collection_versions.load()
+    collection_versions.start()
+    run_in_background(backfill_panel_owner_names(), "completar nombres de propietario en paneles")
+    run_in_background(migrate_created_at_dates(), "migrar created_at a fechas BSON")
+    reading_buffer.start()
+    energy_hub.start()
+    await alert_engine.start()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
     """Cerrar conexión a la base de datos"""
+    await database_health.stop()
+    await token_revocations.stop()
+    await collection_versions.stop()
+    await energy_hub.stop()
+    await reading_buffer.stop()
+    await alert_engine.stop()
+    password_hasher.shutdown()
     client.close()
     logger.info("🔒 Conexión a base de datos cerrada")
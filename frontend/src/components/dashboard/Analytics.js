@@ -1,26 +1,74 @@
-import React from 'react';
+import React, { useState, useEffect } from 'react';
 import { DashboardLayout } from './DashboardLayout';
 import { Card } from '../ui/card';
-import { BarChart3, TrendingUp, Download, Calendar } from 'lucide-react';
+import { BarChart3, TrendingUp, TrendingDown, Download, Calendar } from 'lucide-react';
 import { Button } from '../ui/button';
+import { toast } from 'sonner';
+import axios from 'axios';
 
-const monthlyData = [
-  { month: 'Ene', production: 4200, consumption: 3800, savings: 400 },
-  { month: 'Feb', production: 4500, consumption: 4100, savings: 400 },
-  { month: 'Mar', production: 5200, consumption: 4300, savings: 900 },
-  { month: 'Abr', production: 5800, consumption: 4500, savings: 1300 },
-  { month: 'May', production: 6200, consumption: 4700, savings: 1500 },
-  { month: 'Jun', production: 6500, consumption: 4900, savings: 1600 },
-];
+const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
+const MONTHS = ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun', 'Jul', 'Ago', 'Sep', 'Oct', 'Nov', 'Dic'];
+const RANGE_MONTHS = 6;
 
-const performanceMetrics = [
-  { label: 'Producción Diaria Promedio', value: '218 kWh', change: '+12%', trend: 'up' },
-  { label: 'Eficiencia Energética', value: '94.2%', change: '+2.1%', trend: 'up' },
-  { label: 'Compensación de Carbono', value: '4.8 tons CO₂', change: '+15%', trend: 'up' },
-  { label: 'Ahorro en Costos', value: '$2,340', change: '+18%', trend: 'up' },
-];
+const formatNumber = (value, digits = 0) =>
+  value.toLocaleString('es-ES', { maximumFractionDigits: digits });
+
+const percentChange = (current, previous) => {
+  if (!previous) return null;
+  return ((current - previous) / Math.abs(previous)) * 100;
+};
 
 export const Analytics = () => {
+  const [summary, setSummary] = useState(null);
+
+  useEffect(() => {
+    const from = new Date();
+    from.setUTCMonth(from.getUTCMonth() - (RANGE_MONTHS - 1), 1);
+    from.setUTCHours(0, 0, 0, 0);
+
+    axios.get(`${API}/analytics/summary`, {
+      params: { granularity: 'month', from: from.toISOString() }
+    })
+      .then((response) => setSummary(response.data))
+      .catch(() => toast.error('Error al cargar analítica'));
+  }, []);
+
+  const monthlyData = (summary?.periods || []).map((p) => ({
+    month: MONTHS[parseInt(p.period.slice(5, 7), 10) - 1],
+    production: Math.round(p.production),
+    consumption: Math.round(p.consumption),
+    savings: Math.round(p.savings),
+    efficiency: p.efficiency
+  }));
+  const totals = summary?.totals || { production: 0, consumption: 0, savings: 0, efficiency: 0 };
+  const last = monthlyData[monthlyData.length - 1];
+  const previous = monthlyData[monthlyData.length - 2];
+  const days = RANGE_MONTHS * 30;
+
+  const performanceMetrics = [
+    {
+      label: 'Producción Diaria Promedio',
+      value: `${formatNumber(totals.production / days)} kWh`,
+      change: last && previous ? percentChange(last.production, previous.production) : null
+    },
+    {
+      label: 'Eficiencia Energética',
+      value: `${formatNumber(totals.efficiency, 1)}%`,
+      change: last && previous ? percentChange(last.efficiency, previous.efficiency) : null
+    },
+    {
+      label: 'Consumo Total',
+      value: `${formatNumber(totals.consumption)} kWh`,
+      change: last && previous ? percentChange(last.consumption, previous.consumption) : null
+    },
+    {
+      label: 'Energía Ahorrada',
+      value: `${formatNumber(totals.savings)} kWh`,
+      change: last && previous ? percentChange(last.savings, previous.savings) : null
+    },
+  ];
+  const maxValue = Math.max(1, ...monthlyData.map((d) => Math.max(d.production, d.consumption)));
+
   return (
     <DashboardLayout>
       <div className="space-y-8" data-testid="analytics-page">
@@ -53,11 +101,19 @@ export const Analytics = () => {
               <div className="space-y-2">
                 <p className="text-sm font-medium text-muted-foreground">{metric.label}</p>
                 <p className="text-2xl font-heading font-bold text-foreground">{metric.value}</p>
-                <div className="flex items-center gap-1 text-sm">
-                  <TrendingUp className="h-4 w-4 text-accent" />
-                  <span className="text-accent font-medium">{metric.change}</span>
-                  <span className="text-muted-foreground">vs período anterior</span>
-                </div>
+                {metric.change !== null && (
+                  <div className="flex items-center gap-1 text-sm">
+                    {metric.change >= 0 ? (
+                      <TrendingUp className="h-4 w-4 text-accent" />
+                    ) : (
+                      <TrendingDown className="h-4 w-4 text-red-500" />
+                    )}
+                    <span className={metric.change >= 0 ? 'text-accent font-medium' : 'text-red-500 font-medium'}>
+                      {metric.change >= 0 ? '+' : ''}{formatNumber(metric.change, 1)}%
+                    </span>
+                    <span className="text-muted-foreground">vs período anterior</span>
+                  </div>
+                )}
               </div>
             </Card>
           ))}
@@ -75,8 +131,10 @@ export const Analytics = () => {
           
           {/* Gráfico */}
           <div className="space-y-4">
+            {monthlyData.length === 0 && (
+              <p className="text-sm text-muted-foreground">Aún no hay lecturas de paneles para este período</p>
+            )}
             {monthlyData.map((data) => {
-              const maxValue = 7000;
               const productionWidth = (data.production / maxValue) * 100;
               const consumptionWidth = (data.consumption / maxValue) * 100;
               
@@ -109,7 +167,7 @@ export const Analytics = () => {
                       </div>
                     </div>
                     <div className="text-right w-24">
-                      <span className="text-sm font-bold text-accent">+{data.savings} kWh</span>
+                      <span className="text-sm font-bold text-accent">{data.savings >= 0 ? '+' : ''}{data.savings} kWh</span>
                       <p className="text-xs text-muted-foreground">ahorrados</p>
                     </div>
                   </div>
@@ -146,7 +204,7 @@ export const Analytics = () => {
               </div>
               <div className="flex items-center justify-between py-3">
                 <span className="text-sm font-medium text-muted-foreground">Energía Limpia Generada</span>
-                <span className="text-lg font-bold text-foreground">32,100 kWh</span>
+                <span className="text-lg font-bold text-foreground">{formatNumber(totals.production)} kWh</span>
               </div>
             </div>
           </Card>
@@ -1,55 +1,134 @@
-import React from 'react';
+import React, { useState, useEffect } from 'react';
 import { DashboardLayout } from './DashboardLayout';
 import { Card } from '../ui/card';
-import { Zap, Battery, Sun, TrendingUp, TrendingDown } from 'lucide-react';
-
-const energySources = [
-  {
-    name: 'Panel Solar A',
-    current: 2450,
-    capacity: 3000,
-    percentage: 82,
-    status: 'activo',
-    trend: 'up',
-    change: '+5.2%',
-    icon: Sun,
-    color: 'text-yellow-500'
-  },
-  {
-    name: 'Panel Solar B',
-    current: 2382,
-    capacity: 3000,
-    percentage: 79,
-    status: 'activo',
-    trend: 'up',
-    change: '+3.8%',
-    icon: Sun,
-    color: 'text-yellow-500'
-  },
-  {
-    name: 'Almacenamiento de Batería',
-    current: 1700,
-    capacity: 2000,
-    percentage: 85,
-    status: 'cargando',
-    trend: 'up',
-    change: '+12.5%',
-    icon: Battery,
-    color: 'text-blue-600'
-  },
-];
-
-const realtimeData = [
-  { time: '00:00', production: 120 },
-  { time: '04:00', production: 80 },
-  { time: '08:00', production: 450 },
-  { time: '12:00', production: 680 },
-  { time: '16:00', production: 520 },
-  { time: '20:00', production: 290 },
-  { time: '23:59', production: 150 },
-];
+import { Zap, Sun, TrendingUp, TrendingDown } from 'lucide-react';
+import axios from 'axios';
+import { getAccessToken } from '../../context/AuthContext';
+
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+const API = `${BACKEND_URL}/api`;
+const WS_URL = `${BACKEND_URL.replace(/^http/, 'ws')}/api/ws/energy`;
+const TIMELINE_POINTS = 12;
+const MAX_SOURCES = 9;
+// Reconexión con espera exponencial tras un cierre del WebSocket
+const RECONNECT_BASE_MS = 1000;
+const RECONNECT_MAX_MS = 30000;
+// Código con el que el servidor cierra por token inválido o expirado
+const WS_POLICY_VIOLATION = 1008;
+
+const PANELS_PAGE_SIZE = 500;
+
+// Los nombres de todos los paneles del feed: se recorren las páginas con X-Next-Cursor
+const fetchAllPanels = async () => {
+  const allPanels = [];
+  let cursor = null;
+  do {
+    const response = await axios.get(`${API}/panels`, {
+      params: { limit: PANELS_PAGE_SIZE, ...(cursor && { cursor }) }
+    });
+    allPanels.push(...response.data);
+    cursor = response.headers['x-next-cursor'] || null;
+  } while (cursor);
+  return allPanels;
+};
+
+const sumProduction = (readings) => Object.values(readings).reduce((sum, p) => sum + p.production, 0);
 
 export const EnergyMonitoring = () => {
+  const [panels, setPanels] = useState({});
+  // Última lectura por panel y la del mensaje anterior (para calcular tendencias)
+  const [feed, setFeed] = useState({ current: {}, previous: {} });
+  const [timeline, setTimeline] = useState([]);
+
+  useEffect(() => {
+    fetchAllPanels()
+      .then((allPanels) => {
+        const byId = {};
+        allPanels.forEach((panel) => { byId[panel.id] = panel; });
+        setPanels(byId);
+      })
+      .catch(() => {});
+  }, []);
+
+  useEffect(() => {
+    let socket = null;
+    let reconnectTimer = null;
+    let attempts = 0;
+    let stopped = false;
+
+    const scheduleReconnect = (forceRefresh) => {
+      const delay = Math.min(RECONNECT_MAX_MS, RECONNECT_BASE_MS * 2 ** attempts);
+      attempts += 1;
+      reconnectTimer = setTimeout(() => connect(forceRefresh), delay);
+    };
+
+    const connect = async (forceRefresh = false) => {
+      let token;
+      try {
+        // El token de acceso dura poco: se renueva antes de conectar si hace falta
+        token = await getAccessToken({ forceRefresh });
+      } catch (error) {
+        // Sin sesión renovable: no se reintenta (la próxima petición a la API cierra la sesión)
+        return;
+      }
+      if (stopped) return;
+
+      socket = new WebSocket(`${WS_URL}?token=${encodeURIComponent(token)}`);
+      socket.onopen = () => { attempts = 0; };
+      socket.onmessage = (event) => {
+        const message = JSON.parse(event.data);
+        if (message.type !== 'energy_update') return;
+        setFeed((prev) => {
+          const next = { ...prev.current };
+          message.panels.forEach((update) => { next[update.panel_id] = update; });
+          return { current: next, previous: prev.current };
+        });
+      };
+      socket.onclose = (event) => {
+        if (stopped) return;
+        scheduleReconnect(event.code === WS_POLICY_VIOLATION);
+      };
+    };
+
+    connect();
+    return () => {
+      stopped = true;
+      clearTimeout(reconnectTimer);
+      if (socket) socket.close();
+    };
+  }, []);
+
+  const live = feed.current;
+  const currentProduction = sumProduction(live);
+  const previousProduction = sumProduction(feed.previous);
+  const productionChange = previousProduction ? ((currentProduction - previousProduction) / previousProduction) * 100 : 0;
+
+  useEffect(() => {
+    if (Object.keys(live).length === 0) return;
+    const time = new Date().toLocaleTimeString('es-ES', { hour: '2-digit', minute: '2-digit', second: '2-digit' });
+    setTimeline((points) => [...points, { time, production: Math.round(sumProduction(live)) }].slice(-TIMELINE_POINTS));
+  }, [live]);
+
+  const energySources = Object.values(live).slice(0, MAX_SOURCES).map((update) => {
+    const panel = panels[update.panel_id];
+    const capacity = panel?.capacity || 0;
+    const previous = feed.previous[update.panel_id];
+    const change = previous && previous.production ? ((update.production - previous.production) / previous.production) * 100 : 0;
+    return {
+      id: update.panel_id,
+      name: panel ? `${panel.model} - ${panel.location}` : update.panel_id,
+      current: Math.round(update.production),
+      capacity,
+      percentage: capacity ? Math.min(100, (update.production / capacity) * 100) : 0,
+      status: panel?.status || 'activo',
+      trend: change >= 0 ? 'up' : 'down',
+      change: `${change >= 0 ? '+' : ''}${change.toFixed(1)}%`,
+      icon: Sun,
+      color: 'text-yellow-500'
+    };
+  });
+  const maxTimeline = Math.max(1, ...timeline.map((d) => d.production));
+
   return (
     <DashboardLayout>
       <div className="space-y-8" data-testid="energy-monitoring-page">
@@ -68,10 +147,18 @@ export const EnergyMonitoring = () => {
           <div className="flex items-center justify-between">
             <div>
               <p className="text-sm font-medium text-muted-foreground mb-2">Producción Actual</p>
-              <p className="text-4xl font-heading font-bold text-foreground mb-1">6,532 kWh</p>
+              <p className="text-4xl font-heading font-bold text-foreground mb-1">
+                {currentProduction.toLocaleString('es-ES', { maximumFractionDigits: 0 })} kWh
+              </p>
               <div className="flex items-center gap-2 text-sm">
-                <TrendingUp className="h-4 w-4 text-accent" />
-                <span className="text-accent font-medium">+8.3% desde ayer</span>
+                {productionChange >= 0 ? (
+                  <TrendingUp className="h-4 w-4 text-accent" />
+                ) : (
+                  <TrendingDown className="h-4 w-4 text-red-500" />
+                )}
+                <span className={productionChange >= 0 ? 'text-accent font-medium' : 'text-red-500 font-medium'}>
+                  {productionChange >= 0 ? '+' : ''}{productionChange.toFixed(1)}% desde la última actualización
+                </span>
               </div>
             </div>
             <div className="p-4 rounded-full bg-primary/10">
@@ -83,9 +170,12 @@ export const EnergyMonitoring = () => {
         {/* Cuadrícula de Fuentes de Energía */}
         <div>
           <h2 className="text-xl font-heading font-semibold mb-4">Fuentes de Energía</h2>
+          {energySources.length === 0 && (
+            <p className="text-sm text-muted-foreground">Esperando lecturas en tiempo real de los paneles...</p>
+          )}
           <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-6">
             {energySources.map((source) => (
-              <Card key={source.name} className="p-6 hover:shadow-md transition-shadow duration-200">
+              <Card key={source.id} className="p-6 hover:shadow-md transition-shadow duration-200">
                 <div className="flex items-start justify-between mb-4">
                   <div className={`p-3 rounded-lg bg-muted/50 ${source.color}`}>
                     <source.icon className="h-6 w-6" />
@@ -137,15 +227,15 @@ export const EnergyMonitoring = () => {
 
         {/* Gráfico en Tiempo Real */}
         <Card className="p-6">
-          <h2 className="text-xl font-heading font-semibold mb-6">Línea de Tiempo de Producción (Hoy)</h2>
+          <h2 className="text-xl font-heading font-semibold mb-6">Línea de Tiempo de Producción (En Vivo)</h2>
           <div className="space-y-4">
-            {realtimeData.map((data, index) => (
+            {timeline.map((data) => (
               <div key={data.time} className="flex items-center gap-4">
                 <span className="text-sm font-medium text-muted-foreground w-16">{data.time}</span>
                 <div className="flex-1 bg-muted rounded-full h-8 relative overflow-hidden">
                   <div 
                     className="bg-gradient-to-r from-primary to-accent h-8 rounded-full flex items-center justify-end pr-3 transition-all duration-500"
-                    style={{ width: `${(data.production / 700) * 100}%` }}
+                    style={{ width: `${(data.production / maxTimeline) * 100}%` }}
                   >
                     <span className="text-xs font-medium text-white">{data.production} kWh</span>
                   </div>
@@ -20,6 +20,22 @@ import { toast } from 'sonner';
 import axios from 'axios';
 
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
+const PAGE_SIZE = 100;
+const USERS_PAGE_SIZE = 500;
+
+// El selector de asignación necesita todos los usuarios: se recorren las páginas con X-Next-Cursor
+const fetchAllUsers = async () => {
+  const allUsers = [];
+  let cursor = null;
+  do {
+    const response = await axios.get(`${API}/users`, {
+      params: { limit: USERS_PAGE_SIZE, ...(cursor && { cursor }) }
+    });
+    allUsers.push(...response.data);
+    cursor = response.headers['x-next-cursor'] || null;
+  } while (cursor);
+  return allUsers;
+};
 
 export const PanelManagement = () => {
   const [panels, setPanels] = useState([]);
@@ -30,6 +46,8 @@ export const PanelManagement = () => {
   const [showCreateForm, setShowCreateForm] = useState(false);
   const [editingPanel, setEditingPanel] = useState(null);
   const [assigningPanel, setAssigningPanel] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   
   const [formData, setFormData] = useState({
     model: '',
@@ -39,12 +57,13 @@ export const PanelManagement = () => {
 
   const fetchData = useCallback(async () => {
     try {
-      const [panelsRes, usersRes] = await Promise.all([
-        axios.get(`${API}/panels`),
-        axios.get(`${API}/users`)
+      const [panelsRes, allUsers] = await Promise.all([
+        axios.get(`${API}/panels`, { params: { limit: PAGE_SIZE } }),
+        fetchAllUsers()
       ]);
       setPanels(panelsRes.data);
-      setUsers(usersRes.data);
+      setNextCursor(panelsRes.headers['x-next-cursor'] || null);
+      setUsers(allUsers);
     } catch (error) {
       toast.error('Error al cargar datos');
     } finally {
@@ -52,6 +71,22 @@ export const PanelManagement = () => {
     }
   }, []);
 
+  const loadMorePanels = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      const response = await axios.get(`${API}/panels`, {
+        params: { limit: PAGE_SIZE, cursor: nextCursor }
+      });
+      setPanels((prev) => [...prev, ...response.data]);
+      setNextCursor(response.headers['x-next-cursor'] || null);
+    } catch (error) {
+      toast.error('Error al cargar más paneles');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   useEffect(() => {
     fetchData();
   }, [fetchData]);
@@ -526,6 +561,18 @@ export const PanelManagement = () => {
               </table>
             </div>
           )}
+          {nextCursor && !loading && (
+            <div className="p-4 text-center border-t border-border">
+              <Button
+                variant="outline"
+                onClick={loadMorePanels}
+                disabled={loadingMore}
+                data-testid="load-more-panels"
+              >
+                {loadingMore ? 'Cargando...' : 'Cargar más paneles'}
+              </Button>
+            </div>
+          )}
         </Card>
       </div>
     </DashboardLayout>
@@ -17,17 +17,21 @@ import { toast } from 'sonner';
 import axios from 'axios';
 
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
+const PAGE_SIZE = 100;
 
 export const UserManagement = () => {
   const [users, setUsers] = useState([]);
   const [loading, setLoading] = useState(true);
   const [searchTerm, setSearchTerm] = useState('');
   const [processingUser, setProcessingUser] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   const fetchUsers = useCallback(async () => {
     try {
-      const response = await axios.get(`${API}/users`);
+      const response = await axios.get(`${API}/users`, { params: { limit: PAGE_SIZE } });
       setUsers(response.data);
+      setNextCursor(response.headers['x-next-cursor'] || null);
     } catch (error) {
       toast.error('Error al cargar usuarios');
     } finally {
@@ -35,6 +39,22 @@ export const UserManagement = () => {
     }
   }, []);
 
+  const loadMoreUsers = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      const response = await axios.get(`${API}/users`, {
+        params: { limit: PAGE_SIZE, cursor: nextCursor }
+      });
+      setUsers((prev) => [...prev, ...response.data]);
+      setNextCursor(response.headers['x-next-cursor'] || null);
+    } catch (error) {
+      toast.error('Error al cargar más usuarios');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   useEffect(() => {
     fetchUsers();
   }, [fetchUsers]);
@@ -242,6 +262,18 @@ export const UserManagement = () => {
               </table>
             </div>
           )}
+          {nextCursor && !loading && (
+            <div className="p-4 text-center border-t border-border">
+              <Button
+                variant="outline"
+                onClick={loadMoreUsers}
+                disabled={loadingMore}
+                data-testid="load-more-users"
+              >
+                {loadingMore ? 'Cargando...' : 'Cargar más usuarios'}
+              </Button>
+            </div>
+          )}
         </Card>
       </div>
     </DashboardLayout>
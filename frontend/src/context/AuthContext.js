@@ -6,11 +6,98 @@ const AuthContext = createContext(null);
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// Rutas de autenticación que no deben disparar una renovación del token
+const AUTH_PATHS = ['/auth/login', '/auth/register', '/auth/refresh', '/auth/logout'];
+
+// Una sola renovación en curso, compartida por las peticiones que reciben 401 a la vez
+let refreshPromise = null;
+
+const saveSession = ({ access_token, refresh_token }) => {
+  localStorage.setItem('token', access_token);
+  if (refresh_token) {
+    localStorage.setItem('refreshToken', refresh_token);
+  }
+  axios.defaults.headers.common['Authorization'] = `Bearer ${access_token}`;
+};
+
+const clearSession = () => {
+  localStorage.removeItem('token');
+  localStorage.removeItem('refreshToken');
+  delete axios.defaults.headers.common['Authorization'];
+};
+
+const refreshAccessToken = () => {
+  if (!refreshPromise) {
+    // Se lee en cada intento: otra pestaña puede haber rotado el token
+    const refreshToken = localStorage.getItem('refreshToken');
+    refreshPromise = (refreshToken
+      ? axios.post(`${API}/auth/refresh`, { refresh_token: refreshToken }).then((response) => {
+          saveSession(response.data);
+          return response.data.access_token;
+        })
+      : Promise.reject(new Error('Sin token de actualización'))
+    ).finally(() => {
+      refreshPromise = null;
+    });
+  }
+  return refreshPromise;
+};
+
+// Margen para renovar antes de que el token expire durante la petición
+const TOKEN_EXPIRY_MARGIN_MS = 30 * 1000;
+
+const tokenExpiresAt = (accessToken) => {
+  try {
+    const payload = JSON.parse(atob(accessToken.split('.')[1].replace(/-/g, '+').replace(/_/g, '/')));
+    return payload.exp * 1000;
+  } catch (error) {
+    return 0;
+  }
+};
+
+/**
+ * Token de acceso vigente para usos fuera de axios (p. ej. el WebSocket).
+ * Con `forceRefresh` se renueva aunque parezca vigente (el servidor lo rechazó).
+ */
+export const getAccessToken = async ({ forceRefresh = false } = {}) => {
+  const accessToken = localStorage.getItem('token');
+  if (!forceRefresh && accessToken && tokenExpiresAt(accessToken) - TOKEN_EXPIRY_MARGIN_MS > Date.now()) {
+    return accessToken;
+  }
+  return refreshAccessToken();
+};
+
 export const AuthProvider = ({ children }) => {
   const [user, setUser] = useState(null);
   const [loading, setLoading] = useState(true);
   const [token, setToken] = useState(localStorage.getItem('token'));
 
+  useEffect(() => {
+    // Token de acceso expirado: renovar una vez y repetir la petición original
+    const interceptor = axios.interceptors.response.use(
+      (response) => response,
+      async (error) => {
+        const original = error.config;
+        const isAuthPath = original && AUTH_PATHS.some((path) => original.url?.endsWith(path));
+        if (error.response?.status !== 401 || !original || original._retried || isAuthPath) {
+          return Promise.reject(error);
+        }
+        original._retried = true;
+        try {
+          const accessToken = await refreshAccessToken();
+          original.headers['Authorization'] = `Bearer ${accessToken}`;
+          return axios(original);
+        } catch (refreshError) {
+          clearSession();
+          setToken(null);
+          setUser(null);
+          return Promise.reject(error);
+        }
+      }
+    );
+    return () => axios.interceptors.response.eject(interceptor);
+  }, []);
+
   useEffect(() => {
     const initAuth = async () => {
       if (token) {
@@ -20,7 +107,7 @@ export const AuthProvider = ({ children }) => {
         setLoading(false);
       }
     };
-    
+
     initAuth();
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [token]);
@@ -40,12 +127,11 @@ export const AuthProvider = ({ children }) => {
   const login = async (email, password) => {
     const response = await axios.post(`${API}/auth/login`, { email, password });
     const { access_token, user } = response.data;
-    
-    localStorage.setItem('token', access_token);
+
+    saveSession(response.data);
     setToken(access_token);
     setUser(user);
-    axios.defaults.headers.common['Authorization'] = `Bearer ${access_token}`;
-    
+
     return user;
   };
 
@@ -56,20 +142,23 @@ export const AuthProvider = ({ children }) => {
       full_name
     });
     const { access_token, user } = response.data;
-    
-    localStorage.setItem('token', access_token);
+
+    saveSession(response.data);
     setToken(access_token);
     setUser(user);
-    axios.defaults.headers.common['Authorization'] = `Bearer ${access_token}`;
-    
+
     return user;
   };
 
   const logout = () => {
-    localStorage.removeItem('token');
+    const refreshToken = localStorage.getItem('refreshToken');
+    if (refreshToken) {
+      // Revocar la sesión en el servidor sin esperar la respuesta
+      axios.post(`${API}/auth/logout`, { refresh_token: refreshToken }).catch(() => {});
+    }
+    clearSession();
     setToken(null);
     setUser(null);
-    delete axios.defaults.headers.common['Authorization'];
   };
 
   return (
@@ -85,4 +174,4 @@ export const useAuth = () => {
     throw new Error('useAuth debe usarse dentro de un AuthProvider');
   }
   return context;
-};
\ No newline at end of file
+};
@@ -6,6 +6,7 @@ Tests for: Authentication, User Management (Admin), Panel Management (Admin), Ro
 import pytest
 import requests
 import os
+import time
 import uuid
 from datetime import datetime
 
@@ -17,6 +18,36 @@ ADMIN_CREDENTIALS = {"email": "admin@effitech.com", "password": "admin123"}
 USER_CREDENTIALS = {"email": "usuario@effitech.com", "password": "user123"}
 
 
+def login(credentials):
+    """Log in and return the token response, skipping the test if login fails"""
+    response = requests.post(f"{API_URL}/auth/login", json=credentials)
+    if response.status_code != 200:
+        pytest.skip(f"Login failed for {credentials['email']}")
+    return response.json()
+
+
+def wait_for(fetch, condition, timeout=10.0, interval=0.5):
+    """Poll fetch() until condition(result) holds; background writes are not immediate"""
+    deadline = time.monotonic() + timeout
+    result = fetch()
+    while not condition(result) and time.monotonic() < deadline:
+        time.sleep(interval)
+        result = fetch()
+    return result
+
+
+@pytest.fixture
+def admin_token():
+    """Get admin authentication token"""
+    return login(ADMIN_CREDENTIALS)["access_token"]
+
+
+@pytest.fixture
+def user_token():
+    """Get regular user authentication token"""
+    return login(USER_CREDENTIALS)["access_token"]
+
+
 class TestHealthAndBasics:
     """Basic API health and root endpoint tests"""
     
@@ -37,6 +68,30 @@ class TestHealthAndBasics:
         assert "EFFITECH" in data.get("message", "")
         print(f"✓ Root endpoint: {data}")
 
+    def test_metrics_endpoint(self):
+        """Test Prometheus metrics exposition"""
+        requests.get(f"{API_URL}/health")
+        response = requests.get(f"{API_URL}/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert 'http_request_duration_seconds_count{method="GET",route="/api/health"}' in response.text
+        print("✓ Metrics endpoint exposes per-route latency")
+
+    def test_liveness_and_readiness_probes(self):
+        """Test liveness and readiness probes"""
+        live = requests.get(f"{API_URL}/health/live")
+        assert live.status_code == 200
+        assert live.json()["status"] == "alive"
+
+        ready = requests.get(f"{API_URL}/health/ready")
+        assert ready.status_code == 200
+        data = ready.json()
+        assert data["status"] == "ready"
+        assert data["database"]["ok"] is True
+        assert "utilization" in data["pool"]
+        assert "buffered" in data["ingestion"]
+        print(f"✓ Readiness: {data}")
+
 
 class TestAuthentication:
     """Authentication flow tests - Login and Register"""
@@ -69,6 +124,18 @@ class TestAuthentication:
         })
         assert response.status_code == 401
         print("✓ Invalid login correctly rejected with 401")
+
+    def test_login_rate_limited_per_email(self):
+        """Test that repeated failed logins for one email are answered with 429"""
+        credentials = {"email": f"TEST_ratelimit_{uuid.uuid4().hex[:8]}@effitech.com", "password": "wrongpassword"}
+        statuses = [requests.post(f"{API_URL}/auth/login", json=credentials).status_code for _ in range(15)]
+        assert 401 in statuses
+        assert statuses[-1] == 429
+
+        response = requests.post(f"{API_URL}/auth/login", json=credentials)
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) >= 1
+        print(f"✓ Failed logins throttled after {statuses.index(429)} attempts (Retry-After: {response.headers['Retry-After']}s)")
     
     def test_get_current_user_admin(self):
         """Test getting current user info for admin"""
@@ -100,6 +167,39 @@ class TestAuthentication:
         assert data["role"] == "user"
         print(f"✓ Regular user info retrieved: {data['full_name']}")
 
+    def test_refresh_token_rotation(self):
+        """Test refresh rotation, reuse detection and logout"""
+        login_response = requests.post(f"{API_URL}/auth/login", json=USER_CREDENTIALS)
+        first_refresh = login_response.json()["refresh_token"]
+
+        response = requests.post(f"{API_URL}/auth/refresh", json={"refresh_token": first_refresh})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["refresh_token"] != first_refresh
+        headers = {"Authorization": f"Bearer {data['access_token']}"}
+        assert requests.get(f"{API_URL}/auth/me", headers=headers).status_code == 200
+
+        # A concurrent refresh with the same token (another tab) gets the same successor
+        response = requests.post(f"{API_URL}/auth/refresh", json={"refresh_token": first_refresh})
+        assert response.status_code == 200
+        assert response.json()["refresh_token"] == data["refresh_token"]
+
+        # Once the successor is used, reusing a rotated token revokes the whole session
+        response = requests.post(f"{API_URL}/auth/refresh", json={"refresh_token": data["refresh_token"]})
+        assert response.status_code == 200
+        latest_refresh = response.json()["refresh_token"]
+        response = requests.post(f"{API_URL}/auth/refresh", json={"refresh_token": first_refresh})
+        assert response.status_code == 401
+        response = requests.post(f"{API_URL}/auth/refresh", json={"refresh_token": latest_refresh})
+        assert response.status_code == 401
+
+        login_response = requests.post(f"{API_URL}/auth/login", json=USER_CREDENTIALS)
+        refresh_token = login_response.json()["refresh_token"]
+        requests.post(f"{API_URL}/auth/logout", json={"refresh_token": refresh_token})
+        response = requests.post(f"{API_URL}/auth/refresh", json={"refresh_token": refresh_token})
+        assert response.status_code == 401
+        print("✓ Refresh tokens rotate, reuse revokes the session and logout invalidates them")
+
 
 class TestUserManagementAdmin:
     """User management tests - Admin only endpoints"""
@@ -151,6 +251,27 @@ class TestUserManagementAdmin:
         assert response.status_code in [401, 403]
         print(f"✓ Unauthenticated request correctly rejected ({response.status_code})")
 
+    def test_user_cache_stats(self, admin_token):
+        """Test that repeated authenticated calls are served from the user cache"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        for _ in range(3):
+            requests.get(f"{API_URL}/auth/me", headers=headers)
+        response = requests.get(f"{API_URL}/cache/stats", headers=headers)
+        assert response.status_code == 200
+        stats = response.json()["user_cache"]
+        assert stats["hits"] >= 1
+        print(f"✓ User cache stats: {stats}")
+
+    def test_password_hasher_stats(self, admin_token):
+        """Test that the hashing pool reports the configured bcrypt cost"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        response = requests.get(f"{API_URL}/security/hasher/stats", headers=headers)
+        assert response.status_code == 200
+        stats = response.json()["password_hasher"]
+        assert 4 <= stats["bcrypt_rounds"] <= 31
+        assert stats["completed"] >= 1
+        print(f"✓ Password hasher stats: {stats}")
+
 
 class TestPanelManagementAdmin:
     """Panel management tests - Admin CRUD operations"""
@@ -236,7 +357,111 @@ class TestPanelManagementAdmin:
         for panel in panels:
             assert panel["user_id"] == user_id, f"Panel {panel['id']} not assigned to user"
         print(f"✓ All {len(panels)} panels correctly belong to the user")
-    
+
+    def test_list_panels_paginated(self, admin_token):
+        """Test keyset pagination with limit and X-Next-Cursor"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        created = []
+        for i in range(3):
+            panel_data = {"model": f"TEST_Page_{uuid.uuid4().hex[:8]}", "location": "Pagination Test", "capacity": 100.0}
+            created.append(requests.post(f"{API_URL}/panels", json=panel_data, headers=headers).json()["id"])
+
+        seen = []
+        params = {"limit": 2, "location": "Pagination Test"}
+        while True:
+            response = requests.get(f"{API_URL}/panels", params=params, headers=headers)
+            assert response.status_code == 200
+            page = response.json()
+            assert len(page) <= 2
+            seen.extend(p["id"] for p in page)
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+            params["cursor"] = cursor
+
+        assert set(created) <= set(seen)
+        assert len(seen) == len(set(seen)), "Pages must not overlap"
+        print(f"✓ Paginated {len(seen)} panels without duplicates")
+
+        for panel_id in created:
+            requests.delete(f"{API_URL}/panels/{panel_id}", headers=headers)
+
+    def test_list_panels_etag(self, admin_token):
+        """Test conditional listing with ETag/If-None-Match"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        response = requests.get(f"{API_URL}/panels", headers=headers)
+        assert response.status_code == 200
+        etag = response.headers["ETag"]
+        assert etag.startswith('W/"')
+
+        response = requests.get(f"{API_URL}/panels", headers={**headers, "If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+
+        # Any write changes the collection version
+        created = requests.post(f"{API_URL}/panels", json={
+            "model": "TEST_ETag", "location": "TEST_Location", "capacity": 1000
+        }, headers=headers)
+        assert created.status_code == 200
+        response = requests.get(f"{API_URL}/panels", headers={**headers, "If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+        requests.delete(f"{API_URL}/panels/{created.json()['id']}", headers=headers)
+        print("✓ Panel listing answers 304 until the collection changes")
+
+    def test_list_panels_invalid_cursor(self, admin_token):
+        """Test that a malformed cursor is rejected"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        response = requests.get(f"{API_URL}/panels", params={"cursor": "not-a-cursor"}, headers=headers)
+        assert response.status_code == 400
+        print("✓ Invalid cursor correctly rejected (400)")
+
+    def test_list_panels_created_range(self, admin_token):
+        """Test created_at range filter on native dates"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        panel_data = {"model": f"TEST_Range_{uuid.uuid4().hex[:8]}", "location": "Range Test", "capacity": 100.0}
+        panel = requests.post(f"{API_URL}/panels", json=panel_data, headers=headers).json()
+        created_at = datetime.fromisoformat(panel["created_at"].replace("Z", "+00:00"))
+        assert created_at.tzinfo is not None
+
+        inside = requests.get(f"{API_URL}/panels", params={"location": "Range Test", "created_from": panel["created_at"]}, headers=headers)
+        assert panel["id"] in [p["id"] for p in inside.json()]
+        outside = requests.get(f"{API_URL}/panels", params={"location": "Range Test", "created_to": "2000-01-01T00:00:00Z"}, headers=headers)
+        assert panel["id"] not in [p["id"] for p in outside.json()]
+        print("✓ created_at range filter works")
+
+        requests.delete(f"{API_URL}/panels/{panel['id']}", headers=headers)
+
+    def test_bulk_import_and_export_panels(self, admin_token):
+        """Test NDJSON bulk import with per-row errors and CSV export"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        location = f"Bulk Test {uuid.uuid4().hex[:8]}"
+        body = "\n".join([
+            f'{{"model": "TEST_Bulk_1", "location": "{location}", "capacity": 100}}',
+            f'{{"model": "TEST_Bulk_2", "location": "{location}", "capacity": -5}}',
+            f'{{"model": "TEST_Bulk_3", "location": "{location}", "capacity": 50}}'
+        ])
+        response = requests.post(
+            f"{API_URL}/panels/bulk",
+            data=body.encode(),
+            headers={**headers, "Content-Type": "application/x-ndjson"}
+        )
+        assert response.status_code == 200
+        result = response.json()
+        assert result["inserted"] == 2
+        assert result["failed"] == 1
+        assert result["errors"][0]["row"] == 2
+
+        export = requests.get(f"{API_URL}/panels/export", params={"format": "csv", "location": location}, headers=headers)
+        assert export.status_code == 200
+        lines = export.text.strip().splitlines()
+        assert lines[0].startswith("id,model,location,capacity")
+        assert len(lines) == 3
+        print("✓ Bulk import and CSV export work")
+
+        for line in lines[1:]:
+            requests.delete(f"{API_URL}/panels/{line.split(',')[0]}", headers=headers)
+
     def test_update_panel_as_admin(self, admin_token):
         """Test updating a panel as admin"""
         headers = {"Authorization": f"Bearer {admin_token}"}
@@ -362,9 +587,66 @@ class TestPanelAssignment:
         assert data["user_id"] is None
         assert data["user_name"] is None
         print("✓ Panel unassigned successfully")
-        
+
         # Cleanup
         requests.delete(f"{API_URL}/panels/{panel_id}", headers=headers)
+
+    def test_rename_updates_assigned_panels(self, admin_token, user_token, user_info):
+        """Test that renaming a user through PUT /auth/me updates user_name on their panels"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        user_headers = {"Authorization": f"Bearer {user_token}"}
+        panel_data = {
+            "model": f"TEST_Rename_Panel_{uuid.uuid4().hex[:8]}",
+            "location": "Rename Test",
+            "capacity": 300.0
+        }
+        panel_id = requests.post(f"{API_URL}/panels", json=panel_data, headers=headers).json()["id"]
+        requests.post(f"{API_URL}/panels/{panel_id}/assign/{user_info['id']}", headers=headers)
+
+        new_name = f"TEST Renamed {uuid.uuid4().hex[:6]}"
+        try:
+            response = requests.put(f"{API_URL}/auth/me", json={"full_name": new_name}, headers=user_headers)
+            assert response.status_code == 200
+            assert response.json()["full_name"] == new_name
+
+            # El nombre se propaga a los paneles en segundo plano
+            panel = wait_for(
+                lambda: requests.get(f"{API_URL}/panels/{panel_id}", headers=headers).json(),
+                lambda p: p.get("user_name") == new_name
+            )
+            assert panel["user_name"] == new_name
+            print("✓ Renamed user propagated to assigned panels")
+        finally:
+            requests.put(f"{API_URL}/auth/me", json={"full_name": user_info["full_name"]}, headers=user_headers)
+            requests.delete(f"{API_URL}/panels/{panel_id}", headers=headers)
+
+    def test_bulk_assign_panels(self, admin_token, user_info):
+        """Test assigning several panels in one bulk operation"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+
+        panel_ids = []
+        for i in range(3):
+            panel_data = {"model": f"TEST_Bulk_Assign_{uuid.uuid4().hex[:8]}", "location": "Bulk Assign Test", "capacity": 100.0}
+            panel_ids.append(requests.post(f"{API_URL}/panels", json=panel_data, headers=headers).json()["id"])
+
+        missing_id = str(uuid.uuid4())
+        response = requests.post(
+            f"{API_URL}/panels/bulk/update",
+            json={"action": "assign", "panel_ids": panel_ids + [missing_id], "user_id": user_info["id"]},
+            headers=headers
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["matched"] == 3
+        assert data["not_found"] == [missing_id]
+
+        panel = requests.get(f"{API_URL}/panels/{panel_ids[0]}", headers=headers).json()
+        assert panel["user_id"] == user_info["id"]
+        print(f"✓ Bulk assigned {data['modified']} panels")
+
+        # Cleanup
+        for panel_id in panel_ids:
+            requests.delete(f"{API_URL}/panels/{panel_id}", headers=headers)
     
     def test_assign_panel_to_nonexistent_user(self, admin_token):
         """Test assigning panel to non-existent user"""
@@ -428,6 +710,211 @@ class TestRoleManagement:
         assert response.status_code == 400
         print("✓ Admin correctly prevented from deleting self (400)")
 
+    def test_role_change_and_delete_revoke_tokens(self, admin_token):
+        """Test that tokens issued before a role change or deletion are rejected"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        credentials = {"email": f"TEST_revoke_{uuid.uuid4().hex[:8]}@effitech.com", "password": "revoke123"}
+
+        register = requests.post(f"{API_URL}/auth/register", json={**credentials, "full_name": "TEST Revoke"})
+        assert register.status_code == 200
+        user_id = register.json()["user"]["id"]
+        old_headers = {"Authorization": f"Bearer {register.json()['access_token']}"}
+        assert requests.get(f"{API_URL}/panels", headers=old_headers).status_code == 200
+
+        response = requests.put(f"{API_URL}/users/{user_id}/role", json={"role": "admin"}, headers=headers)
+        assert response.status_code == 200
+        assert requests.get(f"{API_URL}/panels", headers=old_headers).status_code == 401
+
+        login = requests.post(f"{API_URL}/auth/login", json=credentials)
+        new_headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        assert requests.get(f"{API_URL}/users", headers=new_headers).status_code == 200
+
+        response = requests.delete(f"{API_URL}/users/{user_id}", headers=headers)
+        assert response.status_code == 200
+        assert requests.get(f"{API_URL}/panels", headers=new_headers).status_code == 401
+        print("✓ Role change and deletion revoke previously issued tokens")
+
+
+class TestExternalIngestion:
+    """Telemetry ingestion from the external app"""
+
+    API_KEY = os.environ.get('EXTERNAL_APP_API_KEY')
+
+    @pytest.fixture(autouse=True)
+    def require_api_key(self):
+        """Skip ingestion tests when the deployment's API key is not available"""
+        if not self.API_KEY:
+            pytest.skip("EXTERNAL_APP_API_KEY not set - skipping ingestion tests")
+
+    def test_ingest_single_reading(self):
+        """Test sending a single reading"""
+        reading = {
+            "panel_id": f"TEST_{uuid.uuid4().hex[:8]}",
+            "production": 2450.5,
+            "temperature": 35.2,
+            "timestamp": "2025-01-18T15:30:00Z"
+        }
+        response = requests.post(f"{API_URL}/external/panel-data", params={"api_key": self.API_KEY}, json=reading)
+        assert response.status_code == 200
+        assert response.json()["accepted"] == 1
+        print("✓ Single reading accepted")
+
+    def test_ingest_batch(self):
+        """Test sending an array of readings"""
+        panel_id = f"TEST_{uuid.uuid4().hex[:8]}"
+        readings = [{"panel_id": panel_id, "production": float(i)} for i in range(100)]
+        response = requests.post(f"{API_URL}/external/panel-data", params={"api_key": self.API_KEY}, json=readings)
+        assert response.status_code == 200
+        assert response.json()["accepted"] == 100
+        print("✓ Batch of 100 readings accepted")
+
+    def test_ingested_readings_appear_in_rollups(self, admin_token):
+        """Test that ingested readings are aggregated into production buckets"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        panel_data = {
+            "model": f"TEST_Rollup_Panel_{uuid.uuid4().hex[:8]}",
+            "location": "Rollup Test",
+            "capacity": 500.0
+        }
+        panel_id = requests.post(f"{API_URL}/panels", json=panel_data, headers=headers).json()["id"]
+        readings = [
+            {"panel_id": panel_id, "production": 10.0, "temperature": 30.0, "timestamp": "2025-01-18T15:05:00Z"},
+            {"panel_id": panel_id, "production": 20.0, "temperature": 40.0, "timestamp": "2025-01-18T15:35:00Z"},
+            {"panel_id": panel_id, "production": 30.0, "temperature": 35.0, "timestamp": "2025-01-18T16:10:00Z"},
+        ]
+        try:
+            response = requests.post(f"{API_URL}/external/panel-data", params={"api_key": self.API_KEY}, json=readings)
+            assert response.status_code == 200
+
+            # Las lecturas se agregan al vaciar el buffer de ingesta
+            points = wait_for(
+                lambda: requests.get(
+                    f"{API_URL}/panels/{panel_id}/production", params={"granularity": "1h"}, headers=headers
+                ).json(),
+                lambda p: sum(point["count"] for point in p) == len(readings)
+            )
+            buckets = {point["bucket"][:13]: point for point in points}
+            assert set(buckets) == {"2025-01-18T15", "2025-01-18T16"}
+            first_hour = buckets["2025-01-18T15"]
+            assert first_hour["count"] == 2
+            assert first_hour["production_sum"] == pytest.approx(30.0)
+            assert first_hour["production_max"] == pytest.approx(20.0)
+            assert first_hour["temperature_max"] == pytest.approx(40.0)
+            assert buckets["2025-01-18T16"]["production_sum"] == pytest.approx(30.0)
+            print(f"✓ Readings aggregated into {len(points)} hourly buckets")
+        finally:
+            requests.delete(f"{API_URL}/panels/{panel_id}", headers=headers)
+
+    def test_ingest_invalid_api_key(self):
+        """Test that an invalid API key is rejected"""
+        reading = {"panel_id": "x", "production": 1.0}
+        response = requests.post(f"{API_URL}/external/panel-data", params={"api_key": "wrong"}, json=reading)
+        assert response.status_code == 401
+        print("✓ Invalid API key correctly rejected (401)")
+
+
+class TestAnalytics:
+    """Analytics summary backed by materialized aggregates"""
+
+    def test_analytics_summary_monthly(self, admin_token):
+        """Test monthly analytics summary structure"""
+        headers = {"Authorization": f"Bearer {admin_token}"}
+        response = requests.get(f"{API_URL}/analytics/summary", params={"granularity": "month"}, headers=headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["granularity"] == "month"
+        assert isinstance(data["periods"], list)
+        for key in ("production", "consumption", "savings", "efficiency"):
+            assert key in data["totals"]
+        print(f"✓ Analytics summary: {len(data['periods'])} periods")
+
+    def test_analytics_summary_requires_auth(self):
+        """Test that analytics require authentication"""
+        response = requests.get(f"{API_URL}/analytics/summary")
+        assert response.status_code in [401, 403]
+        print(f"✓ Unauthenticated analytics request rejected ({response.status_code})")
+
+
+class TestAlerts:
+    """Alert configuration and listing"""
+
+    def test_configure_alert(self, user_token):
+        """Test saving an alert threshold"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        config = {"alert_type": "high_temperature", "threshold_value": 50, "enabled": True}
+        response = requests.post(f"{API_URL}/alerts/config", json=config, headers=headers)
+        assert response.status_code == 200
+        assert response.json()["alert_type"] == "high_temperature"
+        print("✓ Alert configured")
+
+    def test_configure_invalid_alert_type(self, user_token):
+        """Test that unknown alert types are rejected"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        config = {"alert_type": "unknown", "threshold_value": 1}
+        response = requests.post(f"{API_URL}/alerts/config", json=config, headers=headers)
+        assert response.status_code == 422
+        print("✓ Invalid alert type rejected (422)")
+
+    def test_list_alerts(self, user_token):
+        """Test listing the user's alerts"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        response = requests.get(f"{API_URL}/alerts", headers=headers)
+        assert response.status_code == 200
+        assert isinstance(response.json(), list)
+        print(f"✓ Alerts listed: {len(response.json())}")
+
+
+class TestCO2:
+    """CO2 formula and calculation"""
+
+    def test_save_formula_and_calculate(self, user_token):
+        """Test saving a formula and calculating CO2 avoided"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        formula = {"formula_variables": {"kwh_factor": 0.6}}
+        response = requests.post(f"{API_URL}/co2/formula", json=formula, headers=headers)
+        assert response.status_code == 200
+
+        response = requests.get(f"{API_URL}/co2/calculate", headers=headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["co2_avoided_kg"] == pytest.approx(data["total_production_kwh"] * 0.6, rel=1e-3)
+        print(f"✓ CO2 calculated: {data}")
+
+    def test_reject_unsafe_expression(self, user_token):
+        """Test that expressions with calls or unknown names are rejected"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        formula = {"formula_variables": {}, "expression": "__import__('os')"}
+        response = requests.post(f"{API_URL}/co2/formula", json=formula, headers=headers)
+        assert response.status_code == 400
+        print("✓ Unsafe formula rejected (400)")
+
+    def test_oversized_expression_rejected(self, user_token):
+        """Test that overly long or deeply nested expressions are rejected instead of failing with 500"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        formula = {"formula_variables": {}, "expression": "total_kwh" + " + 1" * 1000}
+        response = requests.post(f"{API_URL}/co2/formula", json=formula, headers=headers)
+        assert response.status_code == 422
+
+        formula = {"formula_variables": {}, "expression": "-" * 400 + "total_kwh"}
+        response = requests.post(f"{API_URL}/co2/formula", json=formula, headers=headers)
+        assert response.status_code in [200, 400]
+        requests.post(f"{API_URL}/co2/formula", json={"formula_variables": {"kwh_factor": 0.4}}, headers=headers)
+        print("✓ Oversized formula rejected")
+
+    def test_overflowing_formula_rejected(self, user_token):
+        """Test that a formula whose result overflows is answered with 400, not null"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        formula = {"formula_variables": {"factor": 1e308}, "expression": "(total_kwh + 1) * factor * 1e308"}
+        response = requests.post(f"{API_URL}/co2/formula", json=formula, headers=headers)
+        assert response.status_code == 200
+
+        response = requests.get(f"{API_URL}/co2/calculate", headers=headers)
+        assert response.status_code == 400
+
+        # Restaurar una fórmula válida para el usuario de prueba
+        requests.post(f"{API_URL}/co2/formula", json={"formula_variables": {"kwh_factor": 0.4}}, headers=headers)
+        print("✓ Overflowing formula rejected (400)")
+
 
 class TestCleanup:
     """Cleanup test data created during tests"""